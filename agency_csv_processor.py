@@ -6,291 +6,302 @@ Handles various CSV formats from different ad platforms and automatically maps c
 import pandas as pd
 import logging
 import os
+import json
+import gzip
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from app import app, db
-from models import Campaign, CampaignData, User
-
-class AgencyCSVProcessor:
-    def __init__(self):
-        # Common column mappings for different platforms
-        self.column_mappings = {
-            # Facebook Ads Manager exports
-            'facebook': {
-                'client_email': ['client_email', 'account_email', 'advertiser_email'],
-                'campaign_name': ['campaign_name', 'Campaign Name', 'Campaign', 'campaign'],
-                'date': ['date', 'Date', 'reporting_starts', 'day'],
-                'impressions': ['impressions', 'Impressions', 'reach', 'Reach'],
-                'clicks': ['clicks', 'Clicks', 'link_clicks', 'Link Clicks'],
-                'spent': ['spend', 'Spend', 'amount_spent', 'Amount Spent (USD)', 'cost'],
-                'reach': ['reach', 'Reach', 'unique_reach'],
-                'budget': ['budget', 'Budget', 'lifetime_budget', 'daily_budget']
-            },
-            # Google Ads exports
-            'google': {
-                'client_email': ['client_email', 'customer_email', 'account_email'],
-                'campaign_name': ['campaign', 'Campaign', 'campaign_name'],
-                'date': ['date', 'Date', 'day', 'Day'],
-                'impressions': ['impressions', 'Impressions', 'impr'],
-                'clicks': ['clicks', 'Clicks'],
-                'spent': ['cost', 'Cost', 'spend', 'cost_micros'],
-                'reach': ['reach', 'unique_users'],
-                'budget': ['budget', 'Budget', 'average_daily_budget']
-            },
-            # ShareIT or other platforms
-            'shareit': {
-                'client_email': ['client_email', 'advertiser_email'],
-                'campaign_name': ['campaign_name', 'campaign'],
-                'date': ['date', 'report_date'],
-                'impressions': ['impressions', 'views'],
-                'clicks': ['clicks', 'taps'],
-                'spent': ['spend', 'cost'],
-                'reach': ['reach', 'unique_users'],
-                'budget': ['budget', 'campaign_budget']
-            }
-        }
-
-    def detect_platform(self, df):
-        """Detect which platform the CSV is from based on column names"""
-        columns = [col.lower() for col in df.columns]
-        
-        # Facebook indicators
-        if any(fb_col in columns for fb_col in ['amount_spent', 'link_clicks', 'campaign_name']):
-            return 'facebook'
-        
-        # Google Ads indicators
-        if any(g_col in columns for g_col in ['cost_micros', 'average_daily_budget', 'impr']):
-            return 'google'
-        
-        # Default to generic mapping
-        return 'shareit'
-
-    def find_column(self, df, field_name, platform):
-        """Find the actual column name for a field based on mappings"""
-        possible_names = self.column_mappings.get(platform, {}).get(field_name, [field_name])
-        
-        for col_name in possible_names:
-            # Case-insensitive search
-            for actual_col in df.columns:
-                if actual_col.lower() == col_name.lower():
-                    return actual_col
-        
-        return None
+from models import CSVImport
+import agency_parsing
+import bulk_ingest
+import chunked_import
+import csv_sniffer
+import event_stream
+import folder_watcher
+import frame_parsing
+import import_archive
+import schema_registry
+import upload_store
+
+# Processes used by the cron import to parse and pre-aggregate files in parallel
+AGENCY_IMPORT_WORKERS = int(os.environ.get('AGENCY_IMPORT_WORKERS', os.cpu_count() or 1))
+
+# Held while the drop folder is being processed, so the cron run and the folder watcher never overlap
+agency_folder_lock = threading.Lock()
+
+# Forking a threaded web process copies its locks and database connections into the
+# workers, so they start from a fork server (or fresh interpreters where there is none)
+# and only ever run agency_parsing, which imports nothing from the Flask app
+if 'forkserver' in multiprocessing.get_all_start_methods():
+    POOL_CONTEXT = multiprocessing.get_context('forkserver')
+    POOL_CONTEXT.set_forkserver_preload(['agency_parsing'])
+else:
+    POOL_CONTEXT = multiprocessing.get_context('spawn')
+
+class AgencyCSVProcessor(agency_parsing.AgencyCSVParser):
+    """Writer side of the agency import: records, resumes and ingests what AgencyCSVParser prepares"""
+
+    def get_import_record(self, file_path, import_id=None, content_hash=None):
+        """
+        Return the CSVImport tracking this file. A file whose content was seen
+        before gets the original record back: unfinished imports resume and
+        completed ones are reported as duplicates by the caller.
+        """
+        if import_id is not None:
+            return CSVImport.query.get(import_id)
+
+        content_hash = content_hash or frame_parsing.hash_file(file_path)
+        csv_import = upload_store.find_original_import(content_hash, 'agency_auto')
+
+        if csv_import:
+            if csv_import.status != 'Completed':
+                csv_import.file_path = file_path
+                db.session.commit()
+            return csv_import
+
+        csv_import = CSVImport(
+            filename=os.path.basename(file_path),
+            file_path=file_path,
+            status='Pending',
+            import_type='agency_auto',
+            content_hash=content_hash
+        )
+        db.session.add(csv_import)
+        db.session.commit()
+        return csv_import
 
-    def process_csv_file(self, file_path):
-        """Process a CSV file with robust column detection"""
+    def process_csv_file(self, file_path, import_id=None):
+        """Process a CSV file with robust column detection, streaming it in checkpointed chunks"""
+        csv_import = None
         try:
-            # Try different encodings
-            encodings = ['utf-8', 'latin1', 'cp1252', 'iso-8859-1']
-            df = None
-            
-            for encoding in encodings:
-                try:
-                    df = pd.read_csv(file_path, encoding=encoding)
-                    logging.info(f"Successfully read CSV with {encoding} encoding")
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if df is None:
-                raise ValueError("Could not read CSV file with any supported encoding")
-
-            # Detect platform
-            platform = self.detect_platform(df)
-            logging.info(f"Detected platform: {platform}")
-
-            # Map columns
-            column_map = {}
-            required_fields = ['client_email', 'campaign_name', 'date']
-            
-            for field in required_fields:
-                col = self.find_column(df, field, platform)
-                if col:
-                    column_map[field] = col
-                else:
-                    logging.warning(f"Required field '{field}' not found in CSV")
-
-            # Optional fields
-            optional_fields = ['impressions', 'clicks', 'spent', 'reach', 'budget']
-            for field in optional_fields:
-                col = self.find_column(df, field, platform)
-                if col:
-                    column_map[field] = col
-
-            if not all(field in column_map for field in required_fields):
-                missing = [f for f in required_fields if f not in column_map]
-                raise ValueError(f"Missing required columns: {missing}")
+            csv_import = self.get_import_record(file_path, import_id)
+            if import_id is None and csv_import.status == 'Completed':
+                return self.duplicate_result(csv_import, file_path)
+
+            # Sniff encoding and dialect from the first few KB, then parse once
+            read_options = csv_sniffer.read_options(csv_sniffer.detect_format(csv_import))
+            columns = frame_parsing.read_header(file_path, **read_options)
+
+            # Reuse the mapping plan of a previously seen header
+            plan = schema_registry.resolve_plan(
+                'agency_auto', columns, self.column_mappings,
+                self.build_mapping,
+                lambda: pd.read_csv(file_path, nrows=frame_parsing.SAMPLE_ROWS, **read_options)
+            )
+            platform = plan.platform
+            csv_import.platform = platform.title()
 
             # Process data
-            results = self.process_dataframe(df, column_map, platform)
+            results = chunked_import.run_chunked_import(
+                csv_import,
+                lambda chunk: self.normalize_dataframe(chunk, plan),
+                **read_options
+            )
+            results['platform'] = platform
+            results['import_id'] = csv_import.id
             return results
 
         except Exception as e:
+            if csv_import is not None:
+                chunked_import.mark_import_failed(csv_import.id, e)
+            else:
+                db.session.rollback()
             logging.error(f"Error processing CSV: {str(e)}")
-            return {'success': False, 'error': str(e)}
+            return {'success': False, 'error': str(e), 'import_id': csv_import.id if csv_import else None}
 
-    def process_dataframe(self, df, column_map, platform):
-        """Process the dataframe with mapped columns"""
-        rows_processed = 0
-        rows_failed = 0
-        clients_updated = set()
+    def duplicate_result(self, original, file_path):
+        """Record a dropped file whose content was already imported and report it as skipped"""
+        duplicate = upload_store.record_duplicate(original, os.path.basename(file_path))
+        return {
+            'success': True,
+            'rows_processed': 0,
+            'rows_failed': 0,
+            'clients_updated': 0,
+            'platform': duplicate.platform,
+            'duplicate_of': duplicate.duplicate_of_id
+        }
 
-        for index, row in df.iterrows():
-            try:
-                # Get client email
-                client_email = str(row[column_map['client_email']]).strip().lower()
-                if pd.isna(client_email) or client_email == 'nan':
-                    rows_failed += 1
-                    continue
-
-                # Find user
-                user = User.query.filter_by(email=client_email).first()
-                if not user:
-                    logging.warning(f"Client not found: {client_email}")
-                    rows_failed += 1
-                    continue
-
-                clients_updated.add(client_email)
-
-                # Get campaign name
-                campaign_name = str(row[column_map['campaign_name']]).strip()
-                if pd.isna(campaign_name) or campaign_name == 'nan':
-                    rows_failed += 1
-                    continue
-
-                # Get or create campaign
-                campaign = Campaign.query.filter_by(
-                    name=campaign_name,
-                    platform=platform.title(),
-                    user_id=user.id
-                ).first()
-
-                if not campaign:
-                    campaign = Campaign(
-                        name=campaign_name,
-                        platform=platform.title(),
-                        user_id=user.id,
-                        budget=self.safe_float(row.get(column_map.get('budget'), 0)),
-                        status='Active'
-                    )
-                    db.session.add(campaign)
-                    db.session.flush()
-
-                # Extract metrics with safe conversion
-                impressions = self.safe_int(row.get(column_map.get('impressions'), 0))
-                clicks = self.safe_int(row.get(column_map.get('clicks'), 0))
-                spent = self.safe_float(row.get(column_map.get('spent'), 0))
-                reach = self.safe_int(row.get(column_map.get('reach'), 0))
-
-                # Update campaign totals
-                campaign.impressions += impressions
-                campaign.clicks += clicks
-                campaign.spent += spent
-                campaign.reach = max(campaign.reach, reach)
-                campaign.calculate_metrics()
-
-                # Parse date
-                try:
-                    data_date = pd.to_datetime(row[column_map['date']]).date()
-                except:
-                    data_date = datetime.now().date()
-
-                # Create or update daily data
-                daily_data = CampaignData.query.filter_by(
-                    campaign_id=campaign.id,
-                    date=data_date
-                ).first()
-
-                if daily_data:
-                    daily_data.impressions += impressions
-                    daily_data.clicks += clicks
-                    daily_data.spent += spent
-                    daily_data.reach = max(daily_data.reach, reach)
-                else:
-                    daily_data = CampaignData(
-                        campaign_id=campaign.id,
-                        date=data_date,
-                        impressions=impressions,
-                        clicks=clicks,
-                        spent=spent,
-                        reach=reach
-                    )
-                    db.session.add(daily_data)
-
-                rows_processed += 1
+    def apply_prepared_file(self, file_path, prepared):
+        """
+        Writer stage for prepare_file(): record and ingest one pre-aggregated
+        file in a single transaction. Files with a partial checkpoint from an
+        earlier run resume through the streaming path instead.
+        """
+        csv_import = None
+        try:
+            csv_import = self.get_import_record(file_path, content_hash=prepared['content_hash'])
+            if csv_import.status == 'Completed':
+                return self.duplicate_result(csv_import, file_path)
+            if not prepared['success']:
+                raise ValueError(prepared['error'])
+            if csv_import.checkpoint_row:
+                return self.process_csv_file(file_path, import_id=csv_import.id)
+
+            plan = frame_parsing.MappingPlan.from_json(prepared['plan'])
+            schema_registry.save_plan('agency_auto', prepared['fingerprint'], prepared['columns'], plan)
+
+            counts = {'rows_processed': 0, 'rows_failed': 0, 'clients_updated': 0}
+            if prepared['frame'] is not None and not prepared['frame'].empty:
+                import_archive.write_chunk(csv_import, 0, prepared['frame'])
+                counts = bulk_ingest.ingest_frame(prepared['frame'])
+                bulk_ingest.rollup_campaign_totals(counts['campaign_ids'], counts['dates'])
+
+            csv_import.detected_format = json.dumps(prepared['detected_format'])
+            csv_import.platform = plan.platform.title()
+            csv_import.error_message = None
+            csv_import.rows_processed = counts['rows_processed']
+            csv_import.rows_failed = counts['rows_failed']
+            csv_import.rows_total = prepared['rows_total']
+            csv_import.checkpoint_row = prepared['rows_total']
+            csv_import.status = 'Completed'
+            csv_import.completed_at = datetime.utcnow()
+            event_stream.import_changed(csv_import)
+            db.session.commit()
+
+            return {
+                'success': True,
+                'rows_processed': counts['rows_processed'],
+                'rows_failed': counts['rows_failed'],
+                'clients_updated': counts['clients_updated'],
+                'platform': plan.platform,
+                'import_id': csv_import.id
+            }
 
-            except Exception as e:
-                logging.error(f"Error processing row {index}: {str(e)}")
-                rows_failed += 1
-                continue
+        except Exception as e:
+            if csv_import is not None:
+                chunked_import.mark_import_failed(csv_import.id, e)
+            else:
+                db.session.rollback()
+            logging.error(f"Error processing CSV: {str(e)}")
+            return {'success': False, 'error': str(e), 'import_id': csv_import.id if csv_import else None}
+
+    def process_dataframe(self, df, column_map, platform):
+        """Process the dataframe with mapped columns using set-based bulk writes"""
+        plan = frame_parsing.MappingPlan.compile(column_map, df, platform)
+        frame = self.normalize_dataframe(df, plan)
+        counts = bulk_ingest.ingest_frame(frame)
+        bulk_ingest.rollup_campaign_totals(counts['campaign_ids'], counts['dates'])
 
         db.session.commit()
 
         return {
             'success': True,
-            'rows_processed': rows_processed,
-            'rows_failed': rows_failed,
-            'clients_updated': len(clients_updated),
+            'rows_processed': counts['rows_processed'],
+            'rows_failed': counts['rows_failed'],
+            'clients_updated': counts['clients_updated'],
             'platform': platform
         }
 
-    def safe_int(self, value):
-        """Safely convert value to int"""
-        if pd.isna(value):
-            return 0
-        try:
-            return int(float(str(value).replace(',', '')))
-        except:
-            return 0
-
-    def safe_float(self, value):
-        """Safely convert value to float"""
-        if pd.isna(value):
-            return 0.0
-        try:
-            return float(str(value).replace(',', '').replace('$', ''))
-        except:
-            return 0.0
+def archive_file(file_path, target_dir):
+    """
+    Move a drop-folder file into target_dir with a timestamp prefix, gzipping
+    plain CSVs on the way (already compressed exports are moved as they are).
+    Returns the archived path, which the importers can still read directly.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    target = os.path.join(target_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.path.basename(file_path)}")
+    if csv_sniffer.is_compressed(file_path):
+        os.rename(file_path, target)
+        return target
+
+    target += '.gz'
+    with open(file_path, 'rb') as src, gzip.open(target + '.part', 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(target + '.part', target)
+    os.remove(file_path)
+    return target
+
+def finish_agency_file(data_dir, csv_file, result):
+    """Log a file's result and move it, compressed, to processed/ or errors/"""
+    file_path = os.path.join(data_dir, csv_file)
+    if result['success']:
+        if result.get('duplicate_of'):
+            logging.info(f"Skipped {csv_file}: identical to import {result['duplicate_of']}")
+        else:
+            logging.info(f"Successfully processed {csv_file}: {result['rows_processed']} rows, {result['clients_updated']} clients updated")
+        
+        # Move processed file to archive
+        archive_path = archive_file(file_path, os.path.join(data_dir, 'processed'))
+        
+    else:
+        logging.error(f"Failed to process {csv_file}: {result['error']}")
+        
+        # Move failed file to error directory
+        archive_path = archive_file(file_path, os.path.join(data_dir, 'errors'))
+
+    # Keep the import pointing at its file so a failed import can still be resumed
+    if result.get('import_id'):
+        csv_import = CSVImport.query.get(result['import_id'])
+        csv_import.file_path = archive_path
+        db.session.commit()
 
-def process_agency_csv_files():
-    """Process all CSV files in the agency data directory"""
+def agency_data_dir():
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'agency_data')
+
+def process_agency_csv_files(workers=None, csv_files=None):
+    """
+    Process all CSV files in the agency data directory, or only `csv_files`.
+    With more than one worker, files are parsed and pre-aggregated in a process
+    pool and a single writer applies them to the database in filename order.
+    Returns False without doing anything if another run is in progress.
+    """
+    if not agency_folder_lock.acquire(blocking=False):
+        logging.info("Agency data directory is already being processed; skipping this run")
+        return False
+    try:
+        _process_agency_csv_files(workers, csv_files)
+    finally:
+        agency_folder_lock.release()
+    return True
+
+def _process_agency_csv_files(workers, csv_files):
     processor = AgencyCSVProcessor()
-    data_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'agency_data')
+    data_dir = agency_data_dir()
+    workers = workers or AGENCY_IMPORT_WORKERS
     
     if not os.path.exists(data_dir):
         os.makedirs(data_dir, exist_ok=True)
         logging.info(f"Created agency data directory: {data_dir}")
         return
 
-    csv_files = [f for f in os.listdir(data_dir) if f.lower().endswith('.csv')]
+    if csv_files is None:
+        # The folder may hold an export that is still being copied in
+        csv_files = folder_watcher.settled_files(data_dir, os.listdir(data_dir))
+    # A file can already be gone when a previous run archived it
+    csv_files = sorted(f for f in csv_files if os.path.isfile(os.path.join(data_dir, f)))
     
     if not csv_files:
         logging.info("No CSV files found in agency data directory")
         return
 
-    for csv_file in csv_files:
-        file_path = os.path.join(data_dir, csv_file)
-        logging.info(f"Processing file: {csv_file}")
+    if workers <= 1 or len(csv_files) == 1:
+        for csv_file in csv_files:
+            logging.info(f"Processing file: {csv_file}")
+            try:
+                result = processor.process_csv_file(os.path.join(data_dir, csv_file))
+                finish_agency_file(data_dir, csv_file, result)
+            except Exception as e:
+                logging.error(f"Unexpected error processing {csv_file}: {str(e)}")
+        return
+
+    plans = schema_registry.cached_plans('agency_auto')
+    workers = min(workers, len(csv_files))
+    logging.info(f"Processing {len(csv_files)} files with {workers} workers")
+    
+    with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT) as pool:
+        futures = [
+            pool.submit(agency_parsing.prepare_agency_file, os.path.join(data_dir, csv_file), plans)
+            for csv_file in csv_files
+        ]
         
-        try:
-            result = processor.process_csv_file(file_path)
-            
-            if result['success']:
-                logging.info(f"Successfully processed {csv_file}: {result['rows_processed']} rows, {result['clients_updated']} clients updated")
-                
-                # Move processed file to archive
-                archive_dir = os.path.join(data_dir, 'processed')
-                os.makedirs(archive_dir, exist_ok=True)
-                archive_path = os.path.join(archive_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{csv_file}")
-                os.rename(file_path, archive_path)
-                
-            else:
-                logging.error(f"Failed to process {csv_file}: {result['error']}")
-                
-                # Move failed file to error directory
-                error_dir = os.path.join(data_dir, 'errors')
-                os.makedirs(error_dir, exist_ok=True)
-                error_path = os.path.join(error_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{csv_file}")
-                os.rename(file_path, error_path)
-                
-        except Exception as e:
-            logging.error(f"Unexpected error processing {csv_file}: {str(e)}")
\ No newline at end of file
+        # Single writer: apply results in submission order as they become ready
+        for csv_file, future in zip(csv_files, futures):
+            logging.info(f"Processing file: {csv_file}")
+            try:
+                result = processor.apply_prepared_file(os.path.join(data_dir, csv_file), future.result())
+                finish_agency_file(data_dir, csv_file, result)
+            except Exception as e:
+                logging.error(f"Unexpected error processing {csv_file}: {str(e)}")
@@ -7,194 +7,115 @@ Contains data for ALL clients that gets filtered per user login
 import os
 import pandas as pd
 import logging
-from datetime import datetime
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from sqlalchemy import func
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from app import app, db
-from models import Campaign, CampaignData, CSVImport, User
+from models import Campaign, CSVImport, User
+import chunked_import
+import csv_sniffer
+import frame_parsing
+import schema_registry
+import import_jobs
+import upload_store
+import user_provisioning
+from routes import upload_response
 
 agency_bp = Blueprint('agency', __name__, url_prefix='/agency')
 
+# Clients listed per page on the clients overview
+CLIENTS_PAGE_SIZE = int(os.environ.get('CLIENTS_PAGE_SIZE', 50))
+
 @agency_bp.route('/upload', methods=['GET', 'POST'])
 @login_required
 def agency_upload():
     """Agency upload interface for CSV files from ad platforms"""
     if request.method == 'POST':
         if 'csv_file' not in request.files:
-            flash('No file selected', 'error')
-            return redirect(request.url)
+            return upload_response(False, 'No file selected', 'error', request.url)
         
         file = request.files['csv_file']
         platform = request.form.get('platform', 'Unknown')
         
         if file.filename == '':
-            flash('No file selected', 'error')
-            return redirect(request.url)
+            return upload_response(False, 'No file selected', 'error', request.url)
+        
+        if not csv_sniffer.is_csv_file(file.filename):
+            return upload_response(False, 'Please upload a CSV file (.csv, .csv.gz or .zip)', 'error', request.url)
         
-        if file and file.filename.lower().endswith('.csv'):
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-            filename = f"{platform}_{timestamp}{filename}"
-            
-            # Save to agency uploads directory
-            agency_upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'agency_uploads')
-            os.makedirs(agency_upload_dir, exist_ok=True)
-            filepath = os.path.join(agency_upload_dir, filename)
-            
-            file.save(filepath)
-            
-            # Create import record
-            csv_import = CSVImport(
-                filename=filename,
-                file_path=filepath,
-                imported_by=current_user.id,
-                status='Pending'
-            )
-            db.session.add(csv_import)
-            db.session.commit()
-            
-            # Process the file
-            try:
-                result = process_agency_csv(filepath, csv_import.id, platform)
-                if result['success']:
-                    flash(f'CSV imported successfully! Processed {result["rows_processed"]} rows, assigned to {result["clients_updated"]} clients.', 'success')
-                else:
-                    flash(f'CSV import failed: {result["error"]}', 'error')
-            except Exception as e:
-                logging.error(f"Error processing agency CSV: {str(e)}")
-                flash(f'Error processing CSV: {str(e)}', 'error')
-        else:
-            flash('Please upload a valid CSV file', 'error')
+        filename = f"{platform}_{secure_filename(file.filename)}"
+        
+        # Store by content hash; identical re-uploads share one copy
+        content_hash, filepath = upload_store.save_upload(file)
+        message, category, csv_import = upload_store.queue_upload(
+            filename, content_hash, filepath, 'agency', platform, current_user.id
+        )
+        return upload_response(True, message, category, request.url, csv_import)
     
-    # Get recent imports
-    recent_imports = CSVImport.query.order_by(CSVImport.created_at.desc()).limit(10).all()
+    # Get recent imports (clients only see their own)
+    recent_imports = CSVImport.query
+    if not current_user.is_agency_staff():
+        recent_imports = recent_imports.filter(CSVImport.imported_by == current_user.id)
+    recent_imports = recent_imports.order_by(CSVImport.created_at.desc()).limit(10).all()
     
     return render_template('agency/upload.html', recent_imports=recent_imports)
 
+AGENCY_REQUIRED_COLUMNS = ['client_email', 'campaign_name', 'date', 'impressions', 'clicks', 'spent']
+AGENCY_OPTIONAL_COLUMNS = ['reach', 'budget', 'status']
+
+def build_agency_mapping(columns):
+    """Validate the fixed agency export layout and map its columns"""
+    missing_columns = [col for col in AGENCY_REQUIRED_COLUMNS if col not in columns]
+    
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
+    
+    column_map = {col: col for col in AGENCY_REQUIRED_COLUMNS + AGENCY_OPTIONAL_COLUMNS if col in columns}
+    return column_map, None
+
+def normalize_agency_chunk(df, plan, platform):
+    """Map a chunk of an agency export onto the standard ingestion columns"""
+    return pd.DataFrame({
+        'client_email': frame_parsing.clean_text(plan.column(df, 'client_email'), lower=True),
+        'campaign_name': frame_parsing.clean_text(plan.column(df, 'campaign_name')),
+        'platform': platform,
+        'date': plan.dates(df),
+        'impressions': plan.integer(df, 'impressions'),
+        'clicks': plan.integer(df, 'clicks'),
+        'spent': plan.numeric(df, 'spent'),
+        'reach': plan.integer(df, 'reach'),
+        'budget': plan.numeric(df, 'budget'),
+        'status': frame_parsing.clean_text(plan.column(df, 'status', None)).fillna('Active')
+    }, index=df.index)
+
 def process_agency_csv(file_path, import_id, platform):
     """
     Process CSV from ad platforms containing ALL client campaign data
     Expected format: client_email,campaign_name,date,impressions,clicks,spent,reach,budget,status
+    The file is streamed in chunks; each committed chunk advances the import's checkpoint
     """
     try:
         csv_import = CSVImport.query.get(import_id)
-        csv_import.status = 'Processing'
-        db.session.commit()
-        
-        # Read CSV
-        df = pd.read_csv(file_path)
-        
-        # Validate required columns
-        required_columns = ['client_email', 'campaign_name', 'date', 'impressions', 'clicks', 'spent']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
         
-        rows_processed = 0
-        rows_failed = 0
-        clients_updated = set()
+        read_options = csv_sniffer.read_options(csv_sniffer.detect_format(csv_import))
+        columns = frame_parsing.read_header(file_path, **read_options)
         
-        for index, row in df.iterrows():
-            try:
-                # Find client by email
-                client_email = str(row['client_email']).strip().lower()
-                user = User.query.filter_by(email=client_email).first()
-                
-                if not user:
-                    logging.warning(f"Client not found: {client_email}")
-                    rows_failed += 1
-                    continue
-                
-                clients_updated.add(client_email)
-                
-                # Get or create campaign
-                campaign = Campaign.query.filter_by(
-                    name=str(row['campaign_name']).strip(),
-                    platform=platform,
-                    user_id=user.id
-                ).first()
-                
-                if not campaign:
-                    campaign = Campaign(
-                        name=str(row['campaign_name']).strip(),
-                        platform=platform,
-                        user_id=user.id,
-                        budget=float(row.get('budget', 0)) if pd.notna(row.get('budget')) else 0.0,
-                        status=str(row.get('status', 'Active')).strip()
-                    )
-                    db.session.add(campaign)
-                    db.session.flush()
-                
-                # Update campaign totals
-                impressions = int(row.get('impressions', 0)) if pd.notna(row.get('impressions')) else 0
-                clicks = int(row.get('clicks', 0)) if pd.notna(row.get('clicks')) else 0
-                spent = float(row.get('spent', 0)) if pd.notna(row.get('spent')) else 0.0
-                reach = int(row.get('reach', 0)) if pd.notna(row.get('reach')) else 0
-                
-                campaign.impressions += impressions
-                campaign.clicks += clicks
-                campaign.spent += spent
-                campaign.reach = max(campaign.reach, reach)
-                campaign.calculate_ctr()
-                
-                # Parse date
-                try:
-                    data_date = pd.to_datetime(row['date']).date()
-                except:
-                    data_date = datetime.now().date()
-                
-                # Create or update daily data
-                daily_data = CampaignData.query.filter_by(
-                    campaign_id=campaign.id,
-                    date=data_date
-                ).first()
-                
-                if daily_data:
-                    daily_data.impressions += impressions
-                    daily_data.clicks += clicks
-                    daily_data.spent += spent
-                    daily_data.reach = max(daily_data.reach, reach)
-                else:
-                    daily_data = CampaignData(
-                        campaign_id=campaign.id,
-                        date=data_date,
-                        impressions=impressions,
-                        clicks=clicks,
-                        spent=spent,
-                        reach=reach
-                    )
-                    db.session.add(daily_data)
-                
-                rows_processed += 1
-                
-            except Exception as e:
-                logging.error(f"Error processing row {index}: {str(e)}")
-                rows_failed += 1
-                continue
+        # Validate required columns (cached per header layout)
+        plan = schema_registry.resolve_plan(
+            'agency', columns, [AGENCY_REQUIRED_COLUMNS, AGENCY_OPTIONAL_COLUMNS],
+            build_agency_mapping,
+            lambda: pd.read_csv(file_path, nrows=frame_parsing.SAMPLE_ROWS, **read_options)
+        )
         
-        # Update import record
-        csv_import.status = 'Completed'
-        csv_import.rows_processed = rows_processed
-        csv_import.rows_failed = rows_failed
-        csv_import.completed_at = datetime.utcnow()
-        
-        db.session.commit()
-        
-        return {
-            'success': True,
-            'rows_processed': rows_processed,
-            'rows_failed': rows_failed,
-            'clients_updated': len(clients_updated)
-        }
+        return chunked_import.run_chunked_import(
+            csv_import,
+            lambda chunk: normalize_agency_chunk(chunk, plan, platform),
+            **read_options
+        )
         
     except Exception as e:
-        csv_import = CSVImport.query.get(import_id)
-        csv_import.status = 'Failed'
-        csv_import.error_message = str(e)
-        csv_import.completed_at = datetime.utcnow()
-        db.session.commit()
+        chunked_import.mark_import_failed(import_id, e)
         
         logging.error(f"Agency CSV import failed: {str(e)}")
         return {
@@ -202,31 +123,108 @@ def process_agency_csv(file_path, import_id, platform):
             'error': str(e)
         }
 
+@agency_bp.route('/imports/<int:import_id>/resume', methods=['POST'])
+@login_required
+def resume_agency_import(import_id):
+    """Resume a failed import from its last committed checkpoint"""
+    csv_import = CSVImport.query.get_or_404(import_id)
+    if not import_jobs.can_access(csv_import, current_user):
+        abort(404)
+    if csv_import.status != 'Failed':
+        flash(f'Import #{import_id} is {csv_import.status.lower()} and cannot be resumed.', 'error')
+    elif import_jobs.enqueue_import(import_id):
+        flash(f'Import #{import_id} queued to resume from row {csv_import.checkpoint_row or 0}.', 'success')
+    else:
+        flash(f'Import #{import_id} is already running.', 'info')
+    return redirect(url_for('agency.agency_upload'))
+
+def client_summary_query():
+    """Per-client campaign count, budget, spend, impressions and clicks in one GROUP BY"""
+    return db.session.query(
+        Campaign.user_id.label('user_id'),
+        func.count(Campaign.id).label('campaign_count'),
+        func.sum(Campaign.budget).label('total_budget'),
+        func.sum(Campaign.spent).label('total_spent'),
+        func.sum(Campaign.impressions).label('total_impressions'),
+        func.sum(Campaign.clicks).label('total_clicks')
+    ).group_by(Campaign.user_id).subquery()
+
+def client_platforms(user_ids):
+    """{user_id: sorted platforms} for the clients on one page"""
+    platforms = {user_id: [] for user_id in user_ids}
+    rows = db.session.query(Campaign.user_id, Campaign.platform).filter(
+        Campaign.user_id.in_(user_ids)
+    ).distinct().order_by(Campaign.user_id, Campaign.platform).all()
+    for user_id, platform in rows:
+        platforms[user_id].append(platform)
+    return platforms
+
 @agency_bp.route('/clients')
 @login_required
 def view_clients():
-    """View all clients and their campaign summary"""
-    clients = User.query.all()
-    client_stats = []
+    """View all clients and their campaign summary, one sorted page at a time"""
+    summary = client_summary_query()
+    columns = {
+        'campaigns': func.coalesce(summary.c.campaign_count, 0),
+        'budget': func.coalesce(summary.c.total_budget, 0.0),
+        'spent': func.coalesce(summary.c.total_spent, 0.0),
+        'impressions': func.coalesce(summary.c.total_impressions, 0),
+        'clicks': func.coalesce(summary.c.total_clicks, 0)
+    }
+    sort_columns = dict(columns, name=func.lower(func.coalesce(User.first_name, User.username)), email=User.email)
     
-    for client in clients:
-        campaigns = Campaign.query.filter_by(user_id=client.id).all()
-        total_budget = sum(c.budget for c in campaigns)
-        total_spent = sum(c.spent for c in campaigns)
-        total_impressions = sum(c.impressions for c in campaigns)
-        total_clicks = sum(c.clicks for c in campaigns)
-        
+    sort = request.args.get('sort', 'name')
+    if sort not in sort_columns:
+        sort = 'name'
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    sort_column = sort_columns[sort].desc() if order == 'desc' else sort_columns[sort].asc()
+    
+    pagination = db.session.query(User, *columns.values()).outerjoin(
+        summary, summary.c.user_id == User.id
+    ).order_by(sort_column, User.id).paginate(
+        page=request.args.get('page', 1, type=int), per_page=CLIENTS_PAGE_SIZE, error_out=False
+    )
+    
+    platforms = client_platforms([client.id for client, *_ in pagination.items])
+    client_stats = []
+    for client, campaign_count, total_budget, total_spent, total_impressions, total_clicks in pagination.items:
         client_stats.append({
             'client': client,
-            'campaign_count': len(campaigns),
+            'campaign_count': campaign_count,
             'total_budget': total_budget,
             'total_spent': total_spent,
             'total_impressions': total_impressions,
             'total_clicks': total_clicks,
-            'platforms': list(set(c.platform for c in campaigns))
+            'platforms': platforms[client.id],
+            # Accounts provisioned by an import have no password until the client accepts an invite
+            'awaiting_invite': not client.has_usable_password()
         })
     
-    return render_template('agency/clients.html', client_stats=client_stats)
+    # Agency-wide totals for the summary cards
+    campaign_count, total_budget, total_impressions = db.session.query(
+        func.count(Campaign.id),
+        func.coalesce(func.sum(Campaign.budget), 0.0),
+        func.coalesce(func.sum(Campaign.impressions), 0)
+    ).one()
+    totals = {
+        'clients': pagination.total,
+        'campaign_count': campaign_count,
+        'total_budget': total_budget,
+        'total_impressions': total_impressions
+    }
+    
+    return render_template('agency/clients.html', client_stats=client_stats, pagination=pagination,
+                           totals=totals, sort=sort, order=order, is_staff=current_user.is_agency_staff())
+
+@agency_bp.route('/clients/<int:client_id>/access-link', methods=['POST'])
+@login_required
+def client_access_link(client_id):
+    """Invite / password reset link for a client, issued on request to agency staff only"""
+    if not current_user.is_agency_staff():
+        return jsonify({'error': 'Not found'}), 404
+    client = User.query.get_or_404(client_id)
+    logging.info(f"{current_user.email} issued an access link for {client.email}")
+    return jsonify({'url': user_provisioning.invite_url(client)})
 
 # Register blueprint
 app.register_blueprint(agency_bp)
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Database-free parsing stage of the agency CSV import
+Platform detection, column mapping and pre-aggregation of drop-folder exports.
+This module imports nothing from the Flask app, so the import pool's worker
+processes start from it without loading the app or opening database connections.
+"""
+
+import logging
+import pandas as pd
+import csv_sniffer
+import frame_parsing
+
+class AgencyCSVParser:
+    def __init__(self):
+        # Common column mappings for different platforms
+        self.column_mappings = {
+            # Facebook Ads Manager exports
+            'facebook': {
+                'client_email': ['client_email', 'account_email', 'advertiser_email'],
+                'campaign_name': ['campaign_name', 'Campaign Name', 'Campaign', 'campaign'],
+                'date': ['date', 'Date', 'reporting_starts', 'day'],
+                'impressions': ['impressions', 'Impressions', 'reach', 'Reach'],
+                'clicks': ['clicks', 'Clicks', 'link_clicks', 'Link Clicks'],
+                'spent': ['spend', 'Spend', 'amount_spent', 'Amount Spent (USD)', 'cost'],
+                'reach': ['reach', 'Reach', 'unique_reach'],
+                'budget': ['budget', 'Budget', 'lifetime_budget', 'daily_budget']
+            },
+            # Google Ads exports
+            'google': {
+                'client_email': ['client_email', 'customer_email', 'account_email'],
+                'campaign_name': ['campaign', 'Campaign', 'campaign_name'],
+                'date': ['date', 'Date', 'day', 'Day'],
+                'impressions': ['impressions', 'Impressions', 'impr'],
+                'clicks': ['clicks', 'Clicks'],
+                'spent': ['cost', 'Cost', 'spend', 'cost_micros'],
+                'reach': ['reach', 'unique_users'],
+                'budget': ['budget', 'Budget', 'average_daily_budget']
+            },
+            # ShareIT or other platforms
+            'shareit': {
+                'client_email': ['client_email', 'advertiser_email'],
+                'campaign_name': ['campaign_name', 'campaign'],
+                'date': ['date', 'report_date'],
+                'impressions': ['impressions', 'views'],
+                'clicks': ['clicks', 'taps'],
+                'spent': ['spend', 'cost'],
+                'reach': ['reach', 'unique_users'],
+                'budget': ['budget', 'campaign_budget']
+            }
+        }
+
+    def detect_platform(self, df):
+        """Detect which platform the CSV is from based on column names"""
+        columns = [col.lower() for col in df.columns]
+        
+        # Facebook indicators
+        if any(fb_col in columns for fb_col in ['amount_spent', 'link_clicks', 'campaign_name']):
+            return 'facebook'
+        
+        # Google Ads indicators
+        if any(g_col in columns for g_col in ['cost_micros', 'average_daily_budget', 'impr']):
+            return 'google'
+        
+        # Default to generic mapping
+        return 'shareit'
+
+    def find_column(self, df, field_name, platform):
+        """Find the actual column name for a field based on mappings"""
+        possible_names = self.column_mappings.get(platform, {}).get(field_name, [field_name])
+        
+        # Case-insensitive lookup, first matching column wins
+        columns = {}
+        for actual_col in df.columns:
+            columns.setdefault(str(actual_col).lower(), actual_col)
+        
+        for col_name in possible_names:
+            if col_name.lower() in columns:
+                return columns[col_name.lower()]
+        
+        return None
+
+    def build_mapping(self, columns):
+        """Detect the platform and column map from a header row"""
+        header = pd.DataFrame(columns=columns)
+        platform = self.detect_platform(header)
+        logging.info(f"Detected platform: {platform}")
+        return self.map_columns(header, platform), platform
+
+    def map_columns(self, df, platform):
+        """Resolve the source column for each standard field"""
+        column_map = {}
+        required_fields = ['client_email', 'campaign_name', 'date']
+        
+        for field in required_fields:
+            col = self.find_column(df, field, platform)
+            if col:
+                column_map[field] = col
+            else:
+                logging.warning(f"Required field '{field}' not found in CSV")
+
+        # Optional fields
+        optional_fields = ['impressions', 'clicks', 'spent', 'reach', 'budget']
+        for field in optional_fields:
+            col = self.find_column(df, field, platform)
+            if col:
+                column_map[field] = col
+
+        if not all(field in column_map for field in required_fields):
+            missing = [f for f in required_fields if f not in column_map]
+            raise ValueError(f"Missing required columns: {missing}")
+
+        return column_map
+
+    def normalize_dataframe(self, df, plan):
+        """Build the standard ingestion frame using a compiled mapping plan, converting whole columns at once"""
+        return pd.DataFrame({
+            'client_email': frame_parsing.clean_text(plan.column(df, 'client_email'), lower=True),
+            'campaign_name': frame_parsing.clean_text(plan.column(df, 'campaign_name')),
+            'platform': plan.platform.title(),
+            'date': plan.dates(df),
+            'impressions': plan.integer(df, 'impressions'),
+            'clicks': plan.integer(df, 'clicks'),
+            'spent': plan.numeric(df, 'spent'),
+            'reach': plan.integer(df, 'reach'),
+            'budget': plan.numeric(df, 'budget'),
+            'status': 'Active'
+        }, index=df.index)
+
+    def prepare_file(self, file_path, plans):
+        """
+        Parse, map and pre-aggregate a whole file without touching the database,
+        so it can run in a worker process. `plans` is schema_registry.cached_plans().
+        """
+        content_hash = frame_parsing.hash_file(file_path)
+        try:
+            detected = csv_sniffer.sniff_csv(file_path)
+            read_options = csv_sniffer.read_options(detected)
+            columns = frame_parsing.read_header(file_path, **read_options)
+
+            fingerprint = frame_parsing.header_fingerprint('agency_auto', columns, self.column_mappings)
+            if fingerprint in plans:
+                plan = frame_parsing.MappingPlan.from_json(plans[fingerprint])
+            else:
+                column_map, platform = self.build_mapping(columns)
+                sample = pd.read_csv(file_path, nrows=frame_parsing.SAMPLE_ROWS, **read_options)
+                plan = frame_parsing.MappingPlan.compile(column_map, sample, platform)
+
+            parts = []
+            rows_total = 0
+            for chunk in frame_parsing.iter_chunks(file_path, **read_options):
+                parts.append(frame_parsing.preaggregate(self.normalize_dataframe(chunk, plan)))
+                rows_total += len(chunk)
+
+            return {
+                'success': True,
+                'content_hash': content_hash,
+                'detected_format': detected,
+                'columns': [str(column) for column in columns],
+                'fingerprint': fingerprint,
+                'plan': plan.to_json(),
+                'rows_total': rows_total,
+                'frame': frame_parsing.preaggregate(pd.concat(parts)) if parts else None
+            }
+
+        except Exception as e:
+            return {'success': False, 'content_hash': content_hash, 'error': str(e)}
+
+def prepare_agency_file(file_path, plans):
+    """Process pool entry point"""
+    return AgencyCSVParser().prepare_file(file_path, plans)
@@ -1,7 +1,10 @@
 import os
 import logging
+import sqlite3
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager
@@ -19,9 +22,57 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///marketing_dashboard.db"
+# Configure the database: SQLite by default, PostgreSQL via DATABASE_URL
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///marketing_dashboard.db")
+if DATABASE_URL.startswith(("postgres://", "postgresql://")):
+    # Hosting providers hand out postgres://; use the psycopg2 driver the app depends on
+    DATABASE_URL = "postgresql+psycopg2://" + DATABASE_URL.split("://", 1)[1]
+
+# The bulk imports upsert with INSERT ... ON CONFLICT, which only these dialects support
+SUPPORTED_DATABASES = ("sqlite", "postgresql")
+DATABASE_BACKEND = make_url(DATABASE_URL).get_backend_name()
+if DATABASE_BACKEND not in SUPPORTED_DATABASES:
+    raise RuntimeError(f"Unsupported DATABASE_URL backend '{DATABASE_BACKEND}': use one of {', '.join(SUPPORTED_DATABASES)}")
+
+# SQLite: milliseconds a writer waits for the lock, and page cache per connection in KiB
+SQLITE_BUSY_TIMEOUT = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 30000))
+SQLITE_CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", 64 * 1024))
+
+# Server databases: connection pool sizing and recycling
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+
+app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+if DATABASE_URL.startswith("sqlite"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "connect_args": {"timeout": SQLITE_BUSY_TIMEOUT / 1000}
+    }
+else:
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True
+    }
+
+@event.listens_for(Engine, "connect")
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """WAL lets dashboard reads run while an import writes; writers wait instead of failing with 'database is locked'"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE}")
+    cursor.close()
+
+# Accounts allowed to manage clients (comma-separated emails), e.g. to hand out invite and reset links
+app.config['AGENCY_STAFF_EMAILS'] = {
+    email.strip().lower() for email in os.environ.get("AGENCY_STAFF_EMAILS", "").split(",") if email.strip()
+}
 
 # Upload configuration
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -47,3 +98,6 @@ with app.app_context():
     import models  # noqa: F401
     db.create_all()
     logging.info("Database tables created")
+
+    from schema_migrations import apply_migrations
+    apply_migrations()
@@ -3,6 +3,7 @@ from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash
 from app import db
 from models import User
+import user_provisioning
 import logging
 
 auth_bp = Blueprint('auth', __name__)
@@ -101,6 +102,56 @@ def register():
     
     return render_template('login.html')
 
+@auth_bp.route('/reset', methods=['GET', 'POST'])
+def reset_password():
+    """Request a password reset link"""
+    if current_user.is_authenticated:
+        return redirect(url_for('dashboard'))
+    
+    if request.method == 'POST':
+        email = request.form.get('email')
+        user = User.query.filter_by(email=email).first() if email else None
+        
+        if user and user.is_active:
+            # No mail service is configured: agency staff issue the link from the clients page
+            logging.info(f"Password reset requested for {user.email}")
+        
+        # Same reply whether or not the account exists
+        flash('Please ask your agency contact for a password reset link.', 'info')
+        return redirect(url_for('auth.login'))
+    
+    return render_template('set_password.html', token=None)
+
+@auth_bp.route('/set-password/<token>', methods=['GET', 'POST'])
+def set_password(token):
+    """Choose a password from an invite or reset link"""
+    user = user_provisioning.load_invite_token(token)
+    if user is None:
+        flash('This link is invalid or has expired. Please request a new one.', 'error')
+        return redirect(url_for('auth.login'))
+    
+    if request.method == 'POST':
+        password = request.form.get('password')
+        confirm_password = request.form.get('confirm_password')
+        
+        if not password or password != confirm_password:
+            flash('Passwords do not match', 'error')
+            return render_template('set_password.html', token=token, user=user)
+        
+        if len(password) < 6:
+            flash('Password must be at least 6 characters long', 'error')
+            return render_template('set_password.html', token=token, user=user)
+        
+        user.set_password(password)
+        db.session.commit()
+        logging.info(f"Password set for {user.email}")
+        
+        login_user(user)
+        flash('Your password has been set.', 'success')
+        return redirect(url_for('dashboard'))
+    
+    return render_template('set_password.html', token=token, user=user)
+
 @auth_bp.route('/logout')
 @login_required
 def logout():
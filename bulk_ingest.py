@@ -0,0 +1,407 @@
+"""
+Set-based ingestion engine for campaign CSV data
+Resolves clients and campaigns with bulk IN queries, pre-aggregates rows per
+(campaign, date) with pandas and writes CampaignData/Campaign in batches
+"""
+
+import logging
+from datetime import datetime, timedelta
+import pandas as pd
+from sqlalchemy import case, delete, func, select, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from models import Campaign, CampaignData, CampaignDataArchive, MetricRollup, User
+import data_tiering
+import event_stream
+
+# Keep IN (...) lists well below SQLite's bound parameter limit
+IN_CLAUSE_BATCH = 500
+
+METRIC_COLUMNS = ['impressions', 'clicks', 'spent', 'reach']
+
+ROLLUP_GRANULARITIES = ['day', 'week', 'month']
+
+
+def chunked(values, size=IN_CLAUSE_BATCH):
+    """Yield successive lists of at most `size` values"""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def records(frame, columns):
+    """Build insert/update parameter dicts holding plain Python values"""
+    values = [frame[column].tolist() for column in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def row_count(frame):
+    """Number of source CSV rows in a frame (pre-aggregated frames carry a 'rows' column)"""
+    if 'rows' in frame.columns:
+        return int(frame['rows'].sum())
+    return len(frame)
+
+
+def native_insert(model):
+    """
+    INSERT for the bound database that supports ON CONFLICT (SQLite and PostgreSQL
+    share the syntax; app.py refuses to start on any other database)
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model.__table__)
+    return sqlite.insert(model.__table__)
+
+
+def resolve_users(emails):
+    """Map client emails to user ids with batched IN queries"""
+    user_ids = {}
+    for batch in chunked(set(emails)):
+        rows = db.session.query(User.email, User.id).filter(User.email.in_(batch)).all()
+        user_ids.update(rows)
+    return user_ids
+
+
+def _lookup_campaigns(keys):
+    """Return {(user_id, platform, name): campaign_id} for the given campaign keys"""
+    found = {}
+    wanted = set(keys.itertuples(index=False, name=None))
+    for platform, group in keys.groupby('platform'):
+        user_ids = group['user_id'].unique().tolist()
+        for names in chunked(group['campaign_name'].unique()):
+            rows = db.session.query(Campaign.user_id, Campaign.platform, Campaign.name, Campaign.id).filter(
+                Campaign.platform == platform,
+                Campaign.user_id.in_(user_ids),
+                Campaign.name.in_(names)
+            ).order_by(Campaign.id).all()
+            for user_id, campaign_platform, name, campaign_id in rows:
+                key = (user_id, campaign_platform, name)
+                if key in wanted and key not in found:
+                    found[key] = campaign_id
+    return found
+
+
+def resolve_campaigns(frame):
+    """
+    Return a campaign id for every row of `frame`, creating missing campaigns in one insert.
+    `frame` needs user_id, platform and campaign_name columns; budget and status
+    are taken from the first row of each new campaign.
+    """
+    key_columns = ['user_id', 'platform', 'campaign_name']
+    first_rows = frame.drop_duplicates(key_columns)
+    campaign_ids = _lookup_campaigns(first_rows[key_columns])
+
+    is_new = [key not in campaign_ids for key in first_rows[key_columns].itertuples(index=False, name=None)]
+    new_campaigns = first_rows[is_new]
+    if not new_campaigns.empty:
+        new_campaigns = new_campaigns.rename(columns={'campaign_name': 'name'})
+        # A concurrent import may create the same campaign; the unique constraint keeps one
+        db.session.execute(
+            native_insert(Campaign).on_conflict_do_nothing(index_elements=['user_id', 'platform', 'name']),
+            records(new_campaigns, ['name', 'platform', 'user_id', 'budget', 'status'])
+        )
+        campaign_ids.update(_lookup_campaigns(first_rows[key_columns][is_new]))
+        logging.info(f"Created {len(new_campaigns)} campaigns")
+
+    keys = frame[key_columns].itertuples(index=False, name=None)
+    return pd.Series([campaign_ids[key] for key in keys], index=frame.index, dtype='int64')
+
+
+def find_campaigns(frame):
+    """Campaign id of every row of `frame` whose campaign already exists (NA otherwise), creating nothing"""
+    key_columns = ['user_id', 'platform', 'campaign_name']
+    campaign_ids = _lookup_campaigns(frame[key_columns].drop_duplicates())
+    keys = frame[key_columns].itertuples(index=False, name=None)
+    return pd.Series([campaign_ids.get(key) for key in keys], index=frame.index, dtype='Int64')
+
+
+def aggregate_daily(frame):
+    """Collapse rows to one per (campaign_id, date): summed metrics, max reach"""
+    return frame.groupby(['campaign_id', 'date'], as_index=False, sort=True).agg(
+        impressions=('impressions', 'sum'),
+        clicks=('clicks', 'sum'),
+        spent=('spent', 'sum'),
+        reach=('reach', 'max')
+    )
+
+
+def upsert_daily(rows):
+    """
+    Add daily rows to CampaignData with a single INSERT .. ON CONFLICT
+    (campaign_id, date) DO UPDATE: metrics of an existing day are summed,
+    reach keeps the larger value. Rows must be unique per (campaign_id, date).
+    """
+    if not rows:
+        return
+    table = CampaignData.__table__
+    statement = native_insert(CampaignData)
+    excluded = statement.excluded
+    old_reach = func.coalesce(table.c.reach, 0)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['campaign_id', 'date'],
+        set_={
+            'impressions': func.coalesce(table.c.impressions, 0) + excluded.impressions,
+            'clicks': func.coalesce(table.c.clicks, 0) + excluded.clicks,
+            'spent': func.coalesce(table.c.spent, 0.0) + excluded.spent,
+            'reach': case((excluded.reach > old_reach, excluded.reach), else_=old_reach)
+        }
+    ), rows)
+
+
+def write_daily_data(daily):
+    """Merge aggregated daily rows (one per campaign and date) into CampaignData with one upsert"""
+    if daily.empty:
+        return
+    daily = daily.assign(date=daily['date'].dt.date)
+    upsert_daily(records(daily, ['campaign_id', 'date'] + METRIC_COLUMNS))
+    logging.info(f"Daily data: {len(daily)} rows upserted")
+
+
+def write_daily_rows(rows):
+    """Aggregate and upsert loose daily rows (dicts of campaign_id, date and metrics) from row-by-row importers"""
+    if rows:
+        frame = pd.DataFrame(rows)
+        write_daily_data(aggregate_daily(frame.assign(date=pd.to_datetime(frame['date']))))
+
+
+def _daily_totals_query(campaign_ids=None):
+    """
+    Per-campaign totals over both tiers of daily data: summed metrics, max
+    daily reach. Archived years contribute their stored totals.
+    """
+    hot = select(
+        CampaignData.campaign_id.label('campaign_id'),
+        func.sum(CampaignData.impressions).label('impressions'),
+        func.sum(CampaignData.clicks).label('clicks'),
+        func.sum(CampaignData.spent).label('spent'),
+        func.max(CampaignData.reach).label('reach')
+    ).group_by(CampaignData.campaign_id)
+    cold = select(
+        CampaignDataArchive.campaign_id, CampaignDataArchive.impressions, CampaignDataArchive.clicks,
+        CampaignDataArchive.spent, CampaignDataArchive.reach
+    )
+    if campaign_ids is not None:
+        hot = hot.where(CampaignData.campaign_id.in_(campaign_ids))
+        cold = cold.where(CampaignDataArchive.campaign_id.in_(campaign_ids))
+
+    tiers = union_all(hot, cold).subquery()
+    return db.session.query(
+        tiers.c.campaign_id,
+        func.coalesce(func.sum(tiers.c.impressions), 0),
+        func.coalesce(func.sum(tiers.c.clicks), 0),
+        func.coalesce(func.sum(tiers.c.spent), 0.0),
+        func.coalesce(func.max(tiers.c.reach), 0)
+    ).group_by(tiers.c.campaign_id)
+
+
+def period_starts(dates, granularity):
+    """First day of the day / week (Monday) / month period of each date in a datetime64 Series"""
+    if granularity == 'week':
+        return dates - pd.to_timedelta(dates.dt.weekday, unit='D')
+    if granularity == 'month':
+        return dates.dt.to_period('M').dt.start_time
+    return dates
+
+
+def rollup_window(start_date, end_date):
+    """First and last day to re-read so every week and month touching [start_date, end_date] is summed whole"""
+    first = min(start_date - timedelta(days=start_date.weekday()), start_date.replace(day=1))
+    month_end = end_date.replace(day=28) + timedelta(days=4)
+    month_end -= timedelta(days=month_end.day)
+    last = max(end_date + timedelta(days=6 - end_date.weekday()), month_end)
+    return first, last
+
+
+def _client_daily_totals(user_ids, start_date=None, end_date=None, platforms=None):
+    """
+    Daily data of both tiers summed per (client, platform, date) for a batch
+    of clients, optionally limited to a date range and some platforms
+    """
+    query = db.session.query(
+        Campaign.user_id, Campaign.platform, CampaignData.date,
+        func.coalesce(func.sum(CampaignData.impressions), 0),
+        func.coalesce(func.sum(CampaignData.clicks), 0),
+        func.coalesce(func.sum(CampaignData.spent), 0.0),
+        func.coalesce(func.sum(CampaignData.reach), 0)
+    ).join(Campaign, Campaign.id == CampaignData.campaign_id).filter(Campaign.user_id.in_(user_ids))
+    archive_query = db.session.query(
+        Campaign.user_id, Campaign.platform,
+        CampaignDataArchive.campaign_id, CampaignDataArchive.year, CampaignDataArchive.data
+    ).join(Campaign, Campaign.id == CampaignDataArchive.campaign_id).filter(Campaign.user_id.in_(user_ids))
+    if platforms is not None:
+        query = query.filter(Campaign.platform.in_(platforms))
+        archive_query = archive_query.filter(Campaign.platform.in_(platforms))
+    if start_date is not None:
+        query = query.filter(CampaignData.date >= start_date, CampaignData.date <= end_date)
+        archive_query = archive_query.filter(
+            CampaignDataArchive.year >= start_date.year, CampaignDataArchive.year <= end_date.year
+        )
+
+    rows = query.group_by(Campaign.user_id, Campaign.platform, CampaignData.date).all()
+    daily = pd.DataFrame(rows, columns=['user_id', 'platform', 'date'] + METRIC_COLUMNS)
+    daily['date'] = pd.to_datetime(daily['date'])
+
+    # Days moved to the archive tier
+    archives = archive_query.all()
+    if archives:
+        owners = {campaign_id: (user_id, platform) for user_id, platform, campaign_id, _, _ in archives}
+        cold = data_tiering.cold_days([archive[2:] for archive in archives], start_date, end_date)
+        cold = cold.assign(
+            user_id=cold['campaign_id'].map(lambda campaign_id: owners[campaign_id][0]),
+            platform=cold['campaign_id'].map(lambda campaign_id: owners[campaign_id][1])
+        )
+        daily = pd.concat([daily, cold[['user_id', 'platform', 'date'] + METRIC_COLUMNS]], ignore_index=True)
+        daily = daily.groupby(['user_id', 'platform', 'date'], as_index=False)[METRIC_COLUMNS].sum()
+    return daily
+
+
+def upsert_rollups(rows):
+    """Write MetricRollup rows with one INSERT .. ON CONFLICT that replaces the metrics of existing periods"""
+    if not rows:
+        return
+    statement = native_insert(MetricRollup)
+    excluded = statement.excluded
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['user_id', 'platform', 'granularity', 'period_start'],
+        set_={column: excluded[column] for column in METRIC_COLUMNS + ['updated_at']}
+    ), rows)
+
+
+def refresh_metric_rollups(user_ids, start_date=None, end_date=None, platforms=None):
+    """
+    Recompute the day/week/month MetricRollup rows of the given clients: one
+    GROUP BY (client, platform, date) per batch of clients in the database,
+    weeks and months summed from those daily totals with pandas, then one
+    upsert. With a date range only the periods touching it (and only the
+    given platforms) are recomputed, so the cost follows the import rather
+    than the client's history; without one the clients are rebuilt whole.
+    """
+    written = 0
+    now = datetime.utcnow()
+    window = rollup_window(start_date, end_date) if start_date is not None else (None, None)
+    for batch in chunked(user_ids):
+        if start_date is None:
+            db.session.execute(delete(MetricRollup).where(MetricRollup.user_id.in_(batch)))
+        daily = _client_daily_totals(batch, *window, platforms)
+        if daily.empty:
+            continue
+        for granularity in ROLLUP_GRANULARITIES:
+            periods = daily.assign(period_start=period_starts(daily['date'], granularity)).groupby(
+                ['user_id', 'platform', 'period_start'], as_index=False
+            )[METRIC_COLUMNS].sum()
+            if start_date is not None:
+                # The window reaches into neighbouring periods; keep the ones it covers whole
+                first, last = period_starts(pd.Series(pd.to_datetime([start_date, end_date])), granularity)
+                periods = periods[(periods['period_start'] >= first) & (periods['period_start'] <= last)]
+            periods = periods.assign(granularity=granularity, period_start=periods['period_start'].dt.date, updated_at=now)
+            upsert_rollups(records(
+                periods, ['user_id', 'platform', 'granularity', 'period_start', 'updated_at'] + METRIC_COLUMNS
+            ))
+            written += len(periods)
+    logging.info(f"Refreshed {written} metric rollup rows")
+
+
+def rebuild_metric_rollups():
+    """Recompute the rollups of every client from scratch (backfill, or after a replay)"""
+    db.session.execute(delete(MetricRollup))
+    refresh_metric_rollups([user_id for user_id, in db.session.query(Campaign.user_id).distinct()])
+    db.session.execute(
+        update(User).values(data_version=func.coalesce(User.data_version, 0) + 1),
+        execution_options={'synchronize_session': False}
+    )
+    event_stream.metrics_changed()
+
+
+def bump_data_versions(user_ids):
+    """Mark the clients' cached dashboards and reports stale; commits with the data that changed"""
+    for batch in chunked(user_ids):
+        db.session.execute(
+            update(User).where(User.id.in_(batch)).values(data_version=func.coalesce(User.data_version, 0) + 1),
+            execution_options={'synchronize_session': False}
+        )
+    event_stream.metrics_changed(user_ids)
+
+
+def rollup_campaign_totals(campaign_ids, dates=None):
+    """
+    Recompute Campaign totals and derived metrics from their CampaignData with
+    one GROUP BY per batch of campaigns and a single bulk update, so the totals
+    always match the daily rows. Campaigns without daily rows are left alone.
+    The owning clients' MetricRollup rows are refreshed in the same
+    transaction: around the days written (`dates`, as returned by
+    ingest_frame) when given, otherwise over their whole history.
+    """
+    updates = []
+    now = datetime.utcnow()
+    for batch in chunked(campaign_ids):
+        rows = _daily_totals_query(batch).all()
+        for campaign_id, impressions, clicks, spent, reach in rows:
+            values = {
+                'id': campaign_id,
+                'impressions': int(impressions),
+                'clicks': int(clicks),
+                'spent': float(spent),
+                'reach': int(reach),
+                'updated_at': now
+            }
+            values.update(Campaign.derive_metrics(values['impressions'], values['clicks'], values['spent'], values['reach']))
+            updates.append(values)
+
+    if updates:
+        db.session.execute(update(Campaign), updates)
+        logging.info(f"Rolled up totals for {len(updates)} campaigns")
+
+    clients = set()
+    for batch in chunked(campaign_ids):
+        clients.update(db.session.query(Campaign.user_id, Campaign.platform).filter(Campaign.id.in_(batch)).distinct())
+    user_ids = {user_id for user_id, _ in clients}
+    if user_ids:
+        if dates is None:
+            refresh_metric_rollups(user_ids)
+        elif dates:
+            refresh_metric_rollups(user_ids, min(dates), max(dates), {platform for _, platform in clients})
+        bump_data_versions(user_ids)
+
+
+def ingest_frame(frame):
+    """
+    Ingest a normalized frame with one row per CSV row.
+    Expected columns: client_email, campaign_name, platform, date, impressions,
+    clicks, spent, reach, budget, status (already cleaned and typed).
+    Rows without a usable date (NaT) are counted as failed. A frame from
+    preaggregate() is accepted too; its 'rows' column keeps the counts exact.
+    Returns the rows_processed / rows_failed / clients_updated counts, the
+    set of matched client emails, and the campaign ids and dates whose daily
+    data changed; pass those to rollup_campaign_totals() once the import is done.
+    """
+    total_rows = row_count(frame)
+    frame = frame[frame['client_email'].notna()]
+
+    user_ids = resolve_users(frame['client_email'].unique().tolist())
+    unknown = set(frame['client_email'].unique()) - set(user_ids)
+    for email in sorted(unknown):
+        logging.warning(f"Client not found: {email}")
+
+    frame = frame.assign(user_id=frame['client_email'].map(user_ids))
+    frame = frame[frame['user_id'].notna()]
+    client_emails = set(frame['client_email'].unique())
+
+    frame = frame[frame['campaign_name'].notna() & frame['date'].notna()]
+    rows_processed = row_count(frame)
+
+    campaign_ids, dates = set(), set()
+    if rows_processed:
+        frame = frame.assign(user_id=frame['user_id'].astype('int64'))
+        frame = frame.assign(campaign_id=resolve_campaigns(frame))
+        daily = aggregate_daily(frame)
+        write_daily_data(daily)
+        campaign_ids = set(daily['campaign_id'].tolist())
+        dates = set(daily['date'].dt.date)
+
+    return {
+        'rows_processed': rows_processed,
+        'rows_failed': total_rows - rows_processed,
+        'clients_updated': len(client_emails),
+        'client_emails': client_emails,
+        'campaign_ids': campaign_ids,
+        'dates': dates
+    }
@@ -0,0 +1,152 @@
+"""
+Chunked, resumable CSV imports
+Streams a CSV in fixed-size chunks and commits each chunk together with the
+row checkpoint on its CSVImport record, so a killed import resumes where it stopped
+"""
+
+import io
+import logging
+from datetime import datetime
+from app import db
+from models import CSVImport
+import bulk_ingest
+import csv_sniffer
+import event_stream
+import frame_parsing
+import import_archive
+
+
+def count_data_rows(file_path, encoding='utf-8', skiprows=0, **read_kwargs):
+    """Count data rows by scanning for line breaks (quoted multi-line cells over-count slightly)"""
+    lines = 0
+    last = ''
+    raw = csv_sniffer.open_csv_bytes(file_path)
+    with io.TextIOWrapper(raw, encoding=encoding, errors='replace', newline='') as f:
+        for block in iter(lambda: f.read(1024 * 1024), ''):
+            lines += block.count('\n')
+            last = block[-1]
+    if last and last != '\n':
+        lines += 1
+    return max(0, lines - (skiprows or 0) - 1)
+
+
+def run_chunked_import(csv_import, normalize, chunk_size=frame_parsing.CHUNK_SIZE, **read_kwargs):
+    """
+    Stream csv_import.file_path through normalize() and the bulk ingestion engine.
+    Each chunk's data and the advanced checkpoint are committed in one transaction,
+    after the normalized chunk is archived for replay; Campaign totals are rolled
+    up once when the import completes.
+    """
+    csv_import.status = 'Processing'
+    csv_import.checkpoint_row = csv_import.checkpoint_row or 0
+    csv_import.rows_processed = csv_import.rows_processed or 0
+    csv_import.rows_failed = csv_import.rows_failed or 0
+    csv_import.error_message = None
+    if not csv_import.rows_total:
+        csv_import.rows_total = count_data_rows(csv_import.file_path, **read_kwargs)
+    event_stream.import_changed(csv_import)
+    db.session.commit()
+
+    client_emails = set()
+    campaign_ids = set()
+    dates = set()
+    if csv_import.checkpoint_row:
+        logging.info(f"Resuming import {csv_import.id} from row {csv_import.checkpoint_row}")
+        # Chunks committed before the interruption were never rolled up; their archives say what they touched
+        committed = import_archive.committed_days(csv_import, csv_import.checkpoint_row)
+        campaign_ids.update(committed['campaign_id'].tolist())
+        dates.update(committed['date'].dt.date)
+
+    try:
+        for chunk in frame_parsing.iter_chunks(csv_import.file_path, csv_import.checkpoint_row, chunk_size, **read_kwargs):
+            frame = normalize(chunk)
+            import_archive.write_chunk(csv_import, csv_import.checkpoint_row, frame)
+            counts = bulk_ingest.ingest_frame(frame)
+            client_emails.update(counts['client_emails'])
+            campaign_ids.update(counts['campaign_ids'])
+            dates.update(counts['dates'])
+
+            csv_import.rows_processed += counts['rows_processed']
+            csv_import.rows_failed += counts['rows_failed']
+            csv_import.checkpoint_row += len(chunk)
+            event_stream.import_changed(csv_import)
+            db.session.commit()
+            logging.info(f"Import {csv_import.id}: committed through row {csv_import.checkpoint_row}")
+    except Exception:
+        # The chunks committed so far stay: bring their campaigns' totals in step with them
+        db.session.rollback()
+        rollup_committed(campaign_ids, dates)
+        raise
+
+    # Campaign totals are rolled up from the daily data once, with the completion
+    bulk_ingest.rollup_campaign_totals(campaign_ids, dates)
+
+    csv_import.status = 'Completed'
+    csv_import.rows_total = csv_import.checkpoint_row
+    csv_import.completed_at = datetime.utcnow()
+    event_stream.import_changed(csv_import)
+    db.session.commit()
+
+    return {
+        'success': True,
+        'rows_processed': csv_import.rows_processed,
+        'rows_failed': csv_import.rows_failed,
+        'clients_updated': len(client_emails)
+    }
+
+
+def rollup_committed(campaign_ids, dates):
+    """Roll up the campaigns a failed import touched; a failure here must not hide the original error"""
+    try:
+        bulk_ingest.rollup_campaign_totals(campaign_ids, dates)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Rolling up totals after a failed import failed: {str(e)}")
+
+
+def mark_import_failed(import_id, error):
+    """Record a failed import, keeping its checkpoint so it can be resumed"""
+    db.session.rollback()
+    csv_import = CSVImport.query.get(import_id)
+    csv_import.status = 'Failed'
+    csv_import.error_message = str(error)
+    csv_import.completed_at = datetime.utcnow()
+    event_stream.import_changed(csv_import)
+    db.session.commit()
+
+
+def run_import(import_id):
+    """Run (or continue) an import with the importer recorded on its CSVImport"""
+    csv_import = CSVImport.query.get(import_id)
+
+    if csv_import.import_type == 'agency':
+        from agency_management import process_agency_csv
+        return process_agency_csv(csv_import.file_path, csv_import.id, csv_import.platform)
+    if csv_import.import_type == 'agency_auto':
+        from agency_csv_processor import AgencyCSVProcessor
+        return AgencyCSVProcessor().process_csv_file(csv_import.file_path, import_id=csv_import.id)
+
+    from csv_processor import process_csv_file
+    return process_csv_file(csv_import.file_path, csv_import.id)
+
+
+def resume_import(import_id):
+    """Continue an interrupted or failed import from its last committed checkpoint"""
+    csv_import = CSVImport.query.get(import_id)
+    if csv_import is None:
+        return {'success': False, 'error': f'Import {import_id} not found'}
+    if csv_import.status in ('Completed', 'Duplicate'):
+        return {'success': False, 'error': 'Import already completed'}
+
+    return run_import(import_id)
+
+
+def resume_interrupted_imports():
+    """Resume imports left queued or in Processing by a crashed or restarted worker"""
+    stalled = CSVImport.query.filter(CSVImport.status.in_(['Pending', 'Processing'])).all()
+    for csv_import in stalled:
+        logging.info(f"Resuming interrupted import {csv_import.id} ({csv_import.filename})")
+        result = resume_import(csv_import.id)
+        if not result['success']:
+            logging.error(f"Could not resume import {csv_import.id}: {result['error']}")
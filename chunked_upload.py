@@ -0,0 +1,164 @@
+"""
+Resumable chunked uploads
+Large exports are sent as a series of PUTs that are appended straight to a
+partial file and hashed as they arrive; the client can ask for the received
+offset and continue after a dropped connection. The assembled file joins the
+content-addressed store and the normal CSVImport pipeline.
+"""
+
+import os
+import uuid
+import hashlib
+import logging
+import threading
+from flask import url_for
+from app import app, db
+from models import ChunkedUpload, CSVImport
+import upload_store
+
+# Chunk size suggested to clients; each PUT body must stay under MAX_CONTENT_LENGTH
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+
+# Largest file accepted through the chunked endpoint
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 4 * 1024 * 1024 * 1024))
+
+# upload id -> (bytes hashed, running sha256); rebuilt from the partial file after a restart
+_hashers = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+
+def partial_path(upload):
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'partial', upload.id + '.part')
+
+
+def received_bytes(upload):
+    path = partial_path(upload)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _upload_lock(upload_id):
+    with _registry_lock:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+
+def upload_state(upload):
+    """JSON-friendly state of an upload, including the import once it is assembled"""
+    state = {
+        'upload_id': upload.id,
+        'filename': upload.filename,
+        'size': upload.total_size,
+        'offset': upload.total_size if upload.status == 'Complete' else received_bytes(upload),
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'status': upload.status,
+        'upload_url': url_for('upload_chunk', upload_id=upload.id)
+    }
+    if upload.import_id:
+        state['import_id'] = upload.import_id
+        state['status_url'] = url_for('import_status', import_id=upload.import_id)
+    return state
+
+
+def start_upload(filename, total_size, import_type, platform, user_id):
+    """Register a new chunked upload and create its empty partial file"""
+    upload = ChunkedUpload(
+        id=uuid.uuid4().hex,
+        filename=filename,
+        total_size=total_size,
+        import_type=import_type,
+        platform=platform,
+        user_id=user_id
+    )
+    path = partial_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+    db.session.add(upload)
+    db.session.commit()
+    logging.info(f"Started chunked upload {upload.id} for {filename} ({total_size} bytes)")
+    return upload
+
+
+def _hasher_at(upload, offset):
+    """sha256 over the first `offset` bytes (a copy of the in-memory state when it is current)"""
+    hashed, digest = _hashers.get(upload.id, (None, None))
+    if hashed == offset:
+        return digest.copy()
+
+    # Process restarted or the client rewound: rehash what is on disk
+    digest = hashlib.sha256()
+    remaining = offset
+    with open(partial_path(upload), 'rb') as f:
+        while remaining:
+            block = f.read(min(upload_store.BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest
+
+
+def write_chunk(upload, offset, stream):
+    """
+    Append a request body at `offset`, hashing it on the way, and return the
+    new received size. An offset behind the received size overwrites from
+    there (a resent chunk); one beyond it is rejected.
+    """
+    with _upload_lock(upload.id):
+        received = received_bytes(upload)
+        if offset > received:
+            raise ValueError(f'Offset {offset} is past the {received} bytes received')
+
+        digest = _hasher_at(upload, offset)
+        # Until this write completes the cached state may not match the file
+        _hashers.pop(upload.id, None)
+        limit = upload.total_size - offset
+        written = 0
+        with open(partial_path(upload), 'r+b') as out:
+            out.seek(offset)
+            out.truncate()
+            for block in iter(lambda: stream.read(upload_store.BLOCK_SIZE), b''):
+                written += len(block)
+                if written > limit:
+                    raise ValueError('Chunk runs past the announced file size')
+                digest.update(block)
+                out.write(block)
+
+        _hashers[upload.id] = (offset + written, digest)
+        return offset + written
+
+
+def finish_upload(upload):
+    """Move the assembled file into the store and queue its import. Returns (message, category, csv_import)"""
+    with _upload_lock(upload.id):
+        # A concurrent retry of the last chunk may have assembled it already
+        db.session.refresh(upload)
+        if upload.status == 'Complete':
+            return 'Upload already complete.', 'info', CSVImport.query.get(upload.import_id)
+        return _assemble(upload)
+
+
+def _assemble(upload):
+    hashed, digest = _hashers.pop(upload.id, (None, None))
+    if hashed != upload.total_size:
+        digest = _hasher_at(upload, upload.total_size)
+    content_hash = digest.hexdigest()
+
+    extension = os.path.splitext(upload.filename)[1].lower() or '.csv'
+    file_path = upload_store.add_to_store(partial_path(upload), content_hash, extension)
+
+    filename = upload.filename
+    if upload.import_type == 'agency':
+        filename = f"{upload.platform}_{filename}"
+    message, category, csv_import = upload_store.queue_upload(
+        filename, content_hash, file_path, upload.import_type, upload.platform, upload.user_id
+    )
+
+    upload.status = 'Complete'
+    upload.import_id = csv_import.id
+    db.session.commit()
+
+    with _registry_lock:
+        _locks.pop(upload.id, None)
+    logging.info(f"Chunked upload {upload.id} assembled ({upload.total_size} bytes) as import {csv_import.id}")
+    return message, category, csv_import
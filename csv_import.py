@@ -1,13 +1,15 @@
 import pandas as pd
 import os
-from datetime import datetime
 from app import app, db
-from models import User, Campaign, CampaignData, CSVImport
+from models import User, Campaign, CSVImport
+from werkzeug.security import generate_password_hash
+import bulk_ingest
+import csv_sniffer
+import user_provisioning
 
 import pandas as pd
-from datetime import datetime
 from app import app, db
-from models import User, Campaign, CampaignData
+from models import User, Campaign
 
 # Define field mappings with synonyms
 COLUMN_SYNONYMS = {
@@ -34,10 +36,8 @@ def match_column(df, standard_name):
 
 def process_csv_file(file_path):
     """Process uploaded CSV file and import campaign data with fuzzy matching and partial support"""
-    try:
-        df = pd.read_csv(file_path, encoding='utf-16', sep=None, engine='python')  # auto-detect separator
-    except UnicodeDecodeError:
-        df = pd.read_csv(file_path, encoding='windows-1252', sep=None, engine='python')
+    # Sniff encoding/separator from the first few KB, then parse once with the C engine
+    df = pd.read_csv(file_path, **csv_sniffer.read_options(csv_sniffer.sniff_csv(file_path)))
 
     field_map = {}
     for field in COLUMN_SYNONYMS.keys():
@@ -47,58 +47,57 @@ def process_csv_file(file_path):
 
     rows_processed = 0
     rows_failed = 0
+    campaign_ids = set()
+    daily_rows = []
+
+    # Create every unknown client in one insert; they set a password from their invite link
+    user_ids = {}
+    if 'client_email' in field_map:
+        user_ids = user_provisioning.provision_users(df[field_map['client_email']].dropna().unique())
 
     for _, row in df.iterrows():
         try:
             if 'client_email' not in field_map:
                 continue  # Cannot associate user
             
-            email = row[field_map['client_email']]
-            user = User.query.filter_by(email=email).first()
-            if not user:
-                username = email.split('@')[0]
-                user = User(username=username, email=email)
-                user.set_password('temp123')
-                db.session.add(user)
-                db.session.flush()
+            email = str(row[field_map['client_email']]).strip()
+            user_id = user_ids[email]
             
             name = row.get(field_map.get('campaign_name'), 'Unnamed')
             platform = row.get(field_map.get('platform'), 'Unknown')
-            campaign = Campaign.query.filter_by(name=name, platform=platform, user_id=user.id).first()
+            campaign = Campaign.query.filter_by(name=name, platform=platform, user_id=user_id).first()
             if not campaign:
                 campaign = Campaign(
                     name=name,
                     platform=platform,
                     status=row.get(field_map.get('status'), 'active'),
                     budget=float(row.get(field_map.get('budget'), 0.0)),
-                    user_id=user.id
+                    user_id=user_id
                 )
                 db.session.add(campaign)
                 db.session.flush()
 
-            # Update campaign
-            for key in ['spent', 'impressions', 'clicks', 'reach', 'budget', 'status']:
+            # Update campaign settings; totals are rolled up from the daily data below
+            for key in ['budget', 'status']:
                 if key in field_map:
                     val = row.get(field_map[key])
                     if pd.notna(val):
-                        setattr(campaign, key, float(val) if key in ['spent', 'budget'] else int(val) if key != 'status' else val)
-            campaign.updated_at = datetime.utcnow()
-            campaign.calculate_metrics()
+                        setattr(campaign, key, float(val) if key == 'budget' else val)
+            campaign_ids.add(campaign.id)
 
             # Daily data
             if 'date' in field_map:
                 date_str = row.get(field_map['date'])
                 campaign_date = pd.to_datetime(date_str, errors='coerce')
                 if pd.notna(campaign_date):
-                    daily_data = CampaignData(
+                    daily_rows.append(dict(
                         campaign_id=campaign.id,
                         date=campaign_date.date(),
                         impressions=int(row.get(field_map.get('impressions'), 0)),
                         clicks=int(row.get(field_map.get('clicks'), 0)),
                         spent=float(row.get(field_map.get('spent'), 0.0)),
                         reach=int(row.get(field_map.get('reach'), 0)),
-                    )
-                    db.session.add(daily_data)
+                    ))
 
             rows_processed += 1
 
@@ -107,6 +106,9 @@ def process_csv_file(file_path):
             rows_failed += 1
             continue
 
+    # Repeated (campaign, date) rows are merged and upserted in one statement
+    bulk_ingest.write_daily_rows(daily_rows)
+    bulk_ingest.rollup_campaign_totals(campaign_ids, {row['date'] for row in daily_rows})
     db.session.commit()
     return True, f"Processed {rows_processed} rows, {rows_failed} failed"
        
@@ -125,9 +127,10 @@ def create_sample_data():
             {'username': 'mike_wilson', 'email': 'mike.wilson@company.com', 'first_name': 'Mike', 'last_name': 'Wilson'}
         ]
         
+        # Demo accounts share one password, so hash it once rather than per user
+        password_hash = generate_password_hash('demo123')
         for user_data in users_data:
-            user = User(**user_data)
-            user.set_password('demo123')
+            user = User(password_hash=password_hash, **user_data)
             db.session.add(user)
         
         db.session.commit()
@@ -1,8 +1,13 @@
 import pandas as pd
 import logging
-from datetime import datetime
 from app import db
-from models import Campaign, CampaignData, CSVImport, User
+from models import Campaign, CSVImport
+import bulk_ingest
+import chunked_import
+import csv_sniffer
+import frame_parsing
+import import_validation
+import schema_registry
 
 # Synonym mapping for flexible column matching
 COLUMN_SYNONYMS = {
@@ -20,110 +25,92 @@ COLUMN_SYNONYMS = {
 
 def match_column(df, standard_name):
     candidates = [standard_name] + COLUMN_SYNONYMS.get(standard_name, [])
+    # Case-insensitive lookup, first matching column wins
+    columns = {}
+    for col in df.columns:
+        columns.setdefault(str(col).strip().lower(), col)
     for candidate in candidates:
-        for col in df.columns:
-            if col.strip().lower() == candidate.lower():
-                return col
+        if candidate.lower() in columns:
+            return columns[candidate.lower()]
     return None
 
+def build_field_map(columns, client_identifier_column='client_email'):
+    """Match the header against COLUMN_SYNONYMS and check the required fields"""
+    header_df = pd.DataFrame(columns=columns)
+    field_map = {}
+    for field in COLUMN_SYNONYMS.keys():
+        matched = match_column(header_df, field)
+        if matched:
+            field_map[field] = matched
+
+    required_core = [client_identifier_column, 'campaign_name', 'platform', 'date', 'impressions', 'clicks', 'spent']
+    for col in required_core:
+        if col not in field_map:
+            raise ValueError(f"Missing required column or synonym: {col}")
+
+    return field_map, None
+
+def normalize_chunk(df, plan, client_identifier_column='client_email'):
+    """Map a chunk onto the standard ingestion columns, converting whole columns at once"""
+    return pd.DataFrame({
+        'client_email': frame_parsing.clean_text(plan.column(df, client_identifier_column)),
+        'campaign_name': frame_parsing.clean_text(plan.column(df, 'campaign_name')),
+        'platform': frame_parsing.clean_text(plan.column(df, 'platform')).fillna('Unknown'),
+        'date': plan.dates(df, fill_invalid=False),
+        'impressions': plan.integer(df, 'impressions'),
+        'clicks': plan.integer(df, 'clicks'),
+        'spent': plan.numeric(df, 'spent'),
+        'reach': plan.integer(df, 'reach'),
+        'budget': plan.numeric(df, 'budget'),
+        'status': frame_parsing.clean_text(plan.column(df, 'status', None)).fillna('In-Progress')
+    }, index=df.index)
+
+def dry_run_csv(file_path, client_identifier_column='client_email'):
+    """Validate every row of a client CSV the way process_csv_file would import it, without writing anything"""
+    try:
+        read_options = csv_sniffer.read_options(csv_sniffer.sniff_csv(file_path))
+        columns = frame_parsing.read_header(file_path, **read_options)
+
+        plan = schema_registry.preview_plan(
+            'client', columns, [COLUMN_SYNONYMS, client_identifier_column],
+            lambda header: build_field_map(header, client_identifier_column),
+            lambda: pd.read_csv(file_path, nrows=frame_parsing.SAMPLE_ROWS, **read_options)
+        )
+
+        return import_validation.validate_file(
+            file_path, plan,
+            lambda chunk: normalize_chunk(chunk, plan, client_identifier_column),
+            **read_options
+        )
+
+    except Exception as e:
+        logging.error(f"CSV dry run failed: {str(e)}")
+        return {'success': False, 'valid': False, 'error': str(e)}
+
 def process_csv_file(file_path, import_id, client_identifier_column='client_email'):
     try:
         csv_import = CSVImport.query.get(import_id)
-        csv_import.status = 'Processing'
-        db.session.commit()
 
-        try:
-            df = pd.read_csv(file_path, encoding='utf-8')
-        except UnicodeDecodeError:
-            df = pd.read_csv(file_path, encoding='ISO-8859-1')
-
-        field_map = {}
-        for field in COLUMN_SYNONYMS.keys():
-            matched = match_column(df, field)
-            if matched:
-                field_map[field] = matched
-
-        required_core = [client_identifier_column, 'campaign_name', 'platform', 'date', 'impressions', 'clicks', 'spent']
-        for col in required_core:
-            if col not in field_map:
-                raise ValueError(f"Missing required column or synonym: {col}")
-
-        rows_processed = 0
-        rows_failed = 0
-
-        for index, row in df.iterrows():
-            try:
-                client_identifier = row.get(field_map.get(client_identifier_column))
-                user = User.query.filter_by(email=client_identifier).first()
-                if not user:
-                    logging.warning(f"Client not found: {client_identifier}")
-                    rows_failed += 1
-                    continue
-
-                name = row.get(field_map.get('campaign_name'), 'Unnamed')
-                platform = row.get(field_map.get('platform'), 'Unknown')
-                campaign = Campaign.query.filter_by(name=name, platform=platform, user_id=user.id).first()
-                if not campaign:
-                    campaign = Campaign(
-                        name=name,
-                        platform=platform,
-                        user_id=user.id,
-                        budget=float(row.get(field_map.get('budget'), 0)),
-                        status=row.get(field_map.get('status'), 'In-Progress')
-                    )
-                    db.session.add(campaign)
-                    db.session.flush()
-
-                campaign.impressions += int(row.get(field_map.get('impressions'), 0))
-                campaign.clicks += int(row.get(field_map.get('clicks'), 0))
-                campaign.spent += float(row.get(field_map.get('spent'), 0))
-                campaign.reach = max(campaign.reach or 0, int(row.get(field_map.get('reach'), 0)))
-                campaign.calculate_ctr()
-
-                data_date = pd.to_datetime(row.get(field_map.get('date')), errors='coerce')
-                if pd.isna(data_date):
-                    raise ValueError("Invalid date format")
-                data_date = data_date.date()
-
-                daily_data = CampaignData.query.filter_by(campaign_id=campaign.id, date=data_date).first()
-                if daily_data:
-                    daily_data.impressions += int(row.get(field_map.get('impressions'), 0))
-                    daily_data.clicks += int(row.get(field_map.get('clicks'), 0))
-                    daily_data.spent += float(row.get(field_map.get('spent'), 0))
-                    daily_data.reach = max(daily_data.reach or 0, int(row.get(field_map.get('reach'), 0)))
-                else:
-                    daily_data = CampaignData(
-                        campaign_id=campaign.id,
-                        date=data_date,
-                        impressions=int(row.get(field_map.get('impressions'), 0)),
-                        clicks=int(row.get(field_map.get('clicks'), 0)),
-                        spent=float(row.get(field_map.get('spent'), 0)),
-                        reach=int(row.get(field_map.get('reach'), 0))
-                    )
-                    db.session.add(daily_data)
-
-                rows_processed += 1
-
-            except Exception as e:
-                logging.error(f"Error processing row {index}: {str(e)}")
-                rows_failed += 1
-                continue
-
-        csv_import.status = 'Completed'
-        csv_import.rows_processed = rows_processed
-        csv_import.rows_failed = rows_failed
-        csv_import.completed_at = datetime.utcnow()
-        db.session.commit()
+        read_options = csv_sniffer.read_options(csv_sniffer.detect_format(csv_import))
+        columns = frame_parsing.read_header(file_path, **read_options)
+
+        plan = schema_registry.resolve_plan(
+            'client', columns, [COLUMN_SYNONYMS, client_identifier_column],
+            lambda header: build_field_map(header, client_identifier_column),
+            lambda: pd.read_csv(file_path, nrows=frame_parsing.SAMPLE_ROWS, **read_options)
+        )
 
-        logging.info(f"CSV import completed: {rows_processed} rows processed, {rows_failed} rows failed")
-        return {'success': True, 'rows_processed': rows_processed, 'rows_failed': rows_failed}
+        result = chunked_import.run_chunked_import(
+            csv_import,
+            lambda chunk: normalize_chunk(chunk, plan, client_identifier_column),
+            **read_options
+        )
+
+        logging.info(f"CSV import completed: {result['rows_processed']} rows processed, {result['rows_failed']} rows failed")
+        return {'success': True, 'rows_processed': result['rows_processed'], 'rows_failed': result['rows_failed']}
 
     except Exception as e:
-        csv_import = CSVImport.query.get(import_id)
-        csv_import.status = 'Failed'
-        csv_import.error_message = str(e)
-        csv_import.completed_at = datetime.utcnow()
-        db.session.commit()
+        chunked_import.mark_import_failed(import_id, e)
 
         logging.error(f"CSV import failed: {str(e)}")
         return {'success': False, 'error': str(e)}
@@ -176,19 +163,16 @@ def create_sample_campaigns(user_id):
                 reach=campaign_data['reach'],
                 status=campaign_data['status']
             )
-            campaign.calculate_ctr()
+            campaign.calculate_metrics()
             db.session.add(campaign)
 
+        bulk_ingest.bump_data_versions([user_id])
         db.session.commit()
         logging.info(f"Created sample campaigns for user {user_id}")
 
 def validate_csv_format(file_path):
-    try:
-        df = pd.read_csv(file_path, nrows=1)
-        required_columns = ['campaign_name', 'platform', 'date', 'impressions', 'clicks', 'spent']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            return False, f"Missing required columns: {', '.join(missing_columns)}"
+    """Full-file dry run reduced to (is_valid, message)"""
+    report = dry_run_csv(file_path)
+    if report['success'] and report['valid']:
         return True, "CSV format is valid"
-    except Exception as e:
-        return False, f"Error reading CSV: {str(e)}"
+    return False, import_validation.summary(report)
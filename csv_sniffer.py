@@ -0,0 +1,163 @@
+"""
+Encoding and dialect sniffing for CSV imports
+Looks at the first few KB of a file only (BOM, UTF-16, delimiter, quoting and
+report preamble lines) so the full file is parsed exactly once with the C engine
+"""
+
+import os
+import csv
+import gzip
+import codecs
+import json
+import logging
+import zipfile
+
+SAMPLE_BYTES = 64 * 1024
+
+# Accepted import files; compressed ones are decompressed as a stream while parsing
+CSV_EXTENSIONS = ('.csv', '.csv.gz', '.zip')
+
+CANDIDATE_DELIMITERS = [',', ';', '\t', '|']
+
+# Longest BOMs first: the UTF-32 LE BOM starts with the UTF-16 LE one
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+
+def is_csv_file(filename):
+    return filename.lower().endswith(CSV_EXTENSIONS)
+
+
+def is_compressed(filename):
+    return filename.lower().endswith(('.gz', '.zip'))
+
+
+def open_csv_bytes(file_path):
+    """
+    Binary stream of a CSV file's content. .gz files and single-file .zip
+    archives are decompressed on the fly (the same files pandas infers from
+    the extension), so no decompressed copy is written to disk.
+    """
+    lower = file_path.lower()
+    if lower.endswith('.gz'):
+        return gzip.open(file_path, 'rb')
+    if lower.endswith('.zip'):
+        archive = zipfile.ZipFile(file_path)
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        if len(members) != 1:
+            archive.close()
+            raise ValueError(f"Expected one CSV inside {os.path.basename(file_path)}, found {len(members)} files")
+        # The member keeps the archive's file open until it is closed itself
+        member = archive.open(members[0])
+        archive.close()
+        return member
+    return open(file_path, 'rb')
+
+
+def sniff_encoding(raw):
+    """Guess the text encoding of a byte sample"""
+    for bom, encoding in BOMS:
+        if raw.startswith(bom):
+            return encoding
+
+    # UTF-16 without a BOM: mostly-ASCII text leaves every other byte NUL
+    half = len(raw) // 2
+    if half:
+        even_nuls = raw[0::2].count(0)
+        odd_nuls = raw[1::2].count(0)
+        if odd_nuls > half * 0.4 and even_nuls < half * 0.1:
+            return 'utf-16-le'
+        if even_nuls > half * 0.4 and odd_nuls < half * 0.1:
+            return 'utf-16-be'
+
+    try:
+        # final=False tolerates a multi-byte character cut off at the sample boundary
+        codecs.getincrementaldecoder('utf-8')().decode(raw, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    try:
+        raw.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return 'latin1'
+
+
+def sample_lines(raw, encoding, max_lines=50):
+    """Decode a byte sample into complete lines"""
+    text = raw.decode(encoding, errors='ignore')
+    if '\n' in text and len(raw) >= SAMPLE_BYTES:
+        # Drop the line cut off at the end of the sample
+        text = text[:text.rfind('\n')]
+    return [line for line in text.splitlines() if line.strip()][:max_lines]
+
+
+def sniff_dialect(lines):
+    """Return (delimiter, quotechar) for the sampled lines"""
+    try:
+        dialect = csv.Sniffer().sniff('\n'.join(lines[:20]), delimiters=''.join(CANDIDATE_DELIMITERS))
+        return dialect.delimiter, dialect.quotechar or '"'
+    except csv.Error:
+        # Fall back to the delimiter that occurs most often per line
+        counts = {d: min(line.count(d) for line in lines) if lines else 0 for d in CANDIDATE_DELIMITERS}
+        delimiter = max(counts, key=counts.get)
+        return (delimiter if counts[delimiter] else ','), '"'
+
+
+def count_preamble_lines(lines, delimiter, quotechar):
+    """Count title lines (e.g. 'Campaign report', 'All time') above the real header"""
+    filled = [sum(1 for field in row if field.strip()) for row in csv.reader(lines, delimiter=delimiter, quotechar=quotechar)]
+    if not filled:
+        return 0
+    widest = max(filled)
+    for index, count in enumerate(filled):
+        if count * 2 > widest:
+            return index
+    return 0
+
+
+def sniff_csv(file_path):
+    """Detect encoding, delimiter, quoting and preamble from the first SAMPLE_BYTES of a file"""
+    with open_csv_bytes(file_path) as f:
+        raw = f.read(SAMPLE_BYTES)
+
+    encoding = sniff_encoding(raw)
+    lines = sample_lines(raw, encoding)
+    delimiter, quotechar = sniff_dialect(lines)
+    detected = {
+        'encoding': encoding,
+        'delimiter': delimiter,
+        'quotechar': quotechar,
+        'skiprows': count_preamble_lines(lines, delimiter, quotechar)
+    }
+    logging.info(f"Sniffed {file_path}: {detected}")
+    return detected
+
+
+def read_options(detected):
+    """pd.read_csv keyword arguments for a sniffed format (always the C engine)"""
+    return {
+        'engine': 'c',
+        'encoding': detected['encoding'],
+        # A stray byte after the sampled region must not abort a streamed import
+        'encoding_errors': 'replace',
+        'sep': detected['delimiter'],
+        'quotechar': detected['quotechar'],
+        'skiprows': detected['skiprows']
+    }
+
+
+def detect_format(csv_import):
+    """Sniff the import's file once and store the result on the record so replays skip sniffing"""
+    if csv_import.detected_format:
+        return json.loads(csv_import.detected_format)
+
+    detected = sniff_csv(csv_import.file_path)
+    csv_import.detected_format = json.dumps(detected)
+    return detected
@@ -0,0 +1,118 @@
+"""
+Dashboard queries
+KPIs and the per-platform breakdown come from one GROUP BY over the client's
+campaigns returning plain tuples; only the campaigns actually shown on the
+page are loaded. The context holds plain values only so view_cache can keep it.
+"""
+
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import db
+from models import Campaign
+import metric_rollups
+
+# Campaign cards shown per dashboard page
+DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', 3))
+
+# Days of history in the dashboard chart
+CHART_DAYS = 30
+
+
+def platform_stats(user_id):
+    """{platform: campaigns, budget, spent, impressions, clicks, reach} for one client"""
+    rows = db.session.query(
+        Campaign.platform,
+        func.count(Campaign.id),
+        func.coalesce(func.sum(Campaign.budget), 0.0),
+        func.coalesce(func.sum(Campaign.spent), 0.0),
+        func.coalesce(func.sum(Campaign.impressions), 0),
+        func.coalesce(func.sum(Campaign.clicks), 0),
+        func.coalesce(func.sum(Campaign.reach), 0)
+    ).filter(Campaign.user_id == user_id).group_by(Campaign.platform).order_by(Campaign.platform).all()
+
+    return {
+        platform: {
+            'campaigns': campaigns,
+            'budget': float(budget),
+            'spent': float(spent),
+            'impressions': int(impressions),
+            'clicks': int(clicks),
+            'reach': int(reach)
+        }
+        for platform, campaigns, budget, spent, impressions, clicks, reach in rows
+    }
+
+
+def summary(stats):
+    """Account totals and derived CTR/CPC/CPM/CPV/CPA from the per-platform rows"""
+    totals = {
+        name: sum(platform[name] for platform in stats.values())
+        for name in ['campaigns', 'budget', 'spent', 'impressions', 'clicks', 'reach']
+    }
+    metrics = Campaign.derive_metrics(totals['impressions'], totals['clicks'], totals['spent'], totals['reach'])
+    totals.update({name: round(value, 2) for name, value in metrics.items()})
+    return totals
+
+
+def campaign_page(user_id, page=1, per_page=DASHBOARD_PAGE_SIZE):
+    """The campaigns shown on one dashboard page, oldest first"""
+    return Campaign.query.filter_by(user_id=user_id).order_by(Campaign.id).paginate(
+        page=page, per_page=per_page, error_out=False
+    )
+
+
+def campaign_names(user_id):
+    """(id, name) tuples for the campaign picker, without loading the campaigns"""
+    return db.session.query(Campaign.id, Campaign.name).filter(Campaign.user_id == user_id).order_by(Campaign.id).all()
+
+
+def page_info(pagination):
+    """The pagination fields the templates use, without the query behind them"""
+    return {
+        'page': pagination.page,
+        'pages': pagination.pages,
+        'per_page': pagination.per_page,
+        'total': pagination.total,
+        'has_prev': pagination.has_prev,
+        'has_next': pagination.has_next,
+        'prev_num': pagination.prev_num,
+        'next_num': pagination.next_num
+    }
+
+
+def dashboard_metrics(user_id):
+    """KPI cards, chart series and platform stats; the JSON metrics endpoint serves exactly this"""
+    stats = platform_stats(user_id)
+    totals = summary(stats)
+
+    end_date = datetime.now().date()
+    chart_data = metric_rollups.trend(user_id, end_date - timedelta(days=CHART_DAYS), end_date)
+
+    return {
+        'total_impressions': totals['impressions'],
+        'total_clicks': totals['clicks'],
+        'total_reach': totals['reach'],
+        'total_budget': totals['budget'],
+        'total_spent': totals['spent'],
+        'ctr': totals['ctr'],
+        'cpc': totals['cpc'],
+        'cpm': totals['cpm'],
+        'cpa': totals['cpa'],
+        'cpv': totals['cpv'],
+        'chart_dates': [point['period'] for point in chart_data],
+        'impressions_data': [point['impressions'] for point in chart_data],
+        'clicks_data': [point['clicks'] for point in chart_data],
+        'platform_stats': stats
+    }
+
+
+def dashboard_context(user_id, page=1):
+    """Template variables for the dashboard page"""
+    pagination = campaign_page(user_id, page)
+    return dict(
+        dashboard_metrics(user_id),
+        campaigns=[campaign.to_dict() for campaign in pagination.items],
+        pagination=page_info(pagination),
+        campaign_names=campaign_names(user_id)
+    )
@@ -0,0 +1,216 @@
+"""
+Hot/cold tiering of daily campaign data
+CampaignData keeps only the recent days; older days are moved into one
+CampaignDataArchive row per campaign and year holding fixed-width per-day
+arrays (zlib-packed). campaign_days() reads a date range across both tiers.
+"""
+
+import os
+import zlib
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, insert, update
+from app import app, db
+from models import CampaignData, CampaignDataArchive
+
+# Days of daily data kept in the hot CampaignData table
+HOT_DAYS = int(os.environ.get('CAMPAIGN_DATA_HOT_DAYS', 180))
+
+# Campaigns moved per transaction by the tiering job
+TIERING_BATCH = int(os.environ.get('TIERING_BATCH', 500))
+
+YEAR_DAYS = 366
+FORMAT_VERSION = 1
+MASK_BYTES = (YEAR_DAYS + 7) // 8
+
+# Column order and little-endian dtypes of the packed arrays
+PACKED_COLUMNS = [('impressions', '<i8'), ('clicks', '<i8'), ('spent', '<f8'), ('reach', '<i8')]
+
+DAY_COLUMNS = ['campaign_id', 'date', 'impressions', 'clicks', 'spent', 'reach']
+
+
+def pack_year(days):
+    """
+    Pack one campaign-year of daily rows (a frame with 'day' = day of year
+    from 0 and the metric columns) as a presence bitmap plus one 366-slot
+    array per metric
+    """
+    present = np.zeros(YEAR_DAYS, dtype=bool)
+    present[days['day'].to_numpy()] = True
+    parts = [bytes([FORMAT_VERSION]), np.packbits(present).tobytes()]
+    for column, dtype in PACKED_COLUMNS:
+        values = np.zeros(YEAR_DAYS, dtype=dtype)
+        values[days['day'].to_numpy()] = days[column].to_numpy()
+        parts.append(values.tobytes())
+    return zlib.compress(b''.join(parts))
+
+
+def unpack_year(blob):
+    """Day-of-year indexes present in an archive blob and the metric values on those days"""
+    raw = zlib.decompress(blob)
+    if raw[0] != FORMAT_VERSION:
+        raise ValueError(f"Unknown archive format {raw[0]}")
+    present = np.unpackbits(np.frombuffer(raw, dtype=np.uint8, count=MASK_BYTES, offset=1))[:YEAR_DAYS].astype(bool)
+    days = np.nonzero(present)[0]
+
+    values = {}
+    offset = 1 + MASK_BYTES
+    for column, dtype in PACKED_COLUMNS:
+        values[column] = np.frombuffer(raw, dtype=dtype, count=YEAR_DAYS, offset=offset)[days]
+        offset += YEAR_DAYS * 8
+    return days, values
+
+
+def merge_days(frame):
+    """One row per (campaign_id, date): a day present in both tiers sums its metrics and keeps the larger reach"""
+    return frame.groupby(['campaign_id', 'date'], as_index=False, sort=True).agg(
+        impressions=('impressions', 'sum'),
+        clicks=('clicks', 'sum'),
+        spent=('spent', 'sum'),
+        reach=('reach', 'max')
+    )
+
+
+def cold_days(archives, start_date=None, end_date=None):
+    """Unpack (campaign_id, year, data) archive rows into one frame of DAY_COLUMNS, keeping the days inside the optional range"""
+    campaign_ids, dates = [], []
+    metrics = {column: [] for column, _ in PACKED_COLUMNS}
+    for campaign_id, year, data in archives:
+        days, values = unpack_year(data)
+        campaign_ids.append(np.full(len(days), campaign_id, dtype='int64'))
+        dates.append(np.datetime64(f'{year:04d}-01-01', 'D') + days)
+        for column, _ in PACKED_COLUMNS:
+            metrics[column].append(values[column])
+    if not campaign_ids:
+        return pd.DataFrame(columns=DAY_COLUMNS)
+
+    frame = pd.DataFrame({
+        'campaign_id': np.concatenate(campaign_ids),
+        'date': pd.to_datetime(np.concatenate(dates)),
+        **{column: np.concatenate(parts) for column, parts in metrics.items()}
+    }, columns=DAY_COLUMNS)
+    if start_date:
+        frame = frame[frame['date'] >= pd.Timestamp(start_date)]
+    if end_date:
+        frame = frame[frame['date'] <= pd.Timestamp(end_date)]
+    return frame
+
+
+def campaign_days(campaign_ids, start_date, end_date):
+    """Daily rows of some campaigns between two dates, read from the hot table and the archive"""
+    hot = db.session.query(
+        CampaignData.campaign_id, CampaignData.date, CampaignData.impressions,
+        CampaignData.clicks, CampaignData.spent, CampaignData.reach
+    ).filter(
+        CampaignData.campaign_id.in_(campaign_ids),
+        CampaignData.date >= start_date,
+        CampaignData.date <= end_date
+    ).all()
+    frame = pd.DataFrame(hot, columns=DAY_COLUMNS)
+    frame['date'] = pd.to_datetime(frame['date'])
+
+    # Only ranges reaching back past the horizon need the archive
+    if start_date < cutoff_date():
+        archives = db.session.query(
+            CampaignDataArchive.campaign_id, CampaignDataArchive.year, CampaignDataArchive.data
+        ).filter(
+            CampaignDataArchive.campaign_id.in_(campaign_ids),
+            CampaignDataArchive.year >= start_date.year,
+            CampaignDataArchive.year <= end_date.year
+        ).all()
+        if archives:
+            frame = pd.concat([frame, cold_days(archives, start_date, end_date)], ignore_index=True)
+
+    frame[['impressions', 'clicks', 'spent', 'reach']] = frame[['impressions', 'clicks', 'spent', 'reach']].fillna(0)
+    return merge_days(frame)
+
+
+def cutoff_date():
+    """Days before this date belong to the cold tier; readers skip the archive for ranges after it"""
+    return datetime.now().date() - timedelta(days=HOT_DAYS)
+
+
+def _archive_batch(campaign_ids, cutoff):
+    """Fold the cold hot-table rows of some campaigns into their yearly archive rows"""
+    rows = db.session.query(
+        CampaignData.campaign_id, CampaignData.date, CampaignData.impressions,
+        CampaignData.clicks, CampaignData.spent, CampaignData.reach
+    ).filter(CampaignData.campaign_id.in_(campaign_ids), CampaignData.date < cutoff).all()
+    frame = pd.DataFrame(rows, columns=DAY_COLUMNS)
+    frame['date'] = pd.to_datetime(frame['date'])
+    years = sorted(frame['date'].dt.year.unique().tolist())
+
+    existing = db.session.query(
+        CampaignDataArchive.id, CampaignDataArchive.campaign_id, CampaignDataArchive.year, CampaignDataArchive.data
+    ).filter(
+        CampaignDataArchive.campaign_id.in_(campaign_ids),
+        CampaignDataArchive.year.in_(years)
+    ).all()
+    archive_ids = {(campaign_id, year): archive_id for archive_id, campaign_id, year, _ in existing}
+    if existing:
+        archived = cold_days([(campaign_id, year, data) for _, campaign_id, year, data in existing])
+        frame = pd.concat([archived, frame], ignore_index=True)
+    frame[['impressions', 'clicks', 'spent', 'reach']] = frame[['impressions', 'clicks', 'spent', 'reach']].fillna(0)
+    frame = merge_days(frame)
+    frame = frame.assign(year=frame['date'].dt.year, day=frame['date'].dt.dayofyear - 1)
+
+    inserts, updates = [], []
+    now = datetime.utcnow()
+    for (campaign_id, year), days in frame.groupby(['campaign_id', 'year']):
+        values = {
+            'campaign_id': int(campaign_id),
+            'year': int(year),
+            'days': len(days),
+            'impressions': int(days['impressions'].sum()),
+            'clicks': int(days['clicks'].sum()),
+            'spent': float(days['spent'].sum()),
+            'reach': int(days['reach'].max()),
+            'data': pack_year(days),
+            'updated_at': now
+        }
+        archive_id = archive_ids.get((values['campaign_id'], values['year']))
+        if archive_id:
+            updates.append(dict(values, id=archive_id))
+        else:
+            inserts.append(values)
+
+    if inserts:
+        db.session.execute(insert(CampaignDataArchive), inserts)
+    if updates:
+        db.session.execute(update(CampaignDataArchive), updates)
+    db.session.execute(delete(CampaignData).where(
+        CampaignData.campaign_id.in_(campaign_ids), CampaignData.date < cutoff
+    ))
+    return len(rows)
+
+
+def archive_cold_data():
+    """
+    Move daily rows older than the hot horizon into the yearly archive, a
+    batch of campaigns per transaction. Totals and rollups read both tiers,
+    so they do not change.
+    """
+    cutoff = cutoff_date()
+    moved = 0
+    last_id = 0
+    while True:
+        campaign_ids = [campaign_id for campaign_id, in db.session.query(CampaignData.campaign_id).filter(
+            CampaignData.date < cutoff,
+            CampaignData.campaign_id > last_id
+        ).distinct().order_by(CampaignData.campaign_id).limit(TIERING_BATCH)]
+        if not campaign_ids:
+            break
+
+        moved += _archive_batch(campaign_ids, cutoff)
+        db.session.commit()
+        last_id = campaign_ids[-1]
+
+    logging.info(f"Moved {moved} daily rows older than {cutoff} to the archive")
+    return moved
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        print(archive_cold_data())
@@ -0,0 +1,159 @@
+"""
+Server-sent event streams per user
+Imports queue 'import' (progress/completion) and 'metrics' (data changed)
+events on the session; they are published once the transaction commits, to
+every open stream of the user in this process. Changes committed by another
+process (scheduler, other web workers) are picked up by a cheap recheck of
+the user's data version and running imports every STREAM_RECHECK seconds,
+which also serves as the keep-alive. Each open stream holds a worker thread,
+so a process serves at most STREAM_MAX_OPEN of them; clients turned away
+fall back to polling.
+"""
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from sqlalchemy import event, or_
+from sqlalchemy.orm import Session
+from app import db
+from models import CSVImport, User
+import import_jobs
+
+# Seconds between rechecks / keep-alive comments on an idle stream
+STREAM_RECHECK = int(os.environ.get('EVENT_STREAM_RECHECK', 15))
+
+# A stream is closed after this long; EventSource reconnects on its own
+STREAM_MAX_SECONDS = int(os.environ.get('EVENT_STREAM_MAX_SECONDS', 600))
+
+# Open streams per process; keep it well below gunicorn's --threads so other requests still get a thread
+STREAM_MAX_OPEN = int(os.environ.get('EVENT_STREAM_MAX_OPEN', 16))
+
+# Events buffered per stream before a slow reader starts missing them
+STREAM_QUEUE_SIZE = 100
+
+# Milliseconds the browser waits before reconnecting
+RECONNECT_MS = 5000
+
+_subscribers = {}
+_lock = threading.Lock()
+
+
+def subscribe(user_id):
+    """Register a stream for a user and return its event queue, or None when STREAM_MAX_OPEN streams are open"""
+    events = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    with _lock:
+        if sum(len(streams) for streams in _subscribers.values()) >= STREAM_MAX_OPEN:
+            return None
+        _subscribers.setdefault(user_id, set()).add(events)
+    return events
+
+
+def unsubscribe(user_id, events):
+    with _lock:
+        streams = _subscribers.get(user_id, set())
+        streams.discard(events)
+        if not streams:
+            _subscribers.pop(user_id, None)
+
+
+def publish(user_ids, name, data):
+    """Send an event to every open stream of the given users (None: every connected user)"""
+    with _lock:
+        if user_ids is None:
+            streams = [events for group in _subscribers.values() for events in group]
+        else:
+            streams = [events for user_id in user_ids for events in _subscribers.get(user_id, ())]
+    for events in streams:
+        try:
+            events.put_nowait((name, data))
+        except queue.Full:
+            # The reader's next recheck catches it up
+            pass
+
+
+def publish_after_commit(user_ids, name, data):
+    """Queue an event on the current session; it is sent only if the transaction commits"""
+    db.session.info.setdefault('pending_events', []).append((user_ids, name, data))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_pending(session):
+    for user_ids, name, data in session.info.pop('pending_events', []):
+        publish(user_ids, name, data)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_pending(session):
+    session.info.pop('pending_events', None)
+
+
+def import_changed(csv_import):
+    """Queue the import's progress for its uploader; cron imports have nobody to tell"""
+    if csv_import.imported_by:
+        publish_after_commit([csv_import.imported_by], 'import', import_jobs.import_status(csv_import))
+
+
+def metrics_changed(user_ids=None):
+    """Queue a 'metrics' notice for the clients whose data changed (None: everybody)"""
+    publish_after_commit(None if user_ids is None else list(user_ids), 'metrics', {})
+
+
+def format_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+def _current_state(user_id, active_ids):
+    """The user's data version and the imports they started that are running (or were last time)"""
+    version = db.session.query(User.data_version).filter(User.id == user_id).scalar()
+    imports = CSVImport.query.filter(
+        CSVImport.imported_by == user_id,
+        or_(CSVImport.status.in_(['Pending', 'Processing']), CSVImport.id.in_(active_ids))
+    ).all()
+    statuses = {csv_import.id: import_jobs.import_status(csv_import) for csv_import in imports}
+    # Don't hold a read transaction (and the SQLite WAL snapshot) while idle
+    db.session.remove()
+    return version, statuses
+
+
+def open_stream(user_id):
+    """Generator of SSE text for a new connection of a user, or None when this process has no stream slot free"""
+    events = subscribe(user_id)
+    if events is None:
+        logging.warning(f"Event stream for user {user_id} refused: {STREAM_MAX_OPEN} streams already open")
+        return None
+    return _stream(user_id, events)
+
+
+def _stream(user_id, events):
+    started = time.time()
+    try:
+        version, statuses = _current_state(user_id, [])
+        yield f"retry: {RECONNECT_MS}\n\n"
+        for status in statuses.values():
+            yield format_event('import', status)
+
+        next_check = time.time() + STREAM_RECHECK
+        while time.time() - started < STREAM_MAX_SECONDS:
+            try:
+                name, data = events.get(timeout=max(0, next_check - time.time()))
+                yield format_event(name, data)
+                continue
+            except queue.Empty:
+                pass
+
+            latest_version, latest = _current_state(user_id, list(statuses))
+            if latest_version != version:
+                version = latest_version
+                yield format_event('metrics', {})
+            for import_id, status in latest.items():
+                if statuses.get(import_id) != status:
+                    yield format_event('import', status)
+            statuses = {import_id: status for import_id, status in latest.items() if not status['finished']}
+            yield ": keep-alive\n\n"
+            next_check = time.time() + STREAM_RECHECK
+    finally:
+        unsubscribe(user_id, events)
+        logging.debug(f"Event stream for user {user_id} closed")
@@ -0,0 +1,94 @@
+"""
+Agency drop-folder watcher
+Polls uploads/agency_data every few seconds and hands each new CSV to the
+agency processor once it has stopped growing, so dropped exports reach the
+dashboards within seconds instead of at the next 2 AM run
+"""
+
+import os
+import time
+import logging
+from app import app
+import csv_sniffer
+
+# Seconds between scans of the drop folder (0 disables the watcher)
+WATCH_INTERVAL = int(os.environ.get('AGENCY_WATCH_INTERVAL', 5))
+
+# A file must be unchanged for this long before it is treated as complete
+SETTLE_SECONDS = int(os.environ.get('AGENCY_WATCH_SETTLE_SECONDS', 2))
+
+# filename -> (size, mtime) seen on the previous scan
+_last_seen = {}
+
+
+def _csv_stats(data_dir, names):
+    """filename -> (size, mtime) for the CSV files among `names` that still exist"""
+    current = {}
+    for name in names:
+        path = os.path.join(data_dir, name)
+        if not csv_sniffer.is_csv_file(name) or not os.path.isfile(path):
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        current[name] = (stat.st_size, stat.st_mtime)
+    return current
+
+
+def ready_files(data_dir, now=None):
+    """
+    CSV files whose size and mtime did not change since the previous scan and
+    that were last written at least SETTLE_SECONDS ago
+    """
+    now = now or time.time()
+    current = _csv_stats(data_dir, os.listdir(data_dir))
+
+    ready = [
+        name for name, (size, mtime) in current.items()
+        if _last_seen.get(name) == (size, mtime) and now - mtime >= SETTLE_SECONDS
+    ]
+
+    _last_seen.clear()
+    _last_seen.update(current)
+    return sorted(ready)
+
+
+def settled_files(data_dir, names):
+    """
+    The files among `names` that stay unchanged over one SETTLE_SECONDS pass
+    and were last written at least that long ago, for runs that have no
+    previous scan to compare against (the nightly import)
+    """
+    before = _csv_stats(data_dir, names)
+    if not before:
+        return []
+    time.sleep(SETTLE_SECONDS)
+    now = time.time()
+    after = _csv_stats(data_dir, before)
+
+    settled = [
+        name for name, (size, mtime) in after.items()
+        if before[name] == (size, mtime) and now - mtime >= SETTLE_SECONDS
+    ]
+    for name in sorted(set(before) - set(settled)):
+        logging.info(f"Skipping {name}: still being written")
+    return sorted(settled)
+
+
+def scan_agency_folder():
+    """Scheduler job: ingest drop-folder files that have finished copying"""
+    with app.app_context():
+        try:
+            from agency_csv_processor import agency_data_dir, process_agency_csv_files
+            data_dir = agency_data_dir()
+            if not os.path.isdir(data_dir):
+                return
+
+            ready = ready_files(data_dir)
+            if ready:
+                logging.info(f"Watcher picked up {len(ready)} new file(s): {', '.join(ready)}")
+                process_agency_csv_files(csv_files=ready)
+
+        except Exception as e:
+            logging.error(f"Agency folder watcher failed: {str(e)}")
@@ -0,0 +1,206 @@
+"""
+Database-free CSV parsing helpers
+Hashing, chunked reading, column mapping plans and whole-column converters
+that only touch files and pandas frames. Nothing here imports the Flask app,
+so the agency import's worker processes can use it without loading the app
+or its database.
+"""
+
+import os
+import re
+import json
+import hashlib
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Rows per chunk when streaming a CSV
+CHUNK_SIZE = int(os.environ.get('CSV_CHUNK_SIZE', 50000))
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+NUMERIC_FIELDS = ['impressions', 'clicks', 'spent', 'reach', 'budget']
+
+# Characters that ad platforms put inside numeric cells; ',' and '$' are always stripped
+NUMERIC_NOISE = ',$€£৳%'
+
+DATE_FORMATS = [
+    '%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y', '%Y/%m/%d', '%d.%m.%Y', '%d-%m-%Y',
+    '%Y%m%d', '%b %d, %Y', '%d %b %Y', '%d-%b-%Y', '%Y-%m-%d %H:%M:%S'
+]
+
+SAMPLE_ROWS = 1000
+
+
+def header_fingerprint(importer, columns, rules):
+    """Hash the importer, its mapping rules and the exact header row"""
+    payload = json.dumps([importer, rules, [str(column) for column in columns]], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def detect_date_format(series):
+    """Return the first strftime format that parses every sampled value, or None"""
+    values = series.dropna().astype(str).str.strip()
+    values = values[values != '']
+    if values.empty:
+        return None
+    for date_format in DATE_FORMATS:
+        if pd.to_datetime(values, format=date_format, errors='coerce').notna().all():
+            return date_format
+    return None
+
+
+def detect_numeric_strip(series):
+    """Characters to strip before a text column parses as numbers (numeric columns skip cleaning at convert time)"""
+    found = set(',$')
+    if not pd.api.types.is_numeric_dtype(series):
+        text = series.dropna().astype(str)
+        found.update(char for char in NUMERIC_NOISE if text.str.contains(char, regex=False).any())
+    return ''.join(sorted(found))
+
+
+class MappingPlan:
+    """Compiled column mapping and converters for one export layout"""
+
+    def __init__(self, column_map, platform=None, date_format=None, numeric_strip=None):
+        self.column_map = column_map
+        self.platform = platform
+        self.date_format = date_format
+        self.numeric_strip = numeric_strip or {}
+
+    @classmethod
+    def compile(cls, column_map, sample, platform=None):
+        """Build a plan by inspecting a sample of the file's values"""
+        date_format = None
+        if 'date' in column_map:
+            date_format = detect_date_format(sample[column_map['date']])
+        numeric_strip = {
+            field: detect_numeric_strip(sample[column_map[field]])
+            for field in NUMERIC_FIELDS if field in column_map
+        }
+        return cls(column_map, platform, date_format, numeric_strip)
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        return cls(data['column_map'], data.get('platform'), data.get('date_format'), data.get('numeric_strip'))
+
+    def to_json(self):
+        return json.dumps({
+            'platform': self.platform,
+            'column_map': self.column_map,
+            'date_format': self.date_format,
+            'numeric_strip': self.numeric_strip
+        })
+
+    def column(self, df, field, default=0):
+        """The mapped source column for a field, or a constant column when it is not mapped"""
+        if field in self.column_map:
+            return df[self.column_map[field]]
+        return pd.Series(default, index=df.index)
+
+    def numeric(self, df, field):
+        return clean_numeric(self.column(df, field), self.numeric_strip.get(field, ',$'))
+
+    def integer(self, df, field):
+        return clean_integer(self.column(df, field), self.numeric_strip.get(field, ',$'))
+
+    def dates(self, df, fill_invalid=True):
+        return parse_dates(self.column(df, 'date'), fill_invalid=fill_invalid, date_format=self.date_format)
+
+
+def hash_file(file_path):
+    """SHA-256 of a file, read in fixed-size blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_header(file_path, **read_kwargs):
+    """Read only the header row of a CSV"""
+    return pd.read_csv(file_path, nrows=0, **read_kwargs).columns
+
+
+def iter_chunks(file_path, start_row=0, chunk_size=CHUNK_SIZE, skiprows=0, **read_kwargs):
+    """
+    Yield DataFrame chunks of at most chunk_size rows, skipping the first start_row data rows.
+    skiprows is the number of preamble lines above the header.
+    """
+    preamble = skiprows or 0
+    if start_row:
+        skip = lambda line: line < preamble or preamble < line <= preamble + start_row
+    else:
+        skip = preamble or None
+    with pd.read_csv(file_path, chunksize=chunk_size, skiprows=skip, **read_kwargs) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def clean_text(series, lower=False):
+    """Strip a text column and turn blanks / 'nan' into missing values"""
+    text = series.astype('string').str.strip()
+    if lower:
+        text = text.str.lower()
+    return text.mask(text.isna() | (text == '') | (text.str.lower() == 'nan'))
+
+
+def parse_numeric(series, strip=',$'):
+    """Convert a whole column to float, stripping `strip` characters (unparseable values become NaN)"""
+    if pd.api.types.is_numeric_dtype(series):
+        values = pd.to_numeric(series, errors='coerce')
+    else:
+        pattern = '[' + re.escape(strip) + r'\s]' if strip else r'\s'
+        text = series.astype('string').str.replace(pattern, '', regex=True)
+        values = pd.to_numeric(text, errors='coerce')
+    return values.astype(float)
+
+
+def clean_numeric(series, strip=',$'):
+    """Convert a whole column to float, stripping `strip` characters (unparseable values become 0)"""
+    return parse_numeric(series, strip).fillna(0.0)
+
+
+def clean_integer(series, strip=',$'):
+    """Convert a whole column to int with the same truncation as int(float(value))"""
+    return np.trunc(clean_numeric(series, strip)).astype('int64')
+
+
+def parse_dates(series, default=None, fill_invalid=True, date_format=None):
+    """
+    Parse a date column in one pass, using `date_format` when it is known.
+    Bad values fall back to `default` (today), or stay NaT when fill_invalid
+    is False so the rows can be rejected.
+    """
+    if date_format:
+        parsed = pd.to_datetime(series, errors='coerce', format=date_format)
+    else:
+        parsed = pd.to_datetime(series, errors='coerce')
+    retry = parsed.isna() & series.notna()
+    if retry.any():
+        # Files mixing date formats fail the single-format fast path
+        parsed[retry] = pd.to_datetime(series[retry], errors='coerce', format='mixed')
+    if fill_invalid:
+        parsed = parsed.fillna(pd.Timestamp(default or datetime.now().date()))
+    return parsed.dt.normalize()
+
+
+def preaggregate(frame):
+    """
+    Collapse a normalized frame to one row per (client, campaign, platform, date)
+    without touching the database, keeping the source row count in 'rows'.
+    Rows with missing keys are kept as their own groups so ingest_frame still
+    counts them as failed; budget and status come from each group's first row.
+    """
+    if 'rows' not in frame.columns:
+        frame = frame.assign(rows=1)
+    return frame.groupby(['client_email', 'campaign_name', 'platform', 'date'], as_index=False, sort=False, dropna=False).agg(
+        impressions=('impressions', 'sum'),
+        clicks=('clicks', 'sum'),
+        spent=('spent', 'sum'),
+        reach=('reach', 'max'),
+        budget=('budget', 'first'),
+        status=('status', 'first'),
+        rows=('rows', 'sum')
+    )
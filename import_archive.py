@@ -0,0 +1,221 @@
+"""
+Columnar archive of normalized import rows and replay engine
+Every import chunk is saved after column mapping and type conversion as a
+compressed .npz file (one array per column, text as dictionary codes), so
+Campaign/CampaignData can be rebuilt from all past imports in one bulk pass
+without re-reading or re-parsing the original CSVs
+"""
+
+import os
+import time
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete
+from app import app, db
+from models import CampaignData, CampaignDataArchive, CSVImport
+import bulk_ingest
+import data_tiering
+import frame_parsing
+
+
+def archive_dir(csv_import):
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'archive', str(csv_import.id))
+
+
+def _chunk_start(filename):
+    return int(filename.split('.')[0])
+
+
+def chunk_files(path):
+    """Archived chunk files of an import in row order"""
+    if not path or not os.path.isdir(path):
+        return []
+    names = sorted((name for name in os.listdir(path) if name.endswith('.npz')), key=_chunk_start)
+    return [os.path.join(path, name) for name in names]
+
+
+def encode_frame(frame):
+    """Arrays for np.savez: numbers and dates as-is, text as int32 codes plus a unicode dictionary"""
+    arrays = {}
+    for column in frame.columns:
+        values = frame[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            arrays[f'{column}.date'] = values.to_numpy(dtype='datetime64[s]')
+        elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            arrays[column] = values.to_numpy()
+        else:
+            codes, uniques = pd.factorize(values)
+            arrays[f'{column}.codes'] = codes.astype('int32')
+            arrays[f'{column}.uniques'] = np.asarray([str(value) for value in uniques], dtype=str)
+    return arrays
+
+
+def decode_frame(arrays):
+    """Inverse of encode_frame (missing text comes back as NA)"""
+    columns = {}
+    for key in arrays.files:
+        name, _, kind = key.partition('.')
+        if kind == '':
+            columns[name] = arrays[key]
+        elif kind == 'date':
+            columns[name] = pd.to_datetime(arrays[key])
+        elif kind == 'codes':
+            uniques = arrays[f'{name}.uniques']
+            codes = arrays[key]
+            text = pd.Series(uniques[np.maximum(codes, 0)] if len(uniques) else np.full(len(codes), ''), dtype='string')
+            columns[name] = text.mask(codes < 0)
+    return pd.DataFrame(columns)
+
+
+def write_chunk(csv_import, start_row, frame):
+    """
+    Save one normalized chunk, named by its first data row. Files at or after
+    start_row are left over from an interrupted run and are replaced.
+    """
+    path = csv_import.archive_path or archive_dir(csv_import)
+    os.makedirs(path, exist_ok=True)
+    for stale in chunk_files(path):
+        if _chunk_start(os.path.basename(stale)) >= start_row:
+            os.remove(stale)
+
+    target = os.path.join(path, f'{start_row:012d}.npz')
+    with open(target + '.part', 'wb') as f:
+        np.savez_compressed(f, **encode_frame(frame))
+    os.replace(target + '.part', target)
+    csv_import.archive_path = path
+
+
+def read_import(csv_import):
+    """All archived rows of an import, pre-aggregated chunk by chunk"""
+    parts = []
+    for file_path in chunk_files(csv_import.archive_path):
+        with np.load(file_path, allow_pickle=False) as arrays:
+            parts.append(frame_parsing.preaggregate(decode_frame(arrays)))
+    return parts
+
+
+def covered_days(frame):
+    """
+    (campaign_id, date) of the existing daily rows that ingesting `frame`
+    recreates: rows of known clients and existing campaigns with a date
+    """
+    frame = frame[frame['client_email'].notna() & frame['campaign_name'].notna() & frame['date'].notna()]
+    user_ids = bulk_ingest.resolve_users(frame['client_email'].unique().tolist())
+    frame = frame.assign(user_id=frame['client_email'].map(user_ids))
+    frame = frame[frame['user_id'].notna()]
+    if frame.empty:
+        return pd.DataFrame(columns=['campaign_id', 'date'])
+
+    frame = frame.assign(user_id=frame['user_id'].astype('int64'))
+    frame = frame.assign(campaign_id=bulk_ingest.find_campaigns(frame))
+    frame = frame[frame['campaign_id'].notna()]
+    return pd.DataFrame({
+        'campaign_id': frame['campaign_id'].astype('int64'),
+        'date': frame['date'].dt.normalize()
+    }).drop_duplicates()
+
+
+def committed_days(csv_import, before_row):
+    """(campaign_id, date) of the daily rows written by an import's archived chunks that start before `before_row`"""
+    parts = []
+    for file_path in chunk_files(csv_import.archive_path):
+        if _chunk_start(os.path.basename(file_path)) < before_row:
+            with np.load(file_path, allow_pickle=False) as arrays:
+                parts.append(frame_parsing.preaggregate(decode_frame(arrays)))
+    if not parts:
+        return pd.DataFrame(columns=['campaign_id', 'date'])
+    return covered_days(pd.concat(parts, ignore_index=True))
+
+
+def clear_covered_days(covered):
+    """
+    Delete the daily rows a replay recreates and nothing else. Archived years
+    of the affected campaigns are unpacked into the hot table first, so their
+    other days are kept. Returns the number of days deleted.
+    """
+    wanted = pd.MultiIndex.from_frame(covered)
+    deleted = 0
+    for batch in bulk_ingest.chunked(covered['campaign_id'].unique().tolist()):
+        archives = db.session.query(
+            CampaignDataArchive.campaign_id, CampaignDataArchive.year, CampaignDataArchive.data
+        ).filter(CampaignDataArchive.campaign_id.in_(batch)).all()
+        if archives:
+            db.session.execute(delete(CampaignDataArchive).where(CampaignDataArchive.campaign_id.in_(batch)))
+            bulk_ingest.write_daily_data(data_tiering.cold_days(archives))
+
+        rows = db.session.query(CampaignData.id, CampaignData.campaign_id, CampaignData.date).filter(
+            CampaignData.campaign_id.in_(batch)
+        ).all()
+        if not rows:
+            continue
+        hot = pd.DataFrame(rows, columns=['id', 'campaign_id', 'date'])
+        hot['date'] = pd.to_datetime(hot['date'])
+        stale = hot['id'][pd.MultiIndex.from_frame(hot[['campaign_id', 'date']]).isin(wanted)].tolist()
+        for ids in bulk_ingest.chunked(stale):
+            db.session.execute(delete(CampaignData).where(CampaignData.id.in_(ids)))
+        deleted += len(stale)
+    return deleted
+
+
+def replay_imports(force=False):
+    """
+    Rebuild CampaignData and Campaign totals from the archives of every
+    completed import, in import order, in a single transaction.
+    Only the (campaign, day) rows the archives recreate are replaced; daily
+    data that did not come from an archived import (seed data, imports made
+    before archiving existed) is kept. A day shared with an import that has
+    no archive would lose that import's share, so unless force=True this
+    refuses to run while any completed import has no archive. Rebuilt days
+    all land in the hot table; the next tiering run moves old ones back out.
+    """
+    started = time.time()
+    imports = CSVImport.query.filter(
+        CSVImport.status == 'Completed',
+        CSVImport.duplicate_of_id.is_(None)
+    ).order_by(CSVImport.id).all()
+
+    missing = [csv_import.id for csv_import in imports if not chunk_files(csv_import.archive_path)]
+    if missing and not force:
+        return {'success': False, 'error': f'Imports without an archive: {missing}', 'missing': missing}
+
+    try:
+        parts = []
+        for csv_import in imports:
+            parts.extend(read_import(csv_import))
+
+        counts = {'rows_processed': 0, 'rows_failed': 0, 'campaign_ids': set(), 'dates': set()}
+        days_replaced = 0
+        if parts:
+            frame = frame_parsing.preaggregate(pd.concat(parts, ignore_index=True))
+            days_replaced = clear_covered_days(covered_days(frame))
+            counts = bulk_ingest.ingest_frame(frame)
+        # Totals only: the rollups of every client are rebuilt right after
+        bulk_ingest.rollup_campaign_totals(counts['campaign_ids'], set())
+        bulk_ingest.rebuild_metric_rollups()
+
+        db.session.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Replay failed: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+    elapsed = time.time() - started
+    logging.info(f"Replayed {len(imports) - len(missing)} imports ({counts['rows_processed']} rows, {days_replaced} days replaced) in {elapsed:.1f}s")
+    return {
+        'success': True,
+        'imports_replayed': len(imports) - len(missing),
+        'imports_skipped': missing,
+        'rows_processed': counts['rows_processed'],
+        'rows_failed': counts['rows_failed'],
+        'days_replaced': days_replaced,
+        'campaigns_updated': len(counts['campaign_ids']),
+        'seconds': round(elapsed, 2)
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    with app.app_context():
+        print(replay_imports(force='--force' in sys.argv))
@@ -0,0 +1,85 @@
+"""
+Background import queue
+Uploads enqueue their CSVImport on a local worker pool and return immediately;
+progress is reported from the import record, which each chunk commit updates
+"""
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app import app
+
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 2))
+
+# Created lazily so every (forked) web worker process gets its own threads
+_executor = None
+_executor_lock = threading.Lock()
+_active_imports = set()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix='csv-import')
+        return _executor
+
+
+def _run_import(import_id):
+    """Worker entry point: run one import inside its own app context and session"""
+    with app.app_context():
+        try:
+            from chunked_import import run_import
+            result = run_import(import_id)
+            if result['success']:
+                logging.info(f"Background import {import_id} completed: {result['rows_processed']} rows")
+            else:
+                logging.error(f"Background import {import_id} failed: {result['error']}")
+        except Exception as e:
+            logging.error(f"Background import {import_id} crashed: {str(e)}")
+        finally:
+            with _executor_lock:
+                _active_imports.discard(import_id)
+
+
+def enqueue_import(import_id):
+    """Queue an import for the worker pool; returns False if it is already queued or running"""
+    with _executor_lock:
+        if import_id in _active_imports:
+            return False
+        _active_imports.add(import_id)
+    get_executor().submit(_run_import, import_id)
+    logging.info(f"Queued import {import_id}")
+    return True
+
+
+def can_access(csv_import, user):
+    """Only the uploader sees an import; agency staff see every import, including the unowned cron ones"""
+    return user.is_agency_staff() or (csv_import.imported_by is not None and csv_import.imported_by == user.id)
+
+
+def import_status(csv_import):
+    """JSON-friendly progress for an import record"""
+    rows_done = csv_import.checkpoint_row or 0
+    rows_total = csv_import.rows_total or 0
+    if csv_import.status in ('Completed', 'Duplicate'):
+        percent = 100
+    elif rows_total:
+        percent = min(99, int(rows_done * 100 / rows_total))
+    else:
+        percent = 0
+
+    return {
+        'id': csv_import.id,
+        'filename': csv_import.filename,
+        'status': csv_import.status,
+        'rows_done': rows_done,
+        'rows_total': rows_total,
+        'rows_processed': csv_import.rows_processed or 0,
+        'rows_failed': csv_import.rows_failed or 0,
+        'percent': percent,
+        'finished': csv_import.status in ('Completed', 'Failed', 'Duplicate'),
+        'error': csv_import.error_message,
+        'duplicate_of': csv_import.duplicate_of_id
+    }
@@ -0,0 +1,114 @@
+"""
+Dry-run validation of import files
+Runs an importer's mapping plan and normalize step over every row with
+whole-column operations and reports what a real import would reject or zero
+out, resolving client emails with batched queries and writing nothing
+"""
+
+import os
+import time
+import logging
+import pandas as pd
+import bulk_ingest
+import frame_parsing
+
+# Bad rows and unknown clients listed in a report; the counts always cover the whole file
+SAMPLE_ERRORS = int(os.environ.get('VALIDATION_SAMPLE_ERRORS', 20))
+
+# Fields whose bad values reject the row; bad numeric values are imported as 0
+REQUIRED_FIELDS = ['client_email', 'campaign_name', 'date']
+
+
+def chunk_errors(chunk, frame, plan):
+    """{field: boolean Series} marking the rows of one chunk with an unusable value"""
+    errors = {field: frame[field].isna() for field in REQUIRED_FIELDS}
+    for field in frame_parsing.NUMERIC_FIELDS:
+        if field not in plan.column_map:
+            continue
+        raw = plan.column(chunk, field)
+        parsed = frame_parsing.parse_numeric(raw, plan.numeric_strip.get(field, ',$'))
+        errors[field] = parsed.isna() & frame_parsing.clean_text(raw).notna()
+    return errors
+
+
+def sample_rows(chunk, errors, bad, start_row, limit):
+    """Up to `limit` bad rows with their 1-based data row number, failed fields and raw values"""
+    samples = []
+    for position in bad.to_numpy().nonzero()[0][:limit]:
+        row = chunk.iloc[position]
+        samples.append({
+            'row': start_row + int(position) + 1,
+            'errors': [field for field, mask in errors.items() if mask.iat[position]],
+            'values': {str(column): (None if pd.isna(value) else str(value)) for column, value in row.items()}
+        })
+    return samples
+
+
+def validate_file(file_path, plan, normalize, **read_kwargs):
+    """
+    Dry-run an import: read the whole file in chunks, normalize each chunk
+    exactly as the importer would, and count errors per field. Unknown
+    clients are looked up once at the end. Returns the validation report.
+    """
+    started = time.time()
+    rows_total = 0
+    rows_rejected = 0
+    column_errors = dict.fromkeys(REQUIRED_FIELDS + [f for f in frame_parsing.NUMERIC_FIELDS if f in plan.column_map], 0)
+    samples = []
+    # Rows that pass every field check, per client email, to count rows of unknown clients
+    client_rows = pd.Series(dtype='int64')
+
+    for chunk in frame_parsing.iter_chunks(file_path, **read_kwargs):
+        frame = normalize(chunk)
+        errors = chunk_errors(chunk, frame, plan)
+
+        rejected = pd.Series(False, index=chunk.index)
+        for field in REQUIRED_FIELDS:
+            rejected |= errors[field]
+        bad = rejected.copy()
+        for field, mask in errors.items():
+            column_errors[field] += int(mask.sum())
+            bad |= mask
+
+        if len(samples) < SAMPLE_ERRORS and bad.any():
+            samples.extend(sample_rows(chunk, errors, bad, rows_total, SAMPLE_ERRORS - len(samples)))
+
+        counts = frame.loc[~rejected.to_numpy(), 'client_email'].value_counts()
+        client_rows = client_rows.add(counts, fill_value=0)
+        rows_total += len(chunk)
+        rows_rejected += int(rejected.sum())
+
+    known = bulk_ingest.resolve_users(client_rows.index.tolist())
+    unknown = client_rows[~client_rows.index.isin(list(known))]
+    unknown_rows = int(unknown.sum())
+    rows_rejected += unknown_rows
+
+    report = {
+        'success': True,
+        'valid': rows_rejected == 0 and not any(column_errors.values()),
+        'rows_total': rows_total,
+        'rows_valid': rows_total - rows_rejected,
+        'rows_rejected': rows_rejected,
+        'column_errors': column_errors,
+        'sample_errors': samples,
+        'unknown_clients': sorted(str(email) for email in unknown.index)[:SAMPLE_ERRORS],
+        'unknown_client_count': len(unknown),
+        'unknown_client_rows': unknown_rows,
+        'column_map': plan.column_map,
+        'date_format': plan.date_format,
+        'seconds': round(time.time() - started, 2)
+    }
+    logging.info(f"Dry run of {os.path.basename(file_path)}: {rows_total} rows, {rows_rejected} would be rejected")
+    return report
+
+
+def summary(report):
+    """One-line description of a report for flash messages and logs"""
+    if not report['success']:
+        return report['error']
+    problems = [f"{count} bad {field}" for field, count in report['column_errors'].items() if count]
+    if report['unknown_client_count']:
+        problems.append(f"{report['unknown_client_count']} unknown clients")
+    if not problems:
+        return f"All {report['rows_total']} rows are valid"
+    return f"{report['rows_rejected']} of {report['rows_total']} rows would be rejected ({', '.join(problems)})"
@@ -0,0 +1,56 @@
+"""
+Read side of the per-client metric rollups
+Trends for dashboards and chart APIs are read from MetricRollup (one row per
+client, platform and day/week/month) instead of summing raw CampaignData;
+bulk_ingest keeps the rollups in step with every import
+"""
+
+from datetime import timedelta
+from sqlalchemy import func
+from app import db
+from models import MetricRollup
+
+GRANULARITIES = ['day', 'week', 'month']
+
+
+def period_start(day, granularity):
+    """First day of the period containing `day`"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def trend(user_id, start_date, end_date, granularity='day', platform=None):
+    """
+    Metrics per period between two dates for one client, summed across
+    platforms unless one is given. Week and month buckets are whole periods:
+    the first bucket is the one containing start_date.
+    """
+    query = db.session.query(
+        MetricRollup.period_start,
+        func.sum(MetricRollup.impressions),
+        func.sum(MetricRollup.clicks),
+        func.sum(MetricRollup.spent),
+        func.sum(MetricRollup.reach)
+    ).filter(
+        MetricRollup.user_id == user_id,
+        MetricRollup.granularity == granularity,
+        MetricRollup.period_start >= period_start(start_date, granularity),
+        MetricRollup.period_start <= end_date
+    )
+    if platform:
+        query = query.filter(MetricRollup.platform == platform)
+
+    rows = query.group_by(MetricRollup.period_start).order_by(MetricRollup.period_start).all()
+    return [
+        {
+            'period': period.strftime('%Y-%m-%d'),
+            'impressions': int(impressions or 0),
+            'clicks': int(clicks or 0),
+            'spent': float(spent or 0.0),
+            'reach': int(reach or 0)
+        }
+        for period, impressions, clicks, spent, reach in rows
+    ]
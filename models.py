@@ -1,5 +1,6 @@
+import secrets
 from datetime import datetime
-from app import db
+from app import app, db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -15,23 +16,56 @@ class User(UserMixin, db.Model):
     company_name = db.Column(db.String(100), nullable=True)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped by every import that changes this client's campaigns; keys the view cache
+    data_version = db.Column(db.Integer, default=0)
     
     # Relationships
     campaigns = db.relationship('Campaign', backref='client', lazy=True)
     
+    # Hashes starting with this never match a password (accounts awaiting an invite)
+    UNUSABLE_PASSWORD_PREFIX = '!'
+    
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
     
+    @classmethod
+    def unusable_password_hash(cls):
+        """A cheap placeholder credential for provisioned accounts; no hashing involved"""
+        return cls.UNUSABLE_PASSWORD_PREFIX + secrets.token_urlsafe(24)
+    
+    def set_unusable_password(self):
+        self.password_hash = self.unusable_password_hash()
+    
+    def has_usable_password(self):
+        return not self.password_hash.startswith(self.UNUSABLE_PASSWORD_PREFIX)
+    
     def check_password(self, password):
+        if not self.has_usable_password():
+            return False
         return check_password_hash(self.password_hash, password)
     
+    def is_agency_staff(self):
+        return self.email.lower() in app.config['AGENCY_STAFF_EMAILS']
+    
     def get_full_name(self):
         if self.first_name and self.last_name:
             return f"{self.first_name} {self.last_name}"
         return self.username
 
+# Campaign columns the reports page sorts on; each has a (user_id, column, id)
+# index so every keyset-paginated page is an index range scan
+REPORT_SORT_COLUMNS = [
+    'created_at', 'name', 'platform', 'status', 'budget', 'spent', 'impressions',
+    'clicks', 'reach', 'ctr', 'cpm', 'cpc', 'cpv', 'cpa'
+]
+
 class Campaign(db.Model):
     __tablename__ = 'campaigns'
+    __table_args__ = (
+        # One campaign per client, platform and name; importers rely on it for race-free creation
+        db.UniqueConstraint('user_id', 'platform', 'name', name='uq_campaigns_user_platform_name'),
+        *[db.Index(f'ix_campaigns_user_{column}', 'user_id', column, 'id') for column in REPORT_SORT_COLUMNS]
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -61,42 +95,42 @@ class Campaign(db.Model):
             return min(100, (self.spent / self.budget) * 100)
         return 0
     
+    def to_dict(self):
+        """Column values plus remaining budget, detached from the session (safe to cache)"""
+        values = {column.name: getattr(self, column.name) for column in self.__table__.columns}
+        values['remaining_budget'] = self.get_remaining_budget()
+        return values
+    
+    @staticmethod
+    def derive_metrics(impressions, clicks, spent, reach):
+        """Derived CTR/CPC/CPM/CPV/CPA for the given totals"""
+        return {
+            # CTR (Click-Through Rate)
+            'ctr': (clicks / impressions) * 100 if impressions > 0 else 0.0,
+            # CPC (Cost Per Click)
+            'cpc': spent / clicks if clicks > 0 else 0.0,
+            # CPM (Cost Per Mille - Cost per 1000 impressions)
+            'cpm': (spent / impressions) * 1000 if impressions > 0 else 0.0,
+            # CPV (Cost Per View) - using reach as views proxy
+            'cpv': spent / reach if reach > 0 else 0.0,
+            # CPA (Cost Per Acquisition) - using clicks as conversion proxy
+            'cpa': spent / clicks if clicks > 0 else 0.0
+        }
+
     def calculate_metrics(self):
         """Calculate and update all marketing metrics"""
-        # CTR (Click-Through Rate)
-        if self.impressions > 0:
-            self.ctr = (self.clicks / self.impressions) * 100
-        else:
-            self.ctr = 0.0
-        
-        # CPC (Cost Per Click)
-        if self.clicks > 0:
-            self.cpc = self.spent / self.clicks
-        else:
-            self.cpc = 0.0
-        
-        # CPM (Cost Per Mille - Cost per 1000 impressions)
-        if self.impressions > 0:
-            self.cpm = (self.spent / self.impressions) * 1000
-        else:
-            self.cpm = 0.0
-        
-        # CPV (Cost Per View) - using reach as views proxy
-        if self.reach > 0:
-            self.cpv = self.spent / self.reach
-        else:
-            self.cpv = 0.0
-        
-        # CPA (Cost Per Acquisition) - using clicks as conversion proxy
-        if self.clicks > 0:
-            self.cpa = self.spent / self.clicks
-        else:
-            self.cpa = 0.0
+        metrics = self.derive_metrics(self.impressions or 0, self.clicks or 0, self.spent or 0.0, self.reach or 0)
+        for name, value in metrics.items():
+            setattr(self, name, value)
         
         return self.ctr
 
 class CampaignData(db.Model):
     __tablename__ = 'campaign_data'
+    __table_args__ = (
+        # One row per campaign and day; imports upsert into it with ON CONFLICT
+        db.UniqueConstraint('campaign_id', 'date', name='uq_campaign_data_campaign_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False)
@@ -110,6 +144,40 @@ class CampaignData(db.Model):
     # Relationships
     campaign = db.relationship('Campaign', backref='daily_data')
 
+class CampaignDataArchive(db.Model):
+    __tablename__ = 'campaign_data_archive'
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'year', name='uq_campaign_data_archive_campaign_year'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    days = db.Column(db.Integer, default=0)  # Days of the year that have data
+    impressions = db.Column(db.BigInteger, default=0)  # Year totals, so campaign totals need no unpacking
+    clicks = db.Column(db.BigInteger, default=0)
+    spent = db.Column(db.Float, default=0.0)
+    reach = db.Column(db.BigInteger, default=0)  # Highest daily reach
+    data = db.Column(db.LargeBinary, nullable=False)  # Packed per-day arrays, see data_tiering.pack_year
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class MetricRollup(db.Model):
+    __tablename__ = 'metric_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'platform', 'granularity', 'period_start', name='uq_metric_rollups_period'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    platform = db.Column(db.String(50), nullable=False)
+    granularity = db.Column(db.String(10), nullable=False)  # day, week, month
+    period_start = db.Column(db.Date, nullable=False)  # The day, the Monday of the week or the 1st of the month
+    impressions = db.Column(db.BigInteger, default=0)
+    clicks = db.Column(db.BigInteger, default=0)
+    spent = db.Column(db.Float, default=0.0)
+    reach = db.Column(db.BigInteger, default=0)  # Sum of daily reach
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class CSVImport(db.Model):
     __tablename__ = 'csv_imports'
     
@@ -119,13 +187,48 @@ class CSVImport(db.Model):
     status = db.Column(db.String(50), default='Pending')  # Pending, Processing, Completed, Failed
     rows_processed = db.Column(db.Integer, default=0)
     rows_failed = db.Column(db.Integer, default=0)
+    rows_total = db.Column(db.Integer, default=0)  # Data rows in the file, for progress reporting
+    checkpoint_row = db.Column(db.Integer, default=0)  # Data rows already committed, used to resume
+    import_type = db.Column(db.String(50), default='client')  # client, agency, agency_auto
+    platform = db.Column(db.String(50), nullable=True)
+    detected_format = db.Column(db.Text)  # JSON from csv_sniffer: encoding, delimiter, quoting, preamble
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of the uploaded file
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('csv_imports.id'), nullable=True)
+    archive_path = db.Column(db.String(500), nullable=True)  # Directory of normalized .npz chunks for replay
     error_message = db.Column(db.Text)
     imported_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     completed_at = db.Column(db.DateTime)
     
     # Relationships
     user = db.relationship('User', backref='csv_imports')
+    duplicate_of = db.relationship('CSVImport', remote_side=[id])
+
+class ImportSchema(db.Model):
+    __tablename__ = 'import_schemas'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(64), unique=True, nullable=False)  # Hash of importer, mapping rules and header row
+    importer = db.Column(db.String(50), nullable=False)  # client, agency, agency_auto
+    header = db.Column(db.Text)  # JSON list of the original column names
+    plan = db.Column(db.Text, nullable=False)  # JSON mapping plan: platform, column map, date format, numeric cleaning
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ChunkedUpload(db.Model):
+    __tablename__ = 'chunked_uploads'
+    
+    id = db.Column(db.String(32), primary_key=True)  # Random hex token used in the upload URL
+    filename = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)  # Bytes the client announced
+    import_type = db.Column(db.String(20), default='client')  # client, agency
+    platform = db.Column(db.String(50), nullable=True)
+    status = db.Column(db.String(20), default='Uploading')  # Uploading, Complete
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    import_id = db.Column(db.Integer, db.ForeignKey('csv_imports.id'), nullable=True)  # Set once the file is assembled
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class SystemSettings(db.Model):
     __tablename__ = 'system_settings'
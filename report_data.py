@@ -0,0 +1,125 @@
+"""
+Reports page queries
+One page of a client's campaigns at a time with keyset pagination: the
+cursor is the (sort value, id) of the last row shown and the next page is
+the rows after it in the (user_id, column, id) index, so deep pages cost the
+same as the first. Results are plain values so view_cache can keep them.
+"""
+
+import os
+import json
+import base64
+from datetime import datetime
+from sqlalchemy import tuple_
+from app import db
+from models import Campaign, REPORT_SORT_COLUMNS
+
+# Campaign rows per reports page, and the most a JSON client may ask for
+REPORT_PAGE_SIZE = int(os.environ.get('REPORT_PAGE_SIZE', 50))
+MAX_REPORT_PAGE_SIZE = 500
+
+# URL sort keys; anything in REPORT_SORT_COLUMNS is accepted by its column name too
+SORT_ALIASES = {'created': 'created_at', 'spend': 'spent'}
+
+STATUSES = ['Pending', 'In-Progress', 'Active', 'Completed']
+
+
+def sort_column(sort):
+    """The Campaign column name for a sort key, or None"""
+    sort = SORT_ALIASES.get(sort, sort)
+    return sort if sort in REPORT_SORT_COLUMNS else None
+
+
+def encode_cursor(value, campaign_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, campaign_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, column):
+    """(sort value, id) from a cursor; ValueError when it is malformed"""
+    try:
+        value, campaign_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if column == 'created_at':
+            value = datetime.fromisoformat(value)
+        return value, int(campaign_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def platforms(user_id):
+    """Platforms the client has campaigns on (an index-only scan of the unique constraint)"""
+    rows = db.session.query(Campaign.platform).filter(Campaign.user_id == user_id).distinct().order_by(Campaign.platform).all()
+    return [platform for platform, in rows]
+
+
+def report_page(user_id, sort='created_at', order='desc', platform=None, status=None, name=None,
+                after=None, before=None, per_page=REPORT_PAGE_SIZE):
+    """
+    One page of campaigns with cursors for the neighbouring pages. `after`
+    continues past a next_cursor, `before` goes back from a prev_cursor.
+    Raises ValueError for an unknown sort key or a malformed cursor.
+    """
+    column_name = sort_column(sort)
+    if column_name is None:
+        raise ValueError(f"Cannot sort by {sort}")
+    column = getattr(Campaign, column_name)
+    descending = order == 'desc'
+    per_page = max(1, min(per_page, MAX_REPORT_PAGE_SIZE))
+
+    query = db.session.query(Campaign).filter(Campaign.user_id == user_id)
+    if platform and platform != 'All':
+        query = query.filter(Campaign.platform == platform)
+    if status:
+        query = query.filter(Campaign.status == status)
+    if name:
+        query = query.filter(Campaign.name.ilike(f"%{name}%"))
+
+    # Walking backwards from `before` scans the index in the opposite direction
+    backwards = bool(before)
+    scan_descending = descending != backwards
+    cursor = before or after
+    if cursor:
+        key = tuple_(column, Campaign.id)
+        value = tuple_(*decode_cursor(cursor, column_name))
+        query = query.filter(key < value if scan_descending else key > value)
+    if scan_descending:
+        query = query.order_by(column.desc(), Campaign.id.desc())
+    else:
+        query = query.order_by(column.asc(), Campaign.id.asc())
+
+    rows = query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    first = encode_cursor(getattr(rows[0], column_name), rows[0].id) if rows else None
+    last = encode_cursor(getattr(rows[-1], column_name), rows[-1].id) if rows else None
+    if backwards:
+        prev_cursor, next_cursor = (first if more else None), last
+    else:
+        prev_cursor, next_cursor = (first if after else None), (last if more else None)
+
+    return {
+        'campaigns': [campaign.to_dict() for campaign in rows],
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+        'sort': column_name,
+        'order': 'desc' if descending else 'asc',
+        'per_page': per_page
+    }
+
+
+def report_context(user_id, platform='All', status=None, name=None, sort='created_at', order='desc',
+                   after=None, before=None, per_page=REPORT_PAGE_SIZE):
+    """Template variables for the reports page"""
+    page = report_page(user_id, sort, order, platform, status, name, after, before, per_page)
+    return dict(
+        page,
+        platforms=platforms(user_id),
+        statuses=STATUSES,
+        current_platform=platform or 'All',
+        current_status=status or '',
+        search=name or ''
+    )
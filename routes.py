@@ -1,212 +1,311 @@
-import os
-from flask import render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import render_template, request, redirect, url_for, flash, jsonify, stream_with_context
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 from app import app, db
-from models import Campaign, CampaignData, CSVImport, User
-from csv_processor import process_csv_file
-import logging
+from models import Campaign, ChunkedUpload, CSVImport
+import bulk_ingest
+import campaign_series
+import chunked_upload
+import csv_processor
+import csv_sniffer
+import dashboard_data
+import event_stream
+import import_jobs
+import import_validation
+import metric_rollups
+import report_data
+import upload_store
+import view_cache
+import os
 
 @app.route('/')
 @login_required
 def dashboard():
     """Main dashboard view"""
-    # Get user's campaigns
-    campaigns = Campaign.query.filter_by(user_id=current_user.id).all()
-    
-    # Calculate summary metrics
-    total_impressions = sum(c.impressions for c in campaigns)
-    total_clicks = sum(c.clicks for c in campaigns)
-    total_reach = sum(c.reach for c in campaigns)
-    total_budget = sum(c.budget for c in campaigns)
-    total_spent = sum(c.spent for c in campaigns)
-    
-    # Calculate all key metrics
-    ctr = (total_clicks / total_impressions * 100) if total_impressions > 0 else 0
-    cpc = (total_spent / total_clicks) if total_clicks > 0 else 0
-    cpm = (total_spent / total_impressions * 1000) if total_impressions > 0 else 0
-    cpv = (total_spent / total_reach) if total_reach > 0 else 0
-    cpa = cpc  # Using CPC as CPA proxy for now
-    
-    # Get recent campaign data for charts (last month)
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=30)
-    
-    # Get daily data for charts
-    daily_data = db.session.query(CampaignData).join(Campaign).filter(
-        Campaign.user_id == current_user.id,
-        CampaignData.date >= start_date,
-        CampaignData.date <= end_date
-    ).order_by(CampaignData.date).all()
-    
-    # Group data by date
-    chart_data = {}
-    for data in daily_data:
-        date_str = data.date.strftime('%Y-%m-%d')
-        if date_str not in chart_data:
-            chart_data[date_str] = {'impressions': 0, 'clicks': 0}
-        chart_data[date_str]['impressions'] += data.impressions
-        chart_data[date_str]['clicks'] += data.clicks
-    
-    # Convert to lists for Chart.js
-    dates = sorted(chart_data.keys())
-    impressions_data = [chart_data[date]['impressions'] for date in dates]
-    clicks_data = [chart_data[date]['clicks'] for date in dates]
-    
-    # Get platform distribution
-    platform_stats = {}
-    for campaign in campaigns:
-        platform = campaign.platform
-        if platform not in platform_stats:
-            platform_stats[platform] = {
-                'campaigns': 0,
-                'budget': 0,
-                'spent': 0,
-                'impressions': 0,
-                'clicks': 0
-            }
-        platform_stats[platform]['campaigns'] += 1
-        platform_stats[platform]['budget'] += campaign.budget
-        platform_stats[platform]['spent'] += campaign.spent
-        platform_stats[platform]['impressions'] += campaign.impressions
-        platform_stats[platform]['clicks'] += campaign.clicks
-    
-    return render_template('dashboard.html',
-                         campaigns=campaigns,
-                         total_impressions=total_impressions,
-                         total_clicks=total_clicks,
-                         total_reach=total_reach,
-                         total_budget=total_budget,
-                         total_spent=total_spent,
-                         ctr=round(ctr, 2),
-                         cpc=round(cpc, 2),
-                         cpm=round(cpm, 2),
-                         cpa=round(cpa, 2),
-                         cpv=round(cpv, 2),
-                         chart_dates=dates,
-                         impressions_data=impressions_data,
-                         clicks_data=clicks_data,
-                         platform_stats=platform_stats)
+    # Totals, metrics and platform stats are aggregated in the database, then cached until the next import
+    page = request.args.get('page', 1, type=int)
+    context = view_cache.cached('dashboard', current_user, lambda: dashboard_data.dashboard_context(current_user.id, page), page, datetime.now().date())
+    return render_template('dashboard.html', metrics_etag=metrics_etag(current_user), **context)
+
+def metrics_etag(user):
+    """Changes when an import bumps the client's data version, or the chart window moves a day"""
+    return f'{user.id}-{user.data_version or 0}-{datetime.now().date():%Y%m%d}'
+
+@app.route('/api/dashboard/metrics')
+@login_required
+def dashboard_metrics():
+    """Dashboard KPIs and chart series as JSON; 304 while the ETag still matches"""
+    etag = metrics_etag(current_user)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        metrics = view_cache.cached('metrics', current_user, lambda: dashboard_data.dashboard_metrics(current_user.id), datetime.now().date())
+        response = jsonify(metrics)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/reports')
 @login_required
 def reports():
-    """Reports view with detailed campaign data"""
-    platform_filter = request.args.get('platform', 'All')
-    
-    # Base query for user's campaigns
-    query = Campaign.query.filter_by(user_id=current_user.id)
-    
-    # Apply platform filter
-    if platform_filter and platform_filter != 'All':
-        query = query.filter_by(platform=platform_filter)
-    
-    campaigns = query.order_by(Campaign.created_at.desc()).all()
-    
-    # Get available platforms for filter
-    platforms = db.session.query(Campaign.platform).filter_by(user_id=current_user.id).distinct().all()
-    platforms = [p[0] for p in platforms]
+    """Reports view with detailed campaign data, one keyset page at a time"""
+    args = report_args()
+    try:
+        # Cached per client and query until the next import
+        context = view_cache.cached('reports', current_user, lambda: report_data.report_context(current_user.id, **args), *sorted(args.items()))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('reports'))
+    return render_template('reports.html', **context)
+
+def report_args():
+    """Reports filters, sort and cursor from the query string"""
+    return {
+        'platform': request.args.get('platform', 'All'),
+        'status': request.args.get('status') or None,
+        'name': request.args.get('q', '').strip() or None,
+        'sort': request.args.get('sort', 'created_at'),
+        'order': 'asc' if request.args.get('order') == 'asc' else 'desc',
+        'after': request.args.get('after') or None,
+        'before': request.args.get('before') or None,
+        'per_page': request.args.get('per_page', report_data.REPORT_PAGE_SIZE, type=int)
+    }
+
+@app.route('/api/reports')
+@login_required
+def reports_api():
+    """JSON counterpart of the reports view: one page of campaigns plus next/prev page URLs"""
+    args = report_args()
+    try:
+        page = view_cache.cached('reports_api', current_user, lambda: report_data.report_page(current_user.id, **args), *sorted(args.items()))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
-    return render_template('reports.html',
-                         campaigns=campaigns,
-                         platforms=platforms,
-                         current_platform=platform_filter)
+    query = {key: request.args[key] for key in ('platform', 'status', 'q', 'sort', 'order', 'per_page') if request.args.get(key)}
+    return jsonify(dict(
+        page,
+        success=True,
+        next_url=url_for('reports_api', after=page['next_cursor'], **query) if page['next_cursor'] else None,
+        prev_url=url_for('reports_api', before=page['prev_cursor'], **query) if page['prev_cursor'] else None
+    ))
+
+def wants_json():
+    """True for fetch() uploads that asked for a JSON reply instead of a redirect"""
+    return request.accept_mimetypes.best == 'application/json'
+
+def upload_response(success, message, category, redirect_to, csv_import=None):
+    """Reply to an upload with JSON (import id and status URL) or a flash + redirect"""
+    if wants_json():
+        payload = {'success': success, 'message': message}
+        if csv_import is not None:
+            payload['import_id'] = csv_import.id
+            payload['status_url'] = url_for('import_status', import_id=csv_import.id)
+        return jsonify(payload), (202 if success else 400)
+    flash(message, category)
+    return redirect(redirect_to)
 
 @app.route('/upload_csv', methods=['POST'])
 @login_required
 def upload_csv():
     """Handle CSV file upload"""
     if 'file' not in request.files:
-        flash('No file selected', 'error')
-        return redirect(url_for('dashboard'))
+        return upload_response(False, 'No file selected', 'error', url_for('dashboard'))
     
     file = request.files['file']
     if file.filename == '':
-        flash('No file selected', 'error')
-        return redirect(url_for('dashboard'))
+        return upload_response(False, 'No file selected', 'error', url_for('dashboard'))
     
-    if file and file.filename.lower().endswith('.csv'):
-        filename = secure_filename(file.filename)
-        # Add timestamp to filename to avoid conflicts
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-        filename = timestamp + filename
-        
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        
-        # Ensure upload directory exists
-        os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
-        
-        file.save(filepath)
-        
-        # Create CSV import record
-        csv_import = CSVImport(
-            filename=filename,
-            file_path=filepath,
-            imported_by=current_user.id,
-            status='Pending'
-        )
-        db.session.add(csv_import)
-        db.session.commit()
-        
-        # Process the CSV file
-        try:
-            result = process_csv_file(filepath, current_user.id, csv_import.id)
-            if result['success']:
-                flash(f'CSV imported successfully! Processed {result["rows_processed"]} rows.', 'success')
-            else:
-                flash(f'CSV import failed: {result["error"]}', 'error')
-        except Exception as e:
-            logging.error(f"Error processing CSV: {str(e)}")
-            flash(f'Error processing CSV: {str(e)}', 'error')
-    else:
-        flash('Please upload a valid CSV file', 'error')
+    if not csv_sniffer.is_csv_file(file.filename):
+        return upload_response(False, 'Please upload a CSV file (.csv, .csv.gz or .zip)', 'error', url_for('dashboard'))
     
-    return redirect(url_for('dashboard'))
+    filename = secure_filename(file.filename)
+    
+    # Store by content hash; identical re-uploads share one copy
+    content_hash, filepath = upload_store.save_upload(file)
+    message, category, csv_import = upload_store.queue_upload(
+        filename, content_hash, filepath, 'client', imported_by=current_user.id
+    )
+    return upload_response(True, message, category, url_for('dashboard'), csv_import)
 
-@app.route('/refresh_data', methods=['POST'])
+@app.route('/upload_csv/validate', methods=['POST'])
 @login_required
-def refresh_data():
-    """Manual data refresh endpoint"""
+def validate_csv():
+    """Dry-run a client CSV and return the validation report without importing it"""
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'success': False, 'valid': False, 'error': 'No file selected'}), 400
+    if not csv_sniffer.is_csv_file(file.filename):
+        return jsonify({'success': False, 'valid': False, 'error': 'Please upload a CSV file (.csv, .csv.gz or .zip)'}), 400
+    
+    temp_path = upload_store.save_temporary(file)
+    try:
+        report = csv_processor.dry_run_csv(temp_path)
+    finally:
+        os.remove(temp_path)
+    report['filename'] = secure_filename(file.filename)
+    report['message'] = import_validation.summary(report)
+    return jsonify(report), 200 if report['success'] else 400
+
+@app.route('/uploads', methods=['POST'])
+@login_required
+def start_chunked_upload():
+    """Begin a resumable upload for exports too large for a single request"""
+    data = request.get_json(silent=True) or request.form
+    filename = secure_filename(data.get('filename', ''))
+    import_type = data.get('import_type', 'client')
+    platform = data.get('platform') or None
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+    
+    if not csv_sniffer.is_csv_file(filename):
+        return jsonify({'success': False, 'message': 'Please upload a CSV file (.csv, .csv.gz or .zip)'}), 400
+    if size <= 0 or size > chunked_upload.MAX_UPLOAD_SIZE:
+        return jsonify({'success': False, 'message': 'Invalid file size'}), 400
+    if import_type not in ('client', 'agency') or (import_type == 'agency' and not platform):
+        return jsonify({'success': False, 'message': 'Invalid import type or platform'}), 400
+    
+    upload = chunked_upload.start_upload(filename, size, import_type, platform if import_type == 'agency' else None, current_user.id)
+    return jsonify(chunked_upload.upload_state(upload)), 201
+
+def get_chunked_upload(upload_id):
+    upload = ChunkedUpload.query.get(upload_id)
+    if upload is None or upload.user_id != current_user.id:
+        return None
+    return upload
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def chunked_upload_status(upload_id):
+    """Bytes received so far, so an interrupted upload can continue"""
+    upload = get_chunked_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(chunked_upload.upload_state(upload))
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """Append one chunk (raw request body) at ?offset=; the last chunk queues the import"""
+    upload = get_chunked_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Not found'}), 404
+    if upload.status == 'Complete':
+        return jsonify(chunked_upload.upload_state(upload)), 409
+    
+    offset = request.args.get('offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify({'error': 'Missing offset'}), 400
+    
     try:
-        # Here you would implement logic to refresh data from APIs
-        # For now, we'll just update the updated_at timestamp for user's campaigns
-        campaigns = Campaign.query.filter_by(user_id=current_user.id).all()
-        for campaign in campaigns:
-            campaign.updated_at = datetime.utcnow()
-        
-        db.session.commit()
-        flash('Data refreshed successfully!', 'success')
-        
-    except Exception as e:
-        logging.error(f"Error refreshing data: {str(e)}")
-        flash(f'Error refreshing data: {str(e)}', 'error')
+        received = chunked_upload.write_chunk(upload, offset, request.stream)
+    except ValueError as e:
+        state = chunked_upload.upload_state(upload)
+        state['error'] = str(e)
+        return jsonify(state), 409
     
+    if received < upload.total_size:
+        return jsonify(chunked_upload.upload_state(upload))
+    
+    message, category, csv_import = chunked_upload.finish_upload(upload)
+    state = chunked_upload.upload_state(upload)
+    state.update({'success': True, 'message': message})
+    return jsonify(state), 202
+
+@app.route('/imports/<int:import_id>/status')
+@login_required
+def import_status(import_id):
+    """Real progress of an import, polled by the upload pages"""
+    csv_import = CSVImport.query.get_or_404(import_id)
+    if not import_jobs.can_access(csv_import, current_user):
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(import_jobs.import_status(csv_import))
+
+@app.route('/events')
+@login_required
+def events():
+    """Server-sent events for the logged-in user: import progress and metrics-changed notices"""
+    # Each open stream holds a worker thread; past the per-process cap the client polls instead
+    stream = event_stream.open_stream(current_user.id)
+    if stream is None:
+        return jsonify({'error': 'Too many open event streams'}), 503
+    response = app.response_class(stream_with_context(stream), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Reverse proxies in front of ProxyFix must pass the stream through unbuffered
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/refresh_data', methods=['POST'])
+@login_required
+def refresh_data():
+    """Manual data refresh endpoint: drop the client's cached views so the dashboard is rebuilt from the database"""
+    bulk_ingest.bump_data_versions([current_user.id])
+    db.session.commit()
+    flash('Dashboard reloaded from the latest imported data.', 'success')
     return redirect(url_for('dashboard'))
 
 @app.route('/api/campaign/<int:campaign_id>/data')
 @login_required
 def get_campaign_data(campaign_id):
-    """API endpoint to get campaign data for charts"""
+    """API endpoint to get campaign data for charts: last 30 days by default, same options as /api/campaigns/series"""
     campaign = Campaign.query.filter_by(id=campaign_id, user_id=current_user.id).first_or_404()
+    try:
+        start_date, end_date, granularity, metrics = series_args(['impressions', 'clicks', 'spent'])
+        data = campaign_series.campaign_series(current_user.id, start_date, end_date, granularity, [campaign.id], metrics=metrics)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Get last 30 days of data
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=30)
-    
-    daily_data = CampaignData.query.filter_by(campaign_id=campaign_id).filter(
-        CampaignData.date >= start_date,
-        CampaignData.date <= end_date
-    ).order_by(CampaignData.date).all()
+    series = data['series'][0]
+    return jsonify(dict({metric: series[metric] for metric in metrics}, dates=data['periods']))
+
+def series_args(default_metrics=None):
+    """start/end (YYYY-MM-DD, default the last 30 days), granularity and metrics from the query string"""
+    end_date = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else datetime.now().date()
+    start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else end_date - timedelta(days=30)
+    metrics = [metric for metric in request.args.get('metrics', '').split(',') if metric] or default_metrics
+    return start_date, end_date, request.args.get('granularity', 'day'), metrics
+
+@app.route('/api/campaigns/series')
+@login_required
+def get_campaign_series():
+    """
+    Bucketed series for many campaigns in one request:
+    ?start=&end=&granularity=day|week|month&campaign_ids=1,2,3&platform=&metrics=impressions,ctr
+    """
+    try:
+        start_date, end_date, granularity, metrics = series_args()
+        campaign_ids = [int(value) for value in request.args.get('campaign_ids', '').split(',') if value.strip()]
+        data = campaign_series.campaign_series(
+            current_user.id, start_date, end_date, granularity,
+            campaign_ids=campaign_ids, platform=request.args.get('platform'), metrics=metrics
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(data)
+
+@app.route('/api/trend')
+@login_required
+def get_trend_data():
+    """API endpoint for the client's metric trend: ?days=, ?granularity=day|week|month, ?platform="""
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in metric_rollups.GRANULARITIES:
+        return jsonify({'error': f'granularity must be one of {", ".join(metric_rollups.GRANULARITIES)}'}), 400
+    days = min(max(request.args.get('days', 30, type=int), 1), 3660)
     
-    data = {
-        'dates': [d.date.strftime('%Y-%m-%d') for d in daily_data],
-        'impressions': [d.impressions for d in daily_data],
-        'clicks': [d.clicks for d in daily_data],
-        'spent': [float(d.spent) for d in daily_data]
-    }
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=days)
+    points = metric_rollups.trend(current_user.id, start_date, end_date, granularity, request.args.get('platform'))
     
-    return jsonify(data)
+    return jsonify({
+        'granularity': granularity,
+        'dates': [point['period'] for point in points],
+        'impressions': [point['impressions'] for point in points],
+        'clicks': [point['clicks'] for point in points],
+        'spent': [point['spent'] for point in points],
+        'reach': [point['reach'] for point in points]
+    })
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -2,6 +2,7 @@ import os
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from datetime import datetime
 from app import app, db
 from models import CSVImport, SystemSettings
@@ -23,6 +24,14 @@ def start_scheduler():
     # Add scheduled jobs
     add_scheduled_jobs()
     
+    # Pick up imports that were interrupted by a crash or restart
+    scheduler.add_job(
+        func=resume_stalled_imports,
+        id='resume_stalled_imports',
+        name='Resume Interrupted Imports',
+        replace_existing=True
+    )
+    
     # Start the scheduler
     scheduler.start()
     logging.info("Background scheduler started")
@@ -40,6 +49,30 @@ def add_scheduled_jobs():
         replace_existing=True
     )
     
+    # Near-real-time pickup of files dropped into the agency data directory;
+    # the daily run stays as a backstop and shares the watcher's folder lock
+    from folder_watcher import WATCH_INTERVAL, scan_agency_folder
+    if WATCH_INTERVAL > 0:
+        scheduler.add_job(
+            func=scan_agency_folder,
+            trigger=IntervalTrigger(seconds=WATCH_INTERVAL),
+            id='watch_agency_folder',
+            name='Agency Folder Watcher',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True
+        )
+    
+    # Nightly move of old daily rows into the compact yearly archive
+    scheduler.add_job(
+        func=scheduled_data_tiering,
+        trigger=CronTrigger(hour=3, minute=30),
+        id='daily_data_tiering',
+        name='Daily Data Tiering',
+        max_instances=1,
+        replace_existing=True
+    )
+    
     # Hourly data refresh job
     scheduler.add_job(
         func=scheduled_data_refresh,
@@ -62,6 +95,27 @@ def scheduled_csv_import():
         except Exception as e:
             logging.error(f"Agency CSV import failed: {str(e)}")
 
+def resume_stalled_imports():
+    """Resume imports left in Processing from their last checkpoint"""
+    with app.app_context():
+        try:
+            from chunked_import import resume_interrupted_imports
+            resume_interrupted_imports()
+            
+        except Exception as e:
+            logging.error(f"Resuming interrupted imports failed: {str(e)}")
+
+def scheduled_data_tiering():
+    """Scheduled function to archive daily data older than the hot horizon"""
+    with app.app_context():
+        try:
+            from data_tiering import archive_cold_data
+            archive_cold_data()
+            
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Data tiering failed: {str(e)}")
+
 def scheduled_data_refresh():
     """Scheduled function to refresh data from APIs"""
     with app.app_context():
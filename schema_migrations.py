@@ -0,0 +1,138 @@
+"""
+Lightweight schema migrations
+db.create_all() only creates missing tables, so columns, indexes and unique
+constraints added to existing models are applied here on startup
+"""
+
+import logging
+from sqlalchemy import UniqueConstraint, inspect, text
+from app import db
+
+
+def add_missing_columns():
+    """Add model columns that are missing from tables created by an older version"""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            logging.info(f"Added column {table.name}.{column.name}")
+
+
+def merge_duplicate_campaigns():
+    """
+    Fold campaigns sharing (user_id, platform, name) into the oldest one,
+    moving their daily rows. Returns the ids of the campaigns kept.
+    """
+    with db.engine.begin() as connection:
+        keepers = {campaign_id for campaign_id, in connection.execute(text(
+            'SELECT MIN(id) FROM campaigns GROUP BY user_id, platform, name HAVING COUNT(*) > 1'
+        ))}
+        if not keepers:
+            return set()
+        connection.execute(text(
+            'UPDATE campaign_data SET campaign_id = ('
+            ' SELECT MIN(keeper.id) FROM campaigns keeper JOIN campaigns c'
+            ' ON keeper.user_id = c.user_id AND keeper.platform = c.platform AND keeper.name = c.name'
+            ' WHERE c.id = campaign_data.campaign_id)'
+        ))
+        connection.execute(text(
+            'DELETE FROM campaigns WHERE id NOT IN (SELECT MIN(id) FROM campaigns GROUP BY user_id, platform, name)'
+        ))
+    logging.info(f"Merged campaigns sharing a client, platform and name in {len(keepers)} groups")
+    return keepers
+
+
+def merge_duplicate_daily_data():
+    """
+    Collapse CampaignData rows sharing (campaign_id, date) into one: summed
+    metrics, max reach. Returns the ids of the campaigns whose rows merged.
+    """
+    with db.engine.begin() as connection:
+        duplicates = connection.execute(text(
+            'SELECT campaign_id FROM campaign_data GROUP BY campaign_id, date HAVING COUNT(*) > 1'
+        )).all()
+        if not duplicates:
+            return set()
+        same_day = 'FROM campaign_data d WHERE d.campaign_id = campaign_data.campaign_id AND d.date = campaign_data.date'
+        connection.execute(text(
+            f'UPDATE campaign_data SET'
+            f' impressions = (SELECT SUM(COALESCE(impressions, 0)) {same_day}),'
+            f' clicks = (SELECT SUM(COALESCE(clicks, 0)) {same_day}),'
+            f' spent = (SELECT SUM(COALESCE(spent, 0)) {same_day}),'
+            f' reach = (SELECT MAX(COALESCE(reach, 0)) {same_day})'
+            f' WHERE id IN (SELECT MIN(id) FROM campaign_data GROUP BY campaign_id, date HAVING COUNT(*) > 1)'
+        ))
+        connection.execute(text(
+            'DELETE FROM campaign_data WHERE id NOT IN (SELECT MIN(id) FROM campaign_data GROUP BY campaign_id, date)'
+        ))
+    logging.info(f"Merged duplicate daily rows for {len(duplicates)} (campaign, date) pairs")
+    return {campaign_id for campaign_id, in duplicates}
+
+
+# Run before a unique constraint is added to an existing table, so the data satisfies it
+DEDUPLICATE = {
+    'campaigns': merge_duplicate_campaigns,
+    'campaign_data': merge_duplicate_daily_data
+}
+
+
+def add_missing_indexes():
+    """
+    Create model indexes and named unique constraints missing from existing
+    tables. Unique constraints become unique indexes (SQLite cannot add
+    constraints to a table), after merging any rows that would violate them.
+    Returns the ids of the campaigns whose rows were merged.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    merged = set()
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        existing.update(constraint['name'] for constraint in inspector.get_unique_constraints(table.name))
+
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                logging.info(f"Created index {index.name}")
+
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint) or not constraint.name or constraint.name in existing:
+                continue
+            if table.name in DEDUPLICATE:
+                merged.update(DEDUPLICATE[table.name]())
+            columns = ', '.join(column.name for column in constraint.columns)
+            with db.engine.begin() as connection:
+                connection.execute(text(f'CREATE UNIQUE INDEX {constraint.name} ON {table.name} ({columns})'))
+            logging.info(f"Created unique index {constraint.name}")
+
+    return merged
+
+
+def apply_migrations():
+    """Bring an existing database up to date with the models"""
+    import bulk_ingest
+    from models import CampaignData, MetricRollup
+
+    add_missing_columns()
+    merged = add_missing_indexes()
+    if merged:
+        # Merged campaigns and daily rows change the stored totals
+        bulk_ingest.rollup_campaign_totals(merged)
+        db.session.commit()
+
+    # Databases from before the rollup tables have daily data but no rollups yet
+    if db.session.query(MetricRollup.id).first() is None and db.session.query(CampaignData.id).first() is not None:
+        bulk_ingest.rebuild_metric_rollups()
+        db.session.commit()
@@ -0,0 +1,79 @@
+"""
+Header-fingerprint schema registry
+Caches a compiled mapping plan (platform, column map, date format and numeric
+cleaning) per distinct export header, so recurring Ads Manager and Google
+exports skip column detection and convert whole columns in one step
+"""
+
+import json
+import logging
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import ImportSchema
+import frame_parsing
+
+
+def cached_plans(importer):
+    """{fingerprint: plan JSON} of every registered plan, for worker processes that cannot query the database"""
+    rows = db.session.query(ImportSchema.fingerprint, ImportSchema.plan).filter_by(importer=importer).all()
+    return dict(rows)
+
+
+def _register_plan(importer, fingerprint, columns, plan):
+    """Insert a newly compiled plan; a concurrent import registering it first is not an error"""
+    try:
+        with db.session.begin_nested():
+            db.session.add(ImportSchema(
+                fingerprint=fingerprint,
+                importer=importer,
+                header=json.dumps([str(column) for column in columns]),
+                plan=plan.to_json()
+            ))
+    except IntegrityError:
+        return
+    logging.info(f"Registered mapping plan for new {importer} header ({len(columns)} columns)")
+
+
+def _touch(schema):
+    schema.hit_count = (schema.hit_count or 0) + 1
+    schema.last_used_at = datetime.utcnow()
+
+
+def save_plan(importer, fingerprint, columns, plan):
+    """Record a plan compiled outside resolve_plan (in a worker process): register it, or count the cache hit"""
+    schema = ImportSchema.query.filter_by(fingerprint=fingerprint).first()
+    if schema:
+        _touch(schema)
+    else:
+        _register_plan(importer, fingerprint, columns, plan)
+
+
+def resolve_plan(importer, columns, rules, build_mapping, load_sample):
+    """
+    Return the cached MappingPlan for this header, or build and register one.
+    build_mapping(columns) -> (column_map, platform) runs column detection;
+    load_sample() -> DataFrame is only read on a cache miss.
+    """
+    fingerprint = frame_parsing.header_fingerprint(importer, columns, rules)
+    schema = ImportSchema.query.filter_by(fingerprint=fingerprint).first()
+    if schema:
+        _touch(schema)
+        logging.info(f"Using cached mapping plan {schema.id} for {importer} header")
+        return frame_parsing.MappingPlan.from_json(schema.plan)
+
+    column_map, platform = build_mapping(columns)
+    plan = frame_parsing.MappingPlan.compile(column_map, load_sample(), platform)
+    _register_plan(importer, fingerprint, columns, plan)
+    return plan
+
+
+def preview_plan(importer, columns, rules, build_mapping, load_sample):
+    """resolve_plan() for dry runs: the cached plan or a freshly compiled one, without registering it"""
+    fingerprint = frame_parsing.header_fingerprint(importer, columns, rules)
+    schema = ImportSchema.query.filter_by(fingerprint=fingerprint).first()
+    if schema:
+        return frame_parsing.MappingPlan.from_json(schema.plan)
+
+    column_map, platform = build_mapping(columns)
+    return frame_parsing.MappingPlan.compile(column_map, load_sample(), platform)
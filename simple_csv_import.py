@@ -2,7 +2,10 @@ import csv
 import os
 from datetime import datetime
 from app import app, db
-from models import User, Campaign, CampaignData
+from models import User, Campaign
+from werkzeug.security import generate_password_hash
+import user_provisioning
+import bulk_ingest
 
 def import_sample_csv():
     """Import the sample CSV file and create users/campaigns"""
@@ -15,30 +18,20 @@ def import_sample_csv():
             
             # Read CSV file
             with open('sample_campaigns.csv', 'r') as file:
-                reader = csv.DictReader(file)
+                rows = list(csv.DictReader(file))
                 
-                users_created = set()
+                # Create all demo users in one insert; they share one password, hashed once
+                user_ids = user_provisioning.provision_users(
+                    [row['client_email'] for row in rows],
+                    password_hash=generate_password_hash('demo123')
+                )
                 campaigns_created = {}
+                daily_rows = []
                 
-                for row in reader:
-                    # Create user if not exists
-                    email = row['client_email']
-                    if email not in users_created:
-                        username = email.split('@')[0]
-                        user = User(
-                            username=username,
-                            email=email
-                        )
-                        user.set_password('demo123')
-                        db.session.add(user)
-                        db.session.flush()
-                        users_created.add(email)
-                        user_id = user.id
-                    else:
-                        user = User.query.filter_by(email=email).first()
-                        user_id = user.id
+                for row in rows:
+                    user_id = user_ids[row['client_email']]
                     
-                    # Create campaign if not exists
+                    # Create campaign if not exists (totals are rolled up after the loop)
                     campaign_key = f"{row['campaign_name']}_{user_id}_{row['platform']}"
                     if campaign_key not in campaigns_created:
                         campaign = Campaign(
@@ -46,42 +39,31 @@ def import_sample_csv():
                             platform=row['platform'],
                             status=row['status'],
                             budget=float(row['budget']),
-                            spent=float(row['spent']),
-                            impressions=int(row['impressions']),
-                            clicks=int(row['clicks']),
-                            reach=int(row['reach']),
                             user_id=user_id
                         )
-                        # Calculate metrics
-                        campaign.calculate_metrics()
                         db.session.add(campaign)
                         db.session.flush()
                         campaigns_created[campaign_key] = campaign.id
                         campaign_id = campaign.id
                     else:
                         campaign_id = campaigns_created[campaign_key]
-                        # Update campaign totals
-                        campaign = Campaign.query.get(campaign_id)
-                        campaign.spent += float(row['spent'])
-                        campaign.impressions += int(row['impressions'])
-                        campaign.clicks += int(row['clicks'])
-                        campaign.reach += int(row['reach'])
-                        campaign.calculate_metrics()
                     
                     # Add daily data
                     campaign_date = datetime.strptime(row['date'], '%Y-%m-%d').date()
-                    daily_data = CampaignData(
+                    daily_rows.append(dict(
                         campaign_id=campaign_id,
                         date=campaign_date,
                         impressions=int(row['impressions']),
                         clicks=int(row['clicks']),
                         spent=float(row['spent']),
                         reach=int(row['reach'])
-                    )
-                    db.session.add(daily_data)
+                    ))
                 
+                # Daily rows go in with one upsert, then one aggregation sets every campaign's totals
+                bulk_ingest.write_daily_rows(daily_rows)
+                bulk_ingest.rollup_campaign_totals(campaigns_created.values(), {row['date'] for row in daily_rows})
                 db.session.commit()
-                return True, f"Successfully imported data for {len(users_created)} users"
+                return True, f"Successfully imported data for {len(user_ids)} users"
                 
     except Exception as e:
         db.session.rollback()
@@ -7,11 +7,22 @@
 let refreshTimeout;
 let isRefreshing = false;
 
+// How often an open dashboard checks for new metrics when server-sent events are unavailable
+const METRICS_POLL_INTERVAL = 60 * 1000;
+
+// Shared server-sent event stream (see openEventStream)
+let eventSource = null;
+
+// Called once if the server refuses or drops the stream for good (see onEventStreamClosed)
+let eventStreamFallbacks = [];
+
+// Files above this size use the resumable chunked upload endpoint
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+
 // Initialize dashboard when DOM is loaded
 document.addEventListener('DOMContentLoaded', function() {
     initializeDashboard();
     setupEventListeners();
-    setupAutoRefresh();
 });
 
 /**
@@ -67,7 +78,9 @@ function setupEventListeners() {
     if (csvUpload) {
         csvUpload.addEventListener('change', function() {
             if (this.files.length > 0) {
-                showUploadProgress();
+                uploadCsvFile(document.getElementById('csv-upload-form'), function() {
+                    window.location.reload();
+                });
             }
         });
     }
@@ -126,15 +139,99 @@ function setupEventListeners() {
 }
 
 /**
- * Setup automatic data refresh
+ * Keep the dashboard metrics current: fetch them with the last ETag whenever
+ * the event stream says they changed (or, without a stream, on an interval).
+ * A 304 means nothing changed, otherwise only the cards and charts whose
+ * values differ are updated
  */
-function setupAutoRefresh() {
-    // Auto-refresh every 5 minutes
-    setInterval(() => {
-        if (!isRefreshing) {
-            refreshDataSilently();
+function startMetricsPolling(url, etag, chartData) {
+    let lastChart = JSON.stringify(chartData);
+
+    const fetchMetrics = () => {
+        if (isRefreshing) {
+            return;
         }
-    }, 5 * 60 * 1000);
+
+        isRefreshing = true;
+        fetch(url, {
+            headers: { 'If-None-Match': etag, 'Accept': 'application/json' },
+            credentials: 'same-origin'
+        })
+        .then(response => {
+            if (response.status === 304 || !response.ok) {
+                return null;
+            }
+            etag = response.headers.get('ETag') || etag;
+            return response.json();
+        })
+        .then(metrics => {
+            if (!metrics) {
+                return;
+            }
+            updateMetricValues(metrics);
+
+            const chart = {
+                dates: metrics.chart_dates,
+                impressions: metrics.impressions_data,
+                clicks: metrics.clicks_data
+            };
+            if (JSON.stringify(chart) !== lastChart) {
+                lastChart = JSON.stringify(chart);
+                initializeImpressionClickChart(chart);
+            }
+        })
+        .catch(error => {
+            console.error('Metrics refresh failed:', error);
+        })
+        .finally(() => {
+            isRefreshing = false;
+        });
+    };
+
+    const poll = () => {
+        setInterval(() => {
+            if (!document.hidden) {
+                fetchMetrics();
+            }
+        }, METRICS_POLL_INTERVAL);
+    };
+
+    const stream = openEventStream();
+    if (stream) {
+        stream.addEventListener('metrics', fetchMetrics);
+        // Catch up on anything published while the stream was reconnecting
+        stream.addEventListener('open', fetchMetrics);
+        onEventStreamClosed(poll);
+    } else {
+        poll();
+    }
+}
+
+/**
+ * The tab's one server-sent event stream, or null where EventSource is
+ * unavailable or the server turned the stream away
+ */
+function openEventStream() {
+    if (!eventSource && window.EventSource) {
+        eventSource = new EventSource('/events', { withCredentials: true });
+        eventSource.addEventListener('error', () => {
+            // A refused connection (the server's stream cap) closes instead of reconnecting
+            if (eventSource.readyState === EventSource.CLOSED) {
+                eventStreamFallbacks.splice(0).forEach(fallback => fallback());
+            }
+        });
+    }
+    if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+        return null;
+    }
+    return eventSource;
+}
+
+/**
+ * Run a fallback (usually polling) if the event stream closes for good
+ */
+function onEventStreamClosed(fallback) {
+    eventStreamFallbacks.push(fallback);
 }
 
 /**
@@ -173,52 +270,52 @@ function refreshData() {
 }
 
 /**
- * Silent data refresh without user feedback
+ * Write new metric values into the [data-metric] elements, animating the
+ * cards whose value changed
  */
-function refreshDataSilently() {
-    if (isRefreshing) {
-        return;
-    }
+function updateMetricValues(metrics) {
+    document.querySelectorAll('[data-metric]').forEach(element => {
+        const value = metrics[element.dataset.metric];
+        if (value === undefined) {
+            return;
+        }
 
-    isRefreshing = true;
-    
-    // Use fetch to silently refresh data
-    fetch('/refresh_data', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/x-www-form-urlencoded',
-        },
-        credentials: 'same-origin'
-    })
-    .then(response => {
-        if (response.ok) {
-            // Optionally update specific elements without full page reload
-            updateMetricValues();
+        const text = formatMetric(value, element.dataset.format);
+        if (element.textContent === text) {
+            return;
         }
-    })
-    .catch(error => {
-        console.error('Silent refresh failed:', error);
-    })
-    .finally(() => {
-        isRefreshing = false;
+        element.textContent = text;
+
+        const card = element.closest('.metric-card, .budget-card');
+        if (card) {
+            card.style.transition = 'transform 0.3s ease';
+            card.style.transform = 'scale(1.02)';
+            setTimeout(() => {
+                card.style.transform = 'scale(1)';
+            }, 300);
+        }
+    });
+
+    const spendShare = metrics.total_budget > 0 ? (metrics.total_spent / metrics.total_budget * 100) : 0;
+    document.querySelectorAll('[data-spend-progress]').forEach(bar => {
+        bar.style.width = `${spendShare}%`;
     });
 }
 
 /**
- * Update metric values on the dashboard
+ * Format a metric the way the dashboard template does
  */
-function updateMetricValues() {
-    // This would typically fetch new data and update the metrics
-    // For now, we'll just add a subtle animation to indicate refresh
-    const metricCards = document.querySelectorAll('.metric-card');
-    metricCards.forEach(card => {
-        card.style.transition = 'transform 0.3s ease';
-        card.style.transform = 'scale(1.02)';
-        
-        setTimeout(() => {
-            card.style.transform = 'scale(1)';
-        }, 300);
-    });
+function formatMetric(value, format) {
+    switch (format) {
+        case 'number':
+            return Math.trunc(value).toLocaleString('en-US');
+        case 'rounded':
+            return value.toLocaleString('en-US', { maximumFractionDigits: 0 });
+        case 'fixed2':
+            return value.toFixed(2);
+        default:
+            return String(value);
+    }
 }
 
 /**
@@ -235,23 +332,227 @@ function showUploadProgress() {
         </div>
     `;
     
-    showNotification(progressHtml, 'info', 0);
+    const existing = document.getElementById('upload-progress');
+    if (existing) {
+        existing.outerHTML = progressHtml;
+    } else {
+        showNotification(progressHtml, 'info', 0);
+    }
+}
+
+/**
+ * Update the upload progress bar and its caption
+ */
+function updateUploadProgress(percent, message, type = 'info') {
+    const progress = document.getElementById('upload-progress');
+    if (!progress) {
+        return;
+    }
     
-    // Simulate progress
-    let progress = 0;
-    const interval = setInterval(() => {
-        progress += Math.random() * 15;
-        if (progress > 90) progress = 90;
-        
-        const progressBar = document.querySelector('#upload-progress .progress-bar');
-        if (progressBar) {
-            progressBar.style.width = progress + '%';
+    const progressBar = progress.querySelector('.progress-bar');
+    if (percent !== null) {
+        progressBar.style.width = percent + '%';
+    }
+    if (type !== 'info') {
+        progressBar.classList.remove('progress-bar-animated');
+        progressBar.classList.add(`bg-${type}`);
+    }
+    progress.querySelector('small').textContent = message;
+}
+
+/**
+ * Upload a CSV form in the background and follow the import's real progress
+ */
+function uploadCsvFile(form, onFinished) {
+    showUploadProgress();
+    
+    const fileInput = form.querySelector('input[type="file"]');
+    const file = fileInput ? fileInput.files[0] : null;
+    let upload;
+    if (file && file.size > CHUNKED_UPLOAD_THRESHOLD) {
+        const platform = form.elements.platform ? form.elements.platform.value : null;
+        upload = uploadInChunks(file, form.dataset.importType || 'client', platform);
+    } else {
+        upload = fetch(form.action, {
+            method: 'POST',
+            body: new FormData(form),
+            headers: {
+                'Accept': 'application/json'
+            },
+            credentials: 'same-origin'
+        })
+        .then(response => response.json());
+    }
+    
+    upload
+    .then(data => {
+        if (!data.success) {
+            updateUploadProgress(100, data.message, 'danger');
+            return;
         }
-        
-        if (progress >= 90) {
-            clearInterval(interval);
+        updateUploadProgress(0, data.message);
+        if (!data.status_url) {
+            onFinished(null);
+            return;
+        }
+        watchImport(data.import_id, data.status_url, status => {
+            const rows = status.rows_total
+                ? `${formatNumber(status.rows_done)} / ${formatNumber(status.rows_total)} rows`
+                : status.status;
+            updateUploadProgress(status.percent, `${status.status}: ${rows}`);
+        }, status => {
+            if (status.status === 'Failed') {
+                updateUploadProgress(100, `Import failed: ${status.error}`, 'danger');
+            } else {
+                updateUploadProgress(100, `Import ${status.status.toLowerCase()}: ${formatNumber(status.rows_processed)} rows processed`, 'success');
+            }
+            onFinished(status);
+        });
+    })
+    .catch(error => {
+        console.error('Upload failed:', error);
+        updateUploadProgress(100, 'Upload failed', 'danger');
+    });
+}
+
+/**
+ * Send a large file in chunks, continuing a previous attempt of the same file if the server still has it
+ */
+function uploadInChunks(file, importType, platform) {
+    const key = `chunked-upload:${importType}:${platform}:${file.name}:${file.size}:${file.lastModified}`;
+    
+    const createUpload = () => fetch('/uploads', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        },
+        body: JSON.stringify({
+            filename: file.name,
+            size: file.size,
+            import_type: importType,
+            platform: platform
+        }),
+        credentials: 'same-origin'
+    })
+    .then(response => response.json())
+    .then(state => {
+        if (state.upload_id) {
+            localStorage.setItem(key, state.upload_id);
         }
-    }, 200);
+        return state;
+    });
+    
+    const savedId = localStorage.getItem(key);
+    const start = savedId
+        ? fetch(`/uploads/${savedId}`, { credentials: 'same-origin' })
+            .then(response => response.ok ? response.json() : createUpload())
+        : createUpload();
+    
+    return start
+    .then(state => sendChunks(file, state, 0))
+    .then(result => {
+        localStorage.removeItem(key);
+        return result;
+    });
+}
+
+/**
+ * Upload the remaining chunks from the server's offset; after a dropped connection, ask where to continue
+ */
+function sendChunks(file, state, retries) {
+    if (!state.upload_id) {
+        return { success: false, message: state.message || state.error || 'Upload failed' };
+    }
+    if (state.status === 'Complete') {
+        return Object.assign({ success: true, message: 'Upload complete' }, state);
+    }
+    
+    const end = Math.min(state.offset + state.chunk_size, file.size);
+    updateUploadProgress(Math.round(state.offset * 100 / file.size),
+        `Uploading ${formatNumber(Math.round(state.offset / 1048576))} / ${formatNumber(Math.round(file.size / 1048576))} MB`);
+    
+    return fetch(`${state.upload_url}?offset=${state.offset}`, {
+        method: 'PUT',
+        body: file.slice(state.offset, end),
+        headers: {
+            'Content-Type': 'application/octet-stream'
+        },
+        credentials: 'same-origin'
+    })
+    .then(response => response.json())
+    .then(next => next.success ? next : sendChunks(file, next, 0))
+    .catch(error => {
+        if (retries >= 5) {
+            throw error;
+        }
+        const delay = 1000 * Math.pow(2, retries);
+        return new Promise(resolve => setTimeout(resolve, delay))
+            .then(() => fetch(state.upload_url, { credentials: 'same-origin' }))
+            .then(response => response.json())
+            .then(latest => sendChunks(file, latest, retries + 1));
+    });
+}
+
+/**
+ * Follow an import until it finishes: pushed over the event stream when there
+ * is one (after one status read to catch up), polled otherwise
+ */
+function watchImport(importId, statusUrl, onProgress, onDone) {
+    const stream = openEventStream();
+    if (!stream) {
+        pollImportStatus(statusUrl, onProgress, onDone);
+        return;
+    }
+
+    let finished = false;
+    const handle = status => {
+        if (finished || status.id !== importId) {
+            return;
+        }
+        onProgress(status);
+        if (status.finished) {
+            finished = true;
+            stream.removeEventListener('import', listener);
+            onDone(status);
+        }
+    };
+    const listener = event => handle(JSON.parse(event.data));
+    stream.addEventListener('import', listener);
+    onEventStreamClosed(() => {
+        if (!finished) {
+            finished = true;
+            stream.removeEventListener('import', listener);
+            pollImportStatus(statusUrl, onProgress, onDone);
+        }
+    });
+
+    fetch(statusUrl, { credentials: 'same-origin' })
+    .then(response => response.json())
+    .then(handle)
+    .catch(error => {
+        console.error('Status read failed:', error);
+    });
+}
+
+/**
+ * Poll an import status URL until the import finishes
+ */
+function pollImportStatus(statusUrl, onProgress, onDone, interval = 1000) {
+    fetch(statusUrl, { credentials: 'same-origin' })
+    .then(response => response.json())
+    .then(status => {
+        onProgress(status);
+        if (status.finished) {
+            onDone(status);
+        } else {
+            setTimeout(() => pollImportStatus(statusUrl, onProgress, onDone, interval), interval);
+        }
+    })
+    .catch(error => {
+        console.error('Status poll failed:', error);
+        setTimeout(() => pollImportStatus(statusUrl, onProgress, onDone, interval), interval * 5);
+    });
 }
 
 /**
@@ -541,3 +842,7 @@ window.toggleSidebar = toggleSidebar;
 window.exportDashboard = exportDashboard;
 window.printDashboard = printDashboard;
 window.generateShareableLink = generateShareableLink;
+window.uploadCsvFile = uploadCsvFile;
+window.pollImportStatus = pollImportStatus;
+window.startMetricsPolling = startMetricsPolling;
+window.watchImport = watchImport;
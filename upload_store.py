@@ -0,0 +1,130 @@
+"""
+Content-addressed upload store
+Uploads are streamed to disk under their SHA-256, so byte-identical files share
+one copy and a re-upload is recognised without parsing it again
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+from werkzeug.utils import secure_filename
+from app import app, db
+from models import CSVImport
+import import_jobs
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def store_root():
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'store')
+
+
+def content_path(content_hash, extension):
+    return os.path.join(store_root(), content_hash[:2], content_hash + extension)
+
+
+def add_to_store(temp_path, content_hash, extension):
+    """Move a fully written temp file into the store, dropping it if the content is already there"""
+    path = content_path(content_hash, extension)
+    if os.path.exists(path):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+    return path
+
+
+def save_upload(file_storage):
+    """Stream an uploaded file into the store, hashing it on the way. Returns (content_hash, path)"""
+    extension = os.path.splitext(secure_filename(file_storage.filename))[1].lower() or '.csv'
+    os.makedirs(store_root(), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=store_root(), suffix='.part')
+
+    digest = hashlib.sha256()
+    with os.fdopen(fd, 'wb') as out:
+        for block in iter(lambda: file_storage.stream.read(BLOCK_SIZE), b''):
+            digest.update(block)
+            out.write(block)
+
+    content_hash = digest.hexdigest()
+    return content_hash, add_to_store(temp_path, content_hash, extension)
+
+
+def save_temporary(file_storage):
+    """Stream an upload to a temp file outside the store (dry runs); the caller removes it"""
+    extension = os.path.splitext(secure_filename(file_storage.filename))[1].lower() or '.csv'
+    os.makedirs(store_root(), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=store_root(), suffix='.dryrun' + extension)
+    with os.fdopen(fd, 'wb') as out:
+        for block in iter(lambda: file_storage.stream.read(BLOCK_SIZE), b''):
+            out.write(block)
+    return temp_path
+
+
+def find_original_import(content_hash, import_type, platform=None):
+    """The first import of this exact content through the same importer, if any"""
+    query = CSVImport.query.filter_by(content_hash=content_hash, import_type=import_type, duplicate_of_id=None)
+    if import_type == 'agency':
+        # The same export uploaded under a different platform creates different campaigns
+        query = query.filter_by(platform=platform)
+    return query.order_by(CSVImport.id).first()
+
+
+def record_duplicate(original, filename, imported_by=None):
+    """Log a re-upload that was skipped because its content was already imported"""
+    duplicate = CSVImport(
+        filename=filename,
+        file_path=original.file_path,
+        status='Duplicate',
+        import_type=original.import_type,
+        platform=original.platform,
+        content_hash=original.content_hash,
+        duplicate_of_id=original.id,
+        imported_by=imported_by,
+        rows_processed=0,
+        rows_failed=0,
+        completed_at=datetime.utcnow()
+    )
+    db.session.add(duplicate)
+    db.session.commit()
+    logging.info(f"Skipped duplicate upload {filename}: identical to import {original.id}")
+    return duplicate
+
+
+def queue_upload(filename, content_hash, file_path, import_type, platform=None, imported_by=None):
+    """
+    Hand a stored upload to the import pipeline: resume a failed import of the
+    same content, skip a completed one, or create and enqueue a new CSVImport.
+    Returns (message, flash category, CSVImport to report progress on); an
+    import started by someone else is never handed back, the uploader gets
+    their own Duplicate record instead.
+    """
+    original = find_original_import(content_hash, import_type, platform)
+    if original and original.status == 'Failed':
+        # Same file again after a failure: continue from the checkpoint
+        import_jobs.enqueue_import(original.id)
+        if original.imported_by == imported_by:
+            return f'This file failed before; resuming import #{original.id} in the background.', 'info', original
+        duplicate = record_duplicate(original, filename, imported_by)
+        return f'This file was already uploaded (import #{original.id}) and failed; resuming that import in the background.', 'info', duplicate
+    if original:
+        duplicate = record_duplicate(original, filename, imported_by)
+        return f'This file was already imported on {original.created_at.strftime("%b %d, %Y")} (import #{original.id}); skipped to avoid double-counting.', 'info', duplicate
+
+    csv_import = CSVImport(
+        filename=filename,
+        file_path=file_path,
+        imported_by=imported_by,
+        status='Pending',
+        import_type=import_type,
+        platform=platform,
+        content_hash=content_hash
+    )
+    db.session.add(csv_import)
+    db.session.commit()
+
+    # Process the file in the background
+    import_jobs.enqueue_import(csv_import.id)
+    return f'CSV uploaded and queued as import #{csv_import.id}.', 'success', csv_import
@@ -0,0 +1,103 @@
+"""
+Bulk client provisioning and account invites
+Creates every missing client account of an import in one insert with an
+unusable password, and issues signed invite / reset links so clients choose
+their own password instead of the importer hashing a temporary one per row
+"""
+
+import hmac
+import hashlib
+import logging
+from flask import url_for
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from sqlalchemy import insert
+from app import app, db
+from models import User
+import bulk_ingest
+
+# Invite and reset links stay valid for a week
+INVITE_MAX_AGE = 7 * 24 * 3600
+
+
+def _base_username(email):
+    return email.split('@')[0][:70] or 'client'
+
+
+def assign_usernames(emails):
+    """Unique usernames for new accounts: the email's local part, suffixed on clashes"""
+    wanted = {email: _base_username(email) for email in emails}
+
+    taken = set()
+    for batch in bulk_ingest.chunked(set(wanted.values())):
+        taken.update(name for name, in db.session.query(User.username).filter(User.username.in_(batch)).all())
+
+    usernames = {}
+    for email in sorted(wanted):
+        base = wanted[email]
+        username, suffix = base, 1
+        while username in taken:
+            # Clashes are rare; check each suffixed candidate against the table
+            suffix += 1
+            username = f"{base}{suffix}"
+            if User.query.filter_by(username=username).first():
+                taken.add(username)
+        taken.add(username)
+        usernames[email] = username
+    return usernames
+
+
+def provision_users(emails, password_hash=None):
+    """
+    Return {email: user_id} for every email, creating the missing accounts in
+    a single insert. New accounts get an unusable password unless a
+    precomputed password_hash is given (demo seeding), so no per-user hashing.
+    """
+    emails = {str(email).strip() for email in emails if email and str(email).strip()}
+    user_ids = bulk_ingest.resolve_users(emails)
+
+    missing = sorted(emails - set(user_ids))
+    if missing:
+        usernames = assign_usernames(missing)
+        db.session.execute(insert(User), [
+            {
+                'username': usernames[email],
+                'email': email,
+                'password_hash': password_hash or User.unusable_password_hash()
+            }
+            for email in missing
+        ])
+        user_ids.update(bulk_ingest.resolve_users(missing))
+        logging.info(f"Provisioned {len(missing)} client accounts")
+
+    return user_ids
+
+
+def _serializer():
+    return URLSafeTimedSerializer(app.secret_key, salt='account-invite')
+
+
+def _password_fingerprint(user):
+    """Keyed digest of the password hash: changes with the password, reveals nothing about it"""
+    return hmac.new(app.secret_key.encode(), user.password_hash.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def make_invite_token(user):
+    """Signed token for setting a password; it stops working once the password changes"""
+    return _serializer().dumps({'id': user.id, 'pw': _password_fingerprint(user)})
+
+
+def load_invite_token(token, max_age=INVITE_MAX_AGE):
+    """The user an invite / reset token belongs to, or None if it is invalid, expired or used"""
+    try:
+        data = _serializer().loads(token, max_age=max_age)
+    except (BadSignature, SignatureExpired):
+        return None
+
+    user = db.session.get(User, data.get('id'))
+    if user is None or not hmac.compare_digest(_password_fingerprint(user), str(data.get('pw', ''))):
+        return None
+    return user
+
+
+def invite_url(user):
+    return url_for('auth.set_password', token=make_invite_token(user), _external=True)
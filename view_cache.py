@@ -0,0 +1,55 @@
+"""
+In-process LRU cache for per-client view payloads
+Entries are keyed by client and the client's data_version, which bulk_ingest
+bumps in the same transaction as any import touching the client's campaigns.
+The version comes from the logged-in user row Flask-Login already loaded, so
+a hit runs no queries and can never return data older than that version;
+entries for superseded versions simply age out of the LRU.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# Cached payloads kept across all clients
+VIEW_CACHE_SIZE = int(os.environ.get('VIEW_CACHE_SIZE', 1024))
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+_counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def cached(kind, user, compute, *args):
+    """
+    The `kind` payload for a client (plus any extra key `args`), calling
+    compute() only on a miss. Payloads are shared between requests: callers
+    must not modify them.
+    """
+    key = (kind, user.id, user.data_version or 0) + args
+    with _lock:
+        if key in _entries:
+            _entries.move_to_end(key)
+            _counters['hits'] += 1
+            return _entries[key]
+        _counters['misses'] += 1
+
+    value = compute()
+    with _lock:
+        _entries[key] = value
+        _entries.move_to_end(key)
+        while len(_entries) > VIEW_CACHE_SIZE:
+            _entries.popitem(last=False)
+            _counters['evictions'] += 1
+    return value
+
+
+def stats():
+    """Hit/miss/eviction counters and the current size"""
+    with _lock:
+        return dict(_counters, size=len(_entries), max_size=VIEW_CACHE_SIZE)
+
+
+def clear():
+    """Drop every entry (counters are kept)"""
+    with _lock:
+        _entries.clear()